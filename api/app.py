@@ -1,34 +1,109 @@
-from flask import Flask, request, jsonify, send_from_directory, send_file
+from flask import Flask, Response, g, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import os
 import logging
 from functools import wraps
+import threading
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
 # Import database and business logic modules
-from db import init_db, get_all_products, get_user_by_name, get_user_by_id, add_to_cart, get_cart, clear_cart, update_user_points, get_product_by_id
-from recommender import find_greener_alternative, estimate_carbon_savings
-from gemini import get_gemini_reason
+from db import init_db, get_catalog_version, query_products, iter_products, get_user_by_name, add_to_cart, get_cart, get_cart_lines, get_cart_summary, clear_cart, award_points, get_product_by_id, get_pool_stats
+from recommender import ensure_scores_current, ensure_alternatives_current, find_greener_alternative, alternatives_report, estimate_carbon_savings, plan_batch_recommendations, summarize_batch_recommendations
+from validation import validate_json_data, parse_product_filters, parse_page_args, parse_alternative_args, parse_batch_request, product_page, DEFAULT_PAGE_SIZE
+from response_cache import response_cache, catalog_etag, variant_etag
+from static_assets import static_assets
+from gemini import (get_gemini_reason, get_gemini_reasons, get_reason_cache_stats, get_gemini_guard_stats,
+                    submit_reason_job, get_reason_job)
+import metrics
+import profiling
+import records
+
+class RecordJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that writes db.py records without building dicts"""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, records.Record):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        # jsonify's compact, key-sorted output is exactly what records.dumps writes
+        if kwargs == {'separators': (',', ':')} and self.sort_keys and self.ensure_ascii:
+            return records.dumps(obj, default=self.default)
+        return super().dumps(obj, **kwargs)
 
 # Initialize Flask app
-app = Flask(__name__, static_folder='static', static_url_path='')
+# The frontend build is served from memory by static_assets, not Flask's static route
+app = Flask(__name__, static_folder=None)
+app.json = RecordJSONProvider(app)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key-for-development')
 app.config['DEBUG'] = os.getenv('FLASK_DEBUG', 'false').lower() == 'true'
 
 # Configure CORS
 CORS(app, resources={r"/api/*": {"origins": "*"}})
 
+# Generate recommendation reasons in the background by default
+ASYNC_REASONS = os.getenv('ESG_ASYNC_REASONS', 'false').lower() == 'true'
+# Upper bound for long-polling /api/recommendation/<id>/reason
+MAX_REASON_WAIT = 30.0
+# Maximum number of products accepted by /api/recommendations/batch
+MAX_BATCH_ITEMS = int(os.getenv('ESG_MAX_BATCH_ITEMS', '200'))
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-print("✅ ESG Recommender Backend initialized successfully")
+# --- Request Metrics ---
+@app.before_request
+def start_request_metrics():
+    g.metrics_token = metrics.start_request()
+
+def _finish_request_metrics(status: int):
+    token = g.pop('metrics_token', None)
+    if token is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.finish_request(token, route, request.method, status)
+
+@app.after_request
+def record_request_metrics(response):
+    _finish_request_metrics(response.status_code)
+    return response
+
+@app.teardown_request
+def close_request_metrics(exc):
+    # Requests that raised never reach after_request
+    _finish_request_metrics(500)
 
-# Initialize database
-init_db()
+# --- Startup ---
+# Schema setup and rescoring run once, on the first request, not at import:
+# under the production gunicorn profile the master runs startup() before
+# forking and sets ESG_SCHEMA_READY so workers skip it entirely.
+_startup_lock = threading.Lock()
+_startup_done = False
+
+def startup():
+    """Create/migrate the schema, seed data and refresh stored scores"""
+    init_db()
+    ensure_scores_current()
+    ensure_alternatives_current()
+    static_assets.load()
+    print("✅ ESG Recommender Backend initialized successfully")
+
+@app.before_request
+def ensure_startup():
+    global _startup_done
+    if _startup_done:
+        return
+    with _startup_lock:
+        if not _startup_done:
+            if os.getenv('ESG_SCHEMA_READY') != '1':
+                startup()
+            _startup_done = True
 
 def handle_errors(f):
     """Decorator for consistent error handling"""
@@ -41,25 +116,67 @@ def handle_errors(f):
             return jsonify({'error': 'Internal server error'}), 500
     return decorated_function
 
-# Input validation helpers
-def validate_json_data(data, required_fields):
-    """Validate JSON request data"""
-    if not data:
-        return False, 'Missing JSON body'
+def catalog_cache_key():
+    """Normalized cache key for the current catalog request"""
+    args = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+    return f'{request.path}?{args}'
+
+def cached_catalog_response(build):
+    """
+    Serve a catalog response from the response cache, with ETag handling.
+    `build` returns (payload, status) and is only called on a cache miss;
+    only 200 responses are cached.
+    """
+    key = catalog_cache_key()
+    version = get_catalog_version()
+    accept_gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+
+    def not_modified(etag):
+        response_cache.record_not_modified()
+        response = Response(status=304)
+        response.headers['ETag'] = etag
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+    # The tag of the encoding this client most likely gets is checked before the
+    # cache lookup; a gzip tag only exists when the gzip body does
+    expected = variant_etag(catalog_etag(version, key), 'gzip' if accept_gzip else None)
+    if request.if_none_match.contains(expected.strip('"')):
+        return not_modified(expected)
     
-    for field in required_fields:
-        if field not in data:
-            return False, f'Missing required field: {field}'
+    entry = response_cache.get(key, version)
+    if entry is None:
+        payload, status = build()
+        if status != 200:
+            return jsonify(payload), status
+        entry = response_cache.put(key, version, app.json.dumps(payload, separators=(',', ':')).encode('utf-8') + b'\n')
     
-    return True, None
+    body, etag, encoding = entry.variant(accept_gzip)
+    if etag != expected and request.if_none_match.contains(etag.strip('"')):
+        return not_modified(etag)
+    response = Response(body, mimetype='application/json')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['ETag'] = etag
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 # --- API Routes ---
 
+def static_response(path: str):
+    """A frontend asset (or index.html for client-side routes) from the in-memory manifest"""
+    result = static_assets.respond(path, request.headers, request.method)
+    if result is None:
+        return jsonify({'error': 'Not found'}), 404
+    status, headers, body = result
+    return Response(body, status=status, headers=headers)
+
 @app.route('/', methods=['GET'])
 @handle_errors
 def serve_frontend():
     """Serve the React frontend"""
-    return send_file('static/index.html')
+    return static_response('')
 
 @app.route('/api/', methods=['GET'])
 @handle_errors
@@ -72,19 +189,20 @@ def api_root():
             'health': '/api/health',
             'products': '/api/products',
             'cart': '/api/cart',
-            'recommendation': '/api/recommendation'
+            'cart_summary': '/api/cart/summary',
+            'alternatives': '/api/alternatives/<product_id>',
+            'recommendation': '/api/recommendation',
+            'recommendations_batch': '/api/recommendations/batch',
+            'stats': '/api/stats',
+            'metrics': '/api/metrics'
         }
     })
 
 # Frontend routes (catch-all for React Router)
 @app.route('/<path:path>')
 def serve_frontend_routes(path):
-    """Serve frontend routes for React Router"""
-    # Check if it's a static file
-    if '.' in path and path.split('.')[-1] in ['js', 'css', 'png', 'jpg', 'ico', 'svg']:
-        return send_from_directory('static', path)
-    # Otherwise serve the React app
-    return send_file('static/index.html')
+    """Serve frontend assets, and index.html for React Router routes"""
+    return static_response(path)
 
 @app.route('/api/health', methods=['GET'])
 @handle_errors
@@ -92,12 +210,83 @@ def health_check():
     """Health check endpoint"""
     return jsonify({'status': 'ok', 'message': 'ESG Recommender API is running'})
 
+@app.route('/api/stats', methods=['GET'])
+@handle_errors
+def get_stats():
+    """Runtime statistics (database connection pool, caches, Gemini upstream guard)"""
+    return jsonify({
+        'db_pool': get_pool_stats(),
+        'reason_cache': get_reason_cache_stats(),
+        'gemini': get_gemini_guard_stats(),
+        'response_cache': response_cache.stats(),
+        'static_assets': static_assets.stats()
+    })
+
+@app.route('/api/metrics', methods=['GET'])
+@handle_errors
+def get_metrics():
+    """Latency histograms, per-request query counts and cache stats (Prometheus text format)"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/products', methods=['GET'])
 @handle_errors
 def get_products():
-    """Get all products with ESG information"""
-    products = get_all_products()
-    return jsonify(products)
+    """Get products with ESG information.
+
+    Supports filters (category, organic, packaging, min/max_carbon,
+    min/max_price), keyset pagination (limit, cursor) and NDJSON streaming
+    (format=ndjson). Without limit/cursor the full filtered list is returned.
+    """
+    filters, error_msg = parse_product_filters(request.args)
+    if error_msg:
+        return jsonify({'error': error_msg}), 400
+    
+    cursor, limit, error_msg = parse_page_args(request.args)
+    if error_msg:
+        return jsonify({'error': error_msg}), 400
+    
+    if request.args.get('format') == 'ndjson':
+        def generate():
+            for product in iter_products(filters, after_id=cursor, limit=limit):
+                yield records.dumps(product) + '\n'
+        return Response(generate(), mimetype='application/x-ndjson')
+    
+    def build():
+        if limit is None and cursor is None:
+            return query_products(filters), 200
+        page_size = limit or DEFAULT_PAGE_SIZE
+        # Fetch one extra row to know whether another page exists
+        return product_page(query_products(filters, after_id=cursor, limit=page_size + 1), page_size), 200
+    
+    return cached_catalog_response(build)
+
+@app.route('/api/products/<int:product_id>', methods=['GET'])
+@handle_errors
+def get_product(product_id):
+    """Get a single product"""
+    def build():
+        product = get_product_by_id(product_id)
+        if not product:
+            return {'error': 'Product not found'}, 404
+        return product, 200
+    
+    return cached_catalog_response(build)
+
+@app.route('/api/alternatives/<int:product_id>', methods=['GET'])
+@handle_errors
+def get_alternatives(product_id):
+    """Top-k greener alternatives, optionally within price and carbon budgets"""
+    options, error_msg = parse_alternative_args(request.args)
+    if error_msg:
+        return jsonify({'error': error_msg}), 400
+    
+    def build():
+        product = get_product_by_id(product_id)
+        if not product:
+            return {'error': 'Product not found'}, 404
+        return alternatives_report(product, **options), 200
+    
+    return cached_catalog_response(build)
 
 @app.route('/api/users/<name>', methods=['GET'])
 @handle_errors
@@ -117,6 +306,13 @@ def get_user_cart():
     cart_items = get_cart(user_id)
     return jsonify(cart_items)
 
+@app.route('/api/cart/summary', methods=['GET'])
+@handle_errors
+def get_user_cart_summary():
+    """Cart totals (items, price, carbon) with category and packaging breakdowns"""
+    user_id = request.args.get('user_id', default=1, type=int)
+    return jsonify(get_cart_summary(user_id))
+
 @app.route('/api/cart', methods=['POST'])
 @handle_errors
 def add_to_user_cart():
@@ -157,6 +353,7 @@ def get_recommendation():
         return jsonify({'error': error_msg}), 400
     
     product_id = data.get('product_id')
+    defer_reason = data.get('async', ASYNC_REASONS)
     
     # Get original product
     original_product = get_product_by_id(product_id)
@@ -171,15 +368,17 @@ def get_recommendation():
         carbon_saved = estimate_carbon_savings(original_product, alternative)
         points_awarded = int(carbon_saved * 10)  # 10 points per kg CO2 saved
         
-        # Get AI explanation
-        reason = get_gemini_reason(original_product, alternative)
+        # Get AI explanation (or start generating it in the background)
+        reason_id = None
+        if defer_reason:
+            reason = None
+            reason_id = submit_reason_job(original_product, alternative)
+        else:
+            reason = get_gemini_reason(original_product, alternative)
         
-        # Update user points (assuming user_id = 1 for demo)
+        # Award points atomically (assuming user_id = 1 for demo)
         user_id = 1
-        user = get_user_by_id(user_id)
-        if user:
-            new_points = user['points'] + points_awarded
-            update_user_points(user_id, new_points)
+        award_points(user_id, points_awarded)
         
         response = {
             'original': original_product,
@@ -188,11 +387,80 @@ def get_recommendation():
             'carbon_saved': carbon_saved,
             'points_awarded': points_awarded
         }
+        if reason_id:
+            response['reason_id'] = reason_id
+            response['reason_status'] = 'pending'
+            response['reason_url'] = f'/api/recommendation/{reason_id}/reason'
         
         return jsonify(response)
     else:
         return jsonify({'error': 'No greener alternative found'}), 404
 
+@app.route('/api/recommendations/batch', methods=['POST'])
+@handle_errors
+def get_batch_recommendations():
+    """Recommend greener alternatives for a list of products or a whole cart"""
+    product_ids, user_id, error_msg = parse_batch_request(request.get_json(silent=True))
+    if error_msg:
+        return jsonify({'error': error_msg}), 400
+    
+    if product_ids is not None:
+        lines = [{'product_id': pid, 'quantity': 1} for pid in product_ids]
+    else:
+        lines = get_cart_lines(user_id)
+    
+    if len(lines) > MAX_BATCH_ITEMS:
+        return jsonify({'error': f'At most {MAX_BATCH_ITEMS} products per batch'}), 400
+    
+    results, pairs = plan_batch_recommendations(lines)
+    # Explanations go out in batched prompts of up to REASON_BATCH_SIZE pairs each
+    payload = summarize_batch_recommendations(results, get_gemini_reasons(pairs))
+    award_points(user_id, payload['total_points_awarded'])
+    
+    return jsonify(payload)
+
+@app.route('/api/recommendation/<reason_id>/reason', methods=['GET'])
+@handle_errors
+def get_recommendation_reason(reason_id):
+    """Fetch a deferred recommendation reason (long-poll with ?wait=seconds)"""
+    wait = min(max(request.args.get('wait', default=0.0, type=float), 0.0), MAX_REASON_WAIT)
+    job = get_reason_job(reason_id, wait=wait)
+    if job is None:
+        return jsonify({'error': 'Reason not found'}), 404
+    
+    payload = {'reason_id': reason_id, 'status': job['status'], 'reason': job['reason']}
+    return jsonify(payload), (202 if job['status'] == 'pending' else 200)
+
+@app.route('/api/admin/profile', methods=['GET'])
+@handle_errors
+def get_profile_summary():
+    """Hot functions aggregated over the sampled request profiles.
+    ?route= narrows to one route, ?format=folded returns merged collapsed stacks."""
+    # Only exists with an admin token configured and profiling enabled
+    if not (profiling.ADMIN_TOKEN and profiling.enabled()):
+        return jsonify({'error': 'Not found'}), 404
+    if not profiling.is_admin_token(request.headers.get('X-Admin-Token')):
+        return jsonify({'error': 'Forbidden'}), 403
+
+    stacks = profiling.read_profiles(request.args.get('route'))
+    if request.args.get('format') == 'folded':
+        body = ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+        return Response(body, mimetype='text/plain')
+
+    limit = min(max(request.args.get('limit', default=20, type=int), 1), 200)
+    summary = profiling.hot_functions(stacks, limit)
+    summary.update({
+        'enabled': profiling.enabled(),
+        'rate': profiling.PROFILE_RATE,
+        'profiles': profiling.profile_count(),
+        'directory': profiling.PROFILE_DIR
+    })
+    return jsonify(summary)
+
+# Sample a fraction of requests (ESG_PROFILE_RATE / X-Profile); see profiling.py
+if profiling.enabled():
+    profiling.install(app)
+
 # --- Run Application ---
 
 # For Render.com and production
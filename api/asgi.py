@@ -0,0 +1,368 @@
+"""
+Async (ASGI) serving mode for the ESG Recommender API.
+
+Exposes the same routes as app.py, but SQLite access goes through the
+async_db executor and Gemini calls are awaited without blocking the loop,
+so a single process can keep hundreds of recommendations in flight.
+
+Run with:  cd api && uvicorn asgi:app --host 0.0.0.0 --port $PORT
+"""
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+
+load_dotenv()
+
+import async_db
+from db import iter_products
+from recommender import (ensure_scores_current, ensure_alternatives_current, find_greener_alternative,
+                         alternatives_report, estimate_carbon_savings, plan_batch_recommendations,
+                         summarize_batch_recommendations)
+from validation import (validate_json_data, parse_product_filters, parse_page_args, parse_alternative_args,
+                        parse_batch_request, product_page, DEFAULT_PAGE_SIZE)
+from response_cache import response_cache, catalog_etag, variant_etag
+from static_assets import static_assets
+from gemini import (get_gemini_reason_async, get_gemini_reasons, get_reason_cache_stats,
+                    get_gemini_guard_stats, submit_reason_job, get_reason_job)
+import metrics
+import records
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ASYNC_REASONS = os.getenv('ESG_ASYNC_REASONS', 'false').lower() == 'true'
+MAX_REASON_WAIT = 30.0
+REASON_POLL_INTERVAL = 0.1
+MAX_BATCH_ITEMS = int(os.getenv('ESG_MAX_BATCH_ITEMS', '200'))
+
+def dumps(payload) -> bytes:
+    # Same compact, key-sorted encoding as Flask's jsonify
+    return records.dumps(payload).encode('utf-8') + b'\n'
+
+def json_response(payload, status_code: int = 200) -> Response:
+    return Response(dumps(payload), status_code=status_code, media_type='application/json')
+
+def error(message: str, status_code: int) -> Response:
+    return json_response({'error': message}, status_code)
+
+async def read_json(request: Request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+def int_arg(request: Request, name: str, default: int) -> int:
+    try:
+        return int(request.query_params.get(name, default))
+    except ValueError:
+        return default
+
+async def cached_catalog_response(request: Request, build) -> Response:
+    """Async counterpart of app.cached_catalog_response (shared cache and ETags)"""
+    args = '&'.join(f'{k}={v}' for k, v in sorted(request.query_params.multi_items()))
+    key = f'{request.url.path}?{args}'
+    version = await async_db.get_catalog_version()
+    accept_gzip = 'gzip' in request.headers.get('accept-encoding', '')
+    if_none_match = [tag.strip() for tag in request.headers.get('if-none-match', '').split(',')]
+
+    def not_modified(etag: str) -> Response:
+        response_cache.record_not_modified()
+        return Response(status_code=304, headers={'ETag': etag, 'Vary': 'Accept-Encoding'})
+
+    expected = variant_etag(catalog_etag(version, key), 'gzip' if accept_gzip else None)
+    if expected in if_none_match:
+        return not_modified(expected)
+
+    # The shared tier reads SQLite and put() gzips: both stay off the loop
+    entry = await async_db.run(response_cache.get, key, version)
+    if entry is None:
+        payload, status = await build()
+        if status != 200:
+            return json_response(payload, status)
+        entry = await async_db.run(response_cache.put, key, version, dumps(payload))
+
+    body, etag, encoding = entry.variant(accept_gzip)
+    if etag != expected and etag in if_none_match:
+        return not_modified(etag)
+    headers = {'ETag': etag, 'Vary': 'Accept-Encoding', 'Cache-Control': 'no-cache'}
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return Response(body, media_type='application/json', headers=headers)
+
+class RequestMetricsMiddleware:
+    """Per-request timing for /api/metrics, like app.py's request hooks"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        token = metrics.start_request()
+        status = [500]
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get('route')
+            metrics.finish_request(token, getattr(route, 'path', 'unmatched'), scope['method'], status[0])
+
+# --- API Routes ---
+
+async def serve_frontend(request: Request):
+    """Serve the React frontend (and client-side routes) from the in-memory manifest"""
+    result = static_assets.respond(request.path_params.get('path', ''), request.headers, request.method)
+    if result is None:
+        return error('Not found', 404)
+    status, headers, body = result
+    return Response(body, status_code=status, headers=dict(headers))
+
+async def api_root(request: Request):
+    return json_response({
+        'message': 'ESG Recommender API',
+        'status': 'running',
+        'endpoints': {
+            'health': '/api/health',
+            'products': '/api/products',
+            'cart': '/api/cart',
+            'cart_summary': '/api/cart/summary',
+            'alternatives': '/api/alternatives/<product_id>',
+            'recommendation': '/api/recommendation',
+            'recommendations_batch': '/api/recommendations/batch',
+            'stats': '/api/stats',
+            'metrics': '/api/metrics'
+        }
+    })
+
+async def health_check(request: Request):
+    return json_response({'status': 'ok', 'message': 'ESG Recommender API is running'})
+
+async def get_stats(request: Request):
+    return json_response({
+        'db_pool': await async_db.get_pool_stats(),
+        'reason_cache': get_reason_cache_stats(),
+        'gemini': get_gemini_guard_stats(),
+        'response_cache': response_cache.stats(),
+        'static_assets': static_assets.stats()
+    })
+
+async def get_metrics(request: Request):
+    return Response(metrics.render(), media_type='text/plain; version=0.0.4')
+
+async def get_products(request: Request):
+    filters, error_msg = parse_product_filters(request.query_params)
+    if error_msg:
+        return error(error_msg, 400)
+    cursor, limit, error_msg = parse_page_args(request.query_params)
+    if error_msg:
+        return error(error_msg, 400)
+
+    if request.query_params.get('format') == 'ndjson':
+        def generate():
+            for product in iter_products(filters, after_id=cursor, limit=limit):
+                yield records.dumps(product) + '\n'
+        # Starlette iterates sync generators in a worker thread
+        return StreamingResponse(generate(), media_type='application/x-ndjson')
+
+    async def build():
+        if limit is None and cursor is None:
+            return await async_db.query_products(filters), 200
+        page_size = limit or DEFAULT_PAGE_SIZE
+        items = await async_db.query_products(filters, after_id=cursor, limit=page_size + 1)
+        return product_page(items, page_size), 200
+
+    return await cached_catalog_response(request, build)
+
+async def get_product(request: Request):
+    product_id = request.path_params['product_id']
+
+    async def build():
+        product = await async_db.get_product_by_id(product_id)
+        if not product:
+            return {'error': 'Product not found'}, 404
+        return product, 200
+
+    return await cached_catalog_response(request, build)
+
+async def get_alternatives(request: Request):
+    options, error_msg = parse_alternative_args(request.query_params)
+    if error_msg:
+        return error(error_msg, 400)
+    product_id = request.path_params['product_id']
+
+    async def build():
+        product = await async_db.get_product_by_id(product_id)
+        if not product:
+            return {'error': 'Product not found'}, 404
+        return await async_db.run(alternatives_report, product, **options), 200
+
+    return await cached_catalog_response(request, build)
+
+async def get_user(request: Request):
+    user = await async_db.get_user_by_name(request.path_params['name'])
+    if user:
+        return json_response(user)
+    return error('User not found', 404)
+
+async def get_user_cart(request: Request):
+    return json_response(await async_db.get_cart(int_arg(request, 'user_id', 1)))
+
+async def get_user_cart_summary(request: Request):
+    return json_response(await async_db.get_cart_summary(int_arg(request, 'user_id', 1)))
+
+async def add_to_user_cart(request: Request):
+    data = await read_json(request)
+    is_valid, error_msg = validate_json_data(data, ['product_id'])
+    if not is_valid:
+        return error(error_msg, 400)
+
+    success, message = await async_db.add_to_cart(data.get('user_id', 1), data.get('product_id'),
+                                                  data.get('quantity', 1))
+    if success:
+        return json_response({'message': message})
+    return error(message, 400)
+
+async def clear_user_cart(request: Request):
+    await async_db.clear_cart(int_arg(request, 'user_id', 1))
+    return json_response({'message': 'Cart cleared successfully'})
+
+async def get_recommendation(request: Request):
+    data = await read_json(request)
+    is_valid, error_msg = validate_json_data(data, ['product_id'])
+    if not is_valid:
+        return error(error_msg, 400)
+
+    original_product = await async_db.get_product_by_id(data.get('product_id'))
+    if not original_product:
+        return error('Product not found', 404)
+
+    alternative = await async_db.run(find_greener_alternative, original_product)
+    if not alternative:
+        return error('No greener alternative found', 404)
+
+    carbon_saved = estimate_carbon_savings(original_product, alternative)
+    points_awarded = int(carbon_saved * 10)  # 10 points per kg CO2 saved
+
+    reason_id = None
+    if data.get('async', ASYNC_REASONS):
+        reason = None
+        # The job table may be persistent (SQLite)
+        reason_id = await async_db.run(submit_reason_job, original_product, alternative)
+        await async_db.award_points(1, points_awarded)
+    else:
+        # Points are awarded while Gemini is still generating
+        reason, _ = await asyncio.gather(get_gemini_reason_async(original_product, alternative),
+                                         async_db.award_points(1, points_awarded))
+
+    response = {
+        'original': original_product,
+        'alternative': alternative,
+        'reason': reason,
+        'carbon_saved': carbon_saved,
+        'points_awarded': points_awarded
+    }
+    if reason_id:
+        response['reason_id'] = reason_id
+        response['reason_status'] = 'pending'
+        response['reason_url'] = f'/api/recommendation/{reason_id}/reason'
+    return json_response(response)
+
+async def get_batch_recommendations(request: Request):
+    product_ids, user_id, error_msg = parse_batch_request(await read_json(request))
+    if error_msg:
+        return error(error_msg, 400)
+
+    if product_ids is not None:
+        lines = [{'product_id': pid, 'quantity': 1} for pid in product_ids]
+    else:
+        lines = await async_db.get_cart_lines(user_id)
+
+    if len(lines) > MAX_BATCH_ITEMS:
+        return error(f'At most {MAX_BATCH_ITEMS} products per batch', 400)
+
+    results, pairs = await async_db.run(plan_batch_recommendations, lines)
+    # The batched Gemini calls (up to REASON_BATCH_SIZE pairs each) block; keep them off the loop
+    reasons = await asyncio.to_thread(get_gemini_reasons, pairs)
+    payload = summarize_batch_recommendations(results, reasons)
+    await async_db.award_points(user_id, payload['total_points_awarded'])
+    return json_response(payload)
+
+async def get_recommendation_reason(request: Request):
+    reason_id = request.path_params['reason_id']
+    try:
+        wait = float(request.query_params.get('wait', 0))
+    except ValueError:
+        wait = 0.0
+    wait = min(max(wait, 0.0), MAX_REASON_WAIT)
+
+    # Long-poll without tying up a thread
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    job = await async_db.run(get_reason_job, reason_id)
+    while job is not None and job['status'] == 'pending' and loop.time() < deadline:
+        await asyncio.sleep(REASON_POLL_INTERVAL)
+        job = await async_db.run(get_reason_job, reason_id)
+    if job is None:
+        return error('Reason not found', 404)
+
+    payload = {'reason_id': reason_id, 'status': job['status'], 'reason': job['reason']}
+    return json_response(payload, 202 if job['status'] == 'pending' else 200)
+
+async def handle_errors(request: Request, exc: Exception):
+    """Consistent error responses, like app.handle_errors"""
+    logger.error(f"Error in {request.method} {request.url.path}: {exc}")
+    return error('Internal server error', 500)
+
+@asynccontextmanager
+async def lifespan(app):
+    await async_db.init_db()
+    await async_db.run(ensure_scores_current)
+    await async_db.run(ensure_alternatives_current)
+    await asyncio.to_thread(static_assets.load)
+    logger.info("✅ ESG Recommender async backend initialized successfully")
+    yield
+    async_db.shutdown()
+
+routes = [
+    Route('/', serve_frontend, methods=['GET']),
+    Route('/api/', api_root, methods=['GET']),
+    Route('/api/health', health_check, methods=['GET']),
+    Route('/api/stats', get_stats, methods=['GET']),
+    Route('/api/metrics', get_metrics, methods=['GET']),
+    Route('/api/products', get_products, methods=['GET']),
+    Route('/api/products/{product_id:int}', get_product, methods=['GET']),
+    Route('/api/alternatives/{product_id:int}', get_alternatives, methods=['GET']),
+    Route('/api/users/{name}', get_user, methods=['GET']),
+    Route('/api/cart', get_user_cart, methods=['GET']),
+    Route('/api/cart', add_to_user_cart, methods=['POST']),
+    Route('/api/cart', clear_user_cart, methods=['DELETE']),
+    Route('/api/cart/summary', get_user_cart_summary, methods=['GET']),
+    Route('/api/recommendation', get_recommendation, methods=['POST']),
+    Route('/api/recommendations/batch', get_batch_recommendations, methods=['POST']),
+    Route('/api/recommendation/{reason_id}/reason', get_recommendation_reason, methods=['GET']),
+    Route('/{path:path}', serve_frontend, methods=['GET']),
+]
+
+app = Starlette(
+    debug=os.getenv('FLASK_DEBUG', 'false').lower() == 'true',
+    routes=routes,
+    middleware=[Middleware(RequestMetricsMiddleware),
+                Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    exception_handlers={Exception: handle_errors},
+    lifespan=lifespan,
+)
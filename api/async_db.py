@@ -0,0 +1,57 @@
+"""
+Async access layer over db.py for the ASGI app (asgi.py).
+
+SQLite calls run on a dedicated thread pool sized to the connection pool,
+so the event loop never blocks on disk I/O and worker threads never queue
+for a connection.
+"""
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+from typing import Any, Callable, Optional
+
+import db
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_pid: Optional[int] = None
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ThreadPoolExecutor(max_workers=db.DB_POOL_SIZE, thread_name_prefix='db')
+        _executor_pid = os.getpid()
+    return _executor
+
+async def run(fn: Callable, *args, **kwargs) -> Any:
+    """Run a blocking database-bound callable on the db executor"""
+    loop = asyncio.get_running_loop()
+    # Carry the caller's context over so request metrics see the work
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(get_executor(), partial(ctx.run, fn, *args, **kwargs))
+
+def _async(fn: Callable) -> Callable:
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await run(fn, *args, **kwargs)
+    return wrapper
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+init_db = _async(db.init_db)
+get_catalog_version = _async(db.get_catalog_version)
+query_products = _async(db.query_products)
+get_product_by_id = _async(db.get_product_by_id)
+get_user_by_name = _async(db.get_user_by_name)
+add_to_cart = _async(db.add_to_cart)
+get_cart = _async(db.get_cart)
+get_cart_lines = _async(db.get_cart_lines)
+get_cart_summary = _async(db.get_cart_summary)
+clear_cart = _async(db.clear_cart)
+award_points = _async(db.award_points)
+get_pool_stats = _async(db.get_pool_stats)
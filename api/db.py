@@ -1,9 +1,16 @@
 import sqlite3
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable, Iterable, Iterator, Tuple
 import os
 import logging
 from contextlib import contextmanager
 import tempfile
+import threading
+import queue
+import time
+import atexit
+
+from metrics import METRICS_ENABLED, count_query, register_stats, timed
+from records import Product, CartItem, User
 
 logger = logging.getLogger(__name__)
 
@@ -15,22 +22,217 @@ else:
     # Local development
     DB_PATH = os.getenv('ESG_DB_PATH', 'esg_recommender.db')
 
+# Connection pool configuration
+DB_POOL_SIZE = int(os.getenv('ESG_DB_POOL_SIZE', '8'))
+DB_POOL_TIMEOUT = float(os.getenv('ESG_DB_POOL_TIMEOUT', '10'))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('ESG_DB_STATEMENT_CACHE', '256'))
+# Read cart summaries from the incrementally maintained cart_summary table
+# instead of aggregating the cart on every request
+CART_SUMMARY_TABLE = os.getenv('ESG_CART_SUMMARY_TABLE', 'true').lower() == 'true'
+
+# Applied to every pooled connection when it is opened
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('mmap_size', int(os.getenv('ESG_DB_MMAP_SIZE', str(256 * 1024 * 1024)))),
+    ('cache_size', int(os.getenv('ESG_DB_CACHE_SIZE', '-65536'))),  # negative = KiB
+    ('temp_store', 'MEMORY'),
+    ('busy_timeout', 5000),
+)
+
+def open_connection(path: Optional[str] = None, **kwargs) -> sqlite3.Connection:
+    """Open a new connection configured with SQLITE_PRAGMAS (outside the pool)"""
+    conn = sqlite3.connect(path or DB_PATH, check_same_thread=False,
+                           cached_statements=DB_STATEMENT_CACHE_SIZE, **kwargs)
+    conn.row_factory = sqlite3.Row  # Enable dict-like access
+    for name, value in SQLITE_PRAGMAS:
+        conn.execute(f'PRAGMA {name}={value}')
+    return conn
+
+class ConnectionPool:
+    """Bounded pool of reusable SQLite connections.
+
+    Connections are opened lazily up to ``size``; callers beyond that wait for
+    one to be released. Each connection keeps its own prepared statement
+    cache, so repeated queries skip re-parsing.
+    """
+
+    def __init__(self, path: str, size: int = DB_POOL_SIZE, timeout: float = DB_POOL_TIMEOUT):
+        self.path = path
+        self.size = max(1, size)
+        self.timeout = timeout
+        self._pid = os.getpid()
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open = 0
+        self._in_use = 0
+        self._stats = {'hits': 0, 'misses': 0, 'waits': 0, 'timeouts': 0, 'discarded': 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = open_connection(self.path)
+        if METRICS_ENABLED:
+            # Count statements per request for /api/metrics
+            conn.set_trace_callback(count_query)
+        return conn
+
+    def _check_fork(self):
+        # Connections must never cross a fork; a child starts with an empty pool
+        if os.getpid() != self._pid:
+            with self._lock:
+                if os.getpid() != self._pid:
+                    self._pid = os.getpid()
+                    self._idle = queue.LifoQueue()
+                    self._open = 0
+                    self._in_use = 0
+
+    def acquire(self) -> sqlite3.Connection:
+        self._check_fork()
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self._stats['hits'] += 1
+                self._in_use += 1
+            return conn
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            create = self._open < self.size
+            if create:
+                self._open += 1
+        if create:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._open -= 1
+                raise
+            with self._lock:
+                self._stats['misses'] += 1
+                self._in_use += 1
+            return conn
+
+        with self._lock:
+            self._stats['waits'] += 1
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise sqlite3.OperationalError(f'Timed out waiting for a database connection ({self.size} in use)')
+        with self._lock:
+            self._in_use += 1
+        return conn
+
+    def release(self, conn: sqlite3.Connection, discard: bool = False):
+        if os.getpid() != self._pid:
+            return
+        if not discard and conn.in_transaction:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                discard = True
+        with self._lock:
+            self._in_use -= 1
+            if discard:
+                self._open -= 1
+                self._stats['discarded'] += 1
+        if discard:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        else:
+            self._idle.put(conn)
+
+    def close(self):
+        """Close all idle connections"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._open -= 1
+            conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'path': self.path,
+                'size': self.size,
+                'open': self._open,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+            })
+        return stats
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    """Return the process-wide connection pool for DB_PATH"""
+    global _pool
+    pool = _pool
+    if pool is None or pool.path != DB_PATH:
+        with _pool_lock:
+            if _pool is None or _pool.path != DB_PATH:
+                if _pool is not None:
+                    _pool.close()
+                _pool = ConnectionPool(DB_PATH)
+            pool = _pool
+    return pool
+
+def close_pool():
+    """Close pooled connections (e.g. at shutdown or before forking)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+def get_pool_stats() -> Dict[str, Any]:
+    return get_pool().stats()
+
+register_stats('db_pool', get_pool_stats)
+
 @contextmanager
 def get_db_connection():
-    """Context manager for database connections"""
-    conn = None
+    """Context manager for database connections borrowed from the pool"""
+    pool = get_pool()
+    conn = pool.acquire()
+    discard = False
     try:
-        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-        conn.row_factory = sqlite3.Row  # Enable dict-like access
         yield conn
     except Exception as e:
-        if conn:
+        try:
             conn.rollback()
+        except sqlite3.Error:
+            discard = True
         logger.error(f"Database error: {e}")
         raise
     finally:
-        if conn:
-            conn.close()
+        pool.release(conn, discard=discard)
+
+# --- Change Notification ---
+# Callbacks invoked after product rows are written. They receive the list of
+# changed product ids, or None when the whole catalog should be reloaded.
+_product_listeners: List[Callable[[Optional[List[int]]], None]] = []
+
+def subscribe_product_changes(callback: Callable[[Optional[List[int]]], None]):
+    """Register a callback to be notified after products are written"""
+    if callback not in _product_listeners:
+        _product_listeners.append(callback)
+
+def notify_product_changes(product_ids: Optional[Iterable[int]] = None):
+    """Notify subscribers that products changed (None means everything)"""
+    ids = list(product_ids) if product_ids is not None else None
+    for callback in list(_product_listeners):
+        try:
+            callback(ids)
+        except Exception as e:
+            logger.error(f"Product change listener failed: {e}")
 
 # --- Schema Creation ---
 def create_tables():
@@ -61,6 +263,202 @@ def create_tables():
         )''')
         conn.commit()
 
+# --- Schema Migrations ---
+_MARK_CATEGORY_STALE = '''INSERT INTO alternative_categories (category, dirty) SELECT {row}.category, 1
+                          WHERE {row}.category IS NOT NULL
+                          ON CONFLICT(category) DO UPDATE SET dirty = 1 WHERE dirty = 0;'''
+
+# Secondary indexes on products. Bulk ingestion drops the deferrable ones for
+# the duration of a load; ensure_schema recreates any an aborted load left missing.
+PRODUCT_INDEXES = {
+    'idx_products_category': 'CREATE INDEX IF NOT EXISTS idx_products_category ON products(category, id)',
+    'idx_products_supplier_sku':
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_products_supplier_sku ON products(supplier_sku)',
+    'idx_products_category_score':
+        'CREATE INDEX IF NOT EXISTS idx_products_category_score ON products(category, esg_score)',
+}
+
+# Ordered (version, description, steps). A step is a SQL string or a callable
+# taking the connection. PRAGMA user_version records the applied version, so
+# existing database files are upgraded in place on startup.
+MIGRATIONS = [
+    (1, 'Index cart and users lookups, unique cart lines', [
+        # Fold duplicate cart lines into the oldest row before enforcing uniqueness
+        '''UPDATE cart SET quantity = (SELECT SUM(c2.quantity) FROM cart c2
+                                       WHERE c2.user_id = cart.user_id AND c2.product_id = cart.product_id)
+           WHERE id IN (SELECT MIN(id) FROM cart GROUP BY user_id, product_id HAVING COUNT(*) > 1)''',
+        'DELETE FROM cart WHERE id NOT IN (SELECT MIN(id) FROM cart GROUP BY user_id, product_id)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_cart_user_product ON cart(user_id, product_id)',
+        'CREATE INDEX IF NOT EXISTS idx_users_name ON users(name)',
+    ]),
+    (2, 'Persistent Gemini reason cache', [
+        '''CREATE TABLE IF NOT EXISTS reason_cache (
+            key TEXT PRIMARY KEY,
+            reason TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )''',
+    ]),
+    (3, 'Index products for filtered keyset pagination', [
+        PRODUCT_INDEXES['idx_products_category'],
+    ]),
+    (4, 'Catalog metadata with a version counter', [
+        '''CREATE TABLE IF NOT EXISTS catalog_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )''',
+        "INSERT OR IGNORE INTO catalog_meta (key, value) VALUES ('catalog_version', '0')",
+    ]),
+    (5, 'Supplier SKU and stored ESG score columns for bulk ingestion', [
+        'ALTER TABLE products ADD COLUMN supplier_sku TEXT',
+        'ALTER TABLE products ADD COLUMN esg_score FLOAT',
+        'ALTER TABLE products ADD COLUMN esg_grade TEXT',
+        PRODUCT_INDEXES['idx_products_supplier_sku'],
+    ]),
+    (6, 'Scoring version stamp and (category, esg_score) index', [
+        'ALTER TABLE products ADD COLUMN esg_version TEXT',
+        PRODUCT_INDEXES['idx_products_category_score'],
+    ]),
+    (7, 'Response cache shared between worker processes', [
+        '''CREATE TABLE IF NOT EXISTS response_cache (
+            key TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            etag TEXT NOT NULL,
+            body BLOB NOT NULL,
+            gzip_body BLOB
+        )''',
+    ]),
+    (8, 'Per-user cart summary maintained on cart writes', [
+        '''CREATE TABLE IF NOT EXISTS cart_summary (
+            user_id INTEGER NOT NULL,
+            dimension TEXT NOT NULL,
+            value TEXT NOT NULL,
+            line_count INTEGER NOT NULL,
+            item_count INTEGER NOT NULL,
+            total_price FLOAT NOT NULL,
+            total_carbon_kg FLOAT NOT NULL,
+            organic_items INTEGER NOT NULL,
+            catalog_version INTEGER NOT NULL,
+            PRIMARY KEY (user_id, dimension, value)
+        )''',
+        lambda conn: rebuild_cart_summaries(conn),
+    ]),
+    (9, 'Precomputed greener alternatives, invalidated per category', [
+        '''CREATE TABLE IF NOT EXISTS product_alternatives (
+            product_id INTEGER PRIMARY KEY,
+            category TEXT NOT NULL,
+            alternative_id INTEGER,
+            score_delta FLOAT,
+            carbon_saved FLOAT
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_product_alternatives_category ON product_alternatives(category)',
+        '''CREATE TABLE IF NOT EXISTS alternative_categories (
+            category TEXT PRIMARY KEY,
+            dirty INTEGER NOT NULL DEFAULT 1,
+            built_at REAL
+        )''',
+        'INSERT OR IGNORE INTO alternative_categories (category) SELECT DISTINCT category FROM products WHERE category IS NOT NULL',
+        # Any product write marks the categories it touches as stale, in the
+        # writer's own transaction (including bulk ingestion)
+        f'''CREATE TRIGGER IF NOT EXISTS products_alternatives_insert AFTER INSERT ON products
+            WHEN NEW.category IS NOT NULL BEGIN {_MARK_CATEGORY_STALE.format(row='NEW')} END''',
+        f'''CREATE TRIGGER IF NOT EXISTS products_alternatives_update
+            AFTER UPDATE OF category, packaging, is_organic, carbon_kg, price, esg_score ON products BEGIN
+            {_MARK_CATEGORY_STALE.format(row='OLD')} {_MARK_CATEGORY_STALE.format(row='NEW')} END''',
+        f'''CREATE TRIGGER IF NOT EXISTS products_alternatives_delete AFTER DELETE ON products
+            WHEN OLD.category IS NOT NULL BEGIN {_MARK_CATEGORY_STALE.format(row='OLD')} END''',
+    ]),
+    (10, 'Pre-generated recommendation reasons', [
+        '''CREATE TABLE IF NOT EXISTS recommendation_reasons (
+            key TEXT PRIMARY KEY,
+            product_id INTEGER NOT NULL,
+            alternative_id INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            model TEXT,
+            created_at REAL NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_recommendation_reasons_product ON recommendation_reasons(product_id)',
+    ]),
+    (11, 'Index reason cache expiry for pruning on write', [
+        'CREATE INDEX IF NOT EXISTS idx_reason_cache_expires ON reason_cache(expires_at)',
+    ]),
+    (12, 'Deferred reason jobs shared between worker processes', [
+        '''CREATE TABLE IF NOT EXISTS reason_jobs (
+            job_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            reason TEXT,
+            fallback TEXT NOT NULL,
+            submitted_at REAL NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_reason_jobs_submitted ON reason_jobs(submitted_at)',
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def run_migrations():
+    """Apply pending schema migrations, one transaction per version"""
+    with get_db_connection() as conn:
+        for version, description, steps in MIGRATIONS:
+            if get_schema_version(conn) >= version:
+                continue
+            # Take the write lock first so concurrent workers don't both migrate
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if get_schema_version(conn) >= version:
+                    conn.rollback()
+                    continue
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(step)
+                conn.execute(f'PRAGMA user_version = {int(version)}')
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            logger.info(f"Applied schema migration {version}: {description}")
+
+def ensure_product_indexes():
+    """Recreate products indexes missing after an interrupted bulk load"""
+    with get_db_connection() as conn:
+        existing = {row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='products'")}
+        missing = [name for name in PRODUCT_INDEXES if name not in existing]
+        for name in missing:
+            logger.warning(f"Recreating missing index {name}")
+            conn.execute(PRODUCT_INDEXES[name])
+        if missing:
+            conn.commit()
+
+# --- Catalog Version ---
+# Incremented in the same transaction as any product write; HTTP caches and
+# ETags are keyed on it, so it is shared correctly across worker processes.
+def bump_catalog_version(conn: sqlite3.Connection) -> None:
+    """Increment the catalog version inside the caller's transaction"""
+    conn.execute("UPDATE catalog_meta SET value = CAST(value AS INTEGER) + 1 WHERE key='catalog_version'")
+
+@timed()
+def get_catalog_version() -> int:
+    with get_db_connection() as conn:
+        row = conn.execute("SELECT value FROM catalog_meta WHERE key='catalog_version'").fetchone()
+    return int(row[0]) if row else 0
+
+@timed()
+def get_catalog_meta(key: str) -> Optional[str]:
+    with get_db_connection() as conn:
+        row = conn.execute('SELECT value FROM catalog_meta WHERE key=?', (key,)).fetchone()
+    return row[0] if row else None
+
+@timed()
+def set_catalog_meta(key: str, value: str):
+    with get_db_connection() as conn:
+        conn.execute('INSERT OR REPLACE INTO catalog_meta (key, value) VALUES (?, ?)', (key, value))
+        conn.commit()
+
 # --- Mock Data Insertion ---
 def insert_mock_data():
     with get_db_connection() as conn:
@@ -82,90 +480,609 @@ def insert_mock_data():
             ]
             c.executemany('''INSERT INTO products (name, description, category, packaging, is_organic, carbon_kg, price)
                              VALUES (?, ?, ?, ?, ?, ?, ?)''', products)
+            bump_catalog_version(conn)
+            products_changed = True
+        else:
+            products_changed = False
         c.execute('SELECT COUNT(*) FROM users')
         if c.fetchone()[0] == 0:
             c.execute('INSERT INTO users (name, points) VALUES (?, ?)', ('Alice', 0))
         conn.commit()
+    if products_changed:
+        notify_product_changes()
 
 # --- Product Helpers ---
-def get_all_products() -> List[Dict[str, Any]]:
+# Product rows are read as plain tuples (row_factory=None) straight into
+# records.Product, whose fields are these columns in this order
+PRODUCT_COLUMNS = list(Product._fields)
+PRODUCT_SELECT = f'SELECT {", ".join(PRODUCT_COLUMNS)} FROM products'
+
+def _tuple_cursor(conn: sqlite3.Connection) -> sqlite3.Cursor:
+    c = conn.cursor()
+    c.row_factory = None
+    return c
+
+@timed()
+def get_all_products() -> List[Product]:
     with get_db_connection() as conn:
-        c = conn.cursor()
-        c.execute('SELECT * FROM products')
-        rows = c.fetchall()
-        keys = ['id', 'name', 'description', 'category', 'packaging', 'is_organic', 'carbon_kg', 'price']
-        return [dict(zip(keys, row)) for row in rows]
+        c = _tuple_cursor(conn)
+        c.execute(PRODUCT_SELECT)
+        return [Product(*row) for row in c.fetchall()]
 
-def get_product_by_id(pid: int) -> Optional[Dict[str, Any]]:
+@timed()
+def get_product_by_id(pid: int) -> Optional[Product]:
     with get_db_connection() as conn:
-        c = conn.cursor()
-        c.execute('SELECT * FROM products WHERE id=?', (pid,))
+        c = _tuple_cursor(conn)
+        c.execute(PRODUCT_SELECT + ' WHERE id=?', (pid,))
         row = c.fetchone()
         if row:
-            keys = ['id', 'name', 'description', 'category', 'packaging', 'is_organic', 'carbon_kg', 'price']
-            return dict(zip(keys, row))
+            return Product(*row)
     return None
 
+# Supported /api/products filters: name -> SQL condition on one bound value
+PRODUCT_FILTERS = {
+    'category': 'category = ?',
+    'packaging': 'packaging = ?',
+    'is_organic': 'is_organic = ?',
+    'min_carbon': 'carbon_kg >= ?',
+    'max_carbon': 'carbon_kg <= ?',
+    'min_price': 'price >= ?',
+    'max_price': 'price <= ?',
+}
+
+def _product_query(filters: Optional[Dict[str, Any]], after_id: Optional[int],
+                   limit: Optional[int]) -> Tuple[str, List[Any]]:
+    """Build a keyset-paginated, filtered products query"""
+    conditions, params = [], []
+    for name, value in (filters or {}).items():
+        if value is None:
+            continue
+        if name not in PRODUCT_FILTERS:
+            raise ValueError(f'Unknown product filter: {name}')
+        conditions.append(PRODUCT_FILTERS[name])
+        params.append(int(value) if name == 'is_organic' else value)
+    if after_id is not None:
+        conditions.append('id > ?')
+        params.append(after_id)
+    sql = PRODUCT_SELECT
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY id'
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    return sql, params
+
+@timed()
+def query_products(filters: Optional[Dict[str, Any]] = None, after_id: Optional[int] = None,
+                   limit: Optional[int] = None) -> List[Product]:
+    """Products matching filters, ordered by id, starting after after_id"""
+    sql, params = _product_query(filters, after_id, limit)
+    with get_db_connection() as conn:
+        c = _tuple_cursor(conn)
+        c.execute(sql, params)
+        return [Product(*row) for row in c.fetchall()]
+
+def iter_products(filters: Optional[Dict[str, Any]] = None, after_id: Optional[int] = None,
+                  limit: Optional[int] = None, batch_size: int = 1000) -> Iterator[Product]:
+    """Stream matching products in keyset pages of batch_size rows.
+    The pooled connection is released between pages, so a slow reader never holds one."""
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = batch_size if remaining is None else min(batch_size, remaining)
+        page = query_products(filters, after_id=after_id, limit=size)
+        yield from page
+        if len(page) < size:
+            return
+        after_id = page[-1]['id']
+        if remaining is not None:
+            remaining -= len(page)
+
+# --- Stored ESG Scores ---
+@timed()
+def get_unscored_products(version: str, limit: int, product_ids: Optional[List[int]] = None,
+                          after_id: int = 0) -> List[Product]:
+    """Products (id > after_id) whose stored score is missing or from another scoring version"""
+    sql = PRODUCT_SELECT + ' WHERE id > ? AND esg_version IS NOT ?'
+    params: List[Any] = [after_id, version]
+    if product_ids is not None:
+        sql += f' AND id IN ({",".join("?" * len(product_ids))})'
+        params.extend(product_ids)
+    sql += ' ORDER BY id LIMIT ?'
+    params.append(limit)
+    with get_db_connection() as conn:
+        c = _tuple_cursor(conn)
+        c.execute(sql, params)
+        return [Product(*row) for row in c.fetchall()]
+
+@timed()
+def update_product_scores(scores: List[Tuple[float, str, str, int]]):
+    """Store (esg_score, esg_grade, esg_version, id) rows and bump the catalog version"""
+    if not scores:
+        return
+    with get_db_connection() as conn:
+        conn.executemany('UPDATE products SET esg_score=?, esg_grade=?, esg_version=? WHERE id=?', scores)
+        bump_catalog_version(conn)
+        conn.commit()
+
+@timed()
+def get_top_scored_products(category: str, limit: int = 1, min_score: Optional[float] = None,
+                            exclude_id: Optional[int] = None) -> List[Tuple[float, Product]]:
+    """(esg_score, product) for the best stored scores in a category (ties: lowest id first)"""
+    sql = f'SELECT esg_score, {", ".join(PRODUCT_COLUMNS)} FROM products WHERE category = ? AND esg_score IS NOT NULL'
+    params: List[Any] = [category]
+    if min_score is not None:
+        sql += ' AND esg_score > ?'
+        params.append(min_score)
+    if exclude_id is not None:
+        sql += ' AND id != ?'
+        params.append(exclude_id)
+    sql += ' ORDER BY esg_score DESC, id ASC LIMIT ?'
+    params.append(limit)
+    with get_db_connection() as conn:
+        c = _tuple_cursor(conn)
+        c.execute(sql, params)
+        return [(row[0], Product(*row[1:])) for row in c.fetchall()]
+
+def iter_scored_candidates(category: str, min_score: float, exclude_id: Optional[int] = None,
+                           max_price: Optional[float] = None, max_carbon: Optional[float] = None,
+                           batch_size: int = 64) -> Iterator[Tuple[float, Product]]:
+    """
+    (esg_score, product) scoring above min_score in a category, best first
+    (ties: lowest id). Rows are read in order from the (category, esg_score)
+    index as the caller consumes them, so stopping early is cheap.
+    """
+    sql = (f'SELECT esg_score, {", ".join(PRODUCT_COLUMNS)} FROM products '
+           'WHERE category = ? AND esg_score > ?')
+    params: List[Any] = [category, min_score]
+    if exclude_id is not None:
+        sql += ' AND id != ?'
+        params.append(exclude_id)
+    if max_price is not None:
+        sql += ' AND price <= ?'
+        params.append(max_price)
+    if max_carbon is not None:
+        sql += ' AND carbon_kg <= ?'
+        params.append(max_carbon)
+    sql += ' ORDER BY esg_score DESC, id ASC'
+    with get_db_connection() as conn:
+        c = _tuple_cursor(conn)
+        c.execute(sql, params)
+        while True:
+            rows = c.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row[0], Product(*row[1:])
+
+@timed()
+def get_product_text_rows() -> List[Tuple[int, str, str, str, Optional[float]]]:
+    """(id, category, name, description, esg_score) of categorized products, grouped by category then id"""
+    with get_db_connection() as conn:
+        c = _tuple_cursor(conn)
+        c.execute('''SELECT id, category, name, description, esg_score FROM products
+                     WHERE category IS NOT NULL ORDER BY category, id''')
+        return c.fetchall()
+
+# --- Precomputed Alternatives ---
+# product_alternatives holds each product's greener alternative (NULL when
+# there is none), rebuilt a category at a time. Categories are marked dirty
+# by triggers on products; rows of dirty categories are not served.
+@timed()
+def get_stale_alternative_categories() -> List[str]:
+    with get_db_connection() as conn:
+        return [row[0] for row in conn.execute('SELECT category FROM alternative_categories WHERE dirty = 1')]
+
+def get_alternative_categories() -> List[str]:
+    with get_db_connection() as conn:
+        return [row[0] for row in conn.execute('SELECT category FROM alternative_categories')]
+
+@timed()
+def replace_category_alternatives(category: str, scoring_version: str,
+                                  compute: Callable[[List[Tuple[int, float, float]]], List[Tuple]]) -> bool:
+    """
+    Rebuild one category of product_alternatives in a single write transaction.
+    `compute` receives the category's (id, esg_score, carbon_kg) rows, best
+    score first (ties: lowest id), and returns (product_id, alternative_id,
+    score_delta, carbon_saved) rows. Returns False, leaving the category
+    stale, when some of its stored scores are from another scoring version.
+    """
+    with get_db_connection() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            c = _tuple_cursor(conn)
+            c.execute('''SELECT id, esg_score, carbon_kg, esg_version FROM products WHERE category = ?
+                         ORDER BY esg_score DESC, id ASC''', (category,))
+            rows = c.fetchall()
+            if any(row[3] != scoring_version for row in rows):
+                conn.rollback()
+                return False
+            conn.execute('DELETE FROM product_alternatives WHERE category = ?', (category,))
+            conn.executemany('''INSERT OR REPLACE INTO product_alternatives
+                                (product_id, category, alternative_id, score_delta, carbon_saved)
+                                VALUES (?, ?, ?, ?, ?)''',
+                             ((pid, category, alt, delta, saved)
+                              for pid, alt, delta, saved in compute([row[:3] for row in rows])))
+            conn.execute('''INSERT INTO alternative_categories (category, dirty, built_at) VALUES (?, 0, ?)
+                            ON CONFLICT(category) DO UPDATE SET dirty = 0, built_at = excluded.built_at''',
+                         (category, time.time()))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return True
+
+@timed()
+def get_precomputed_alternative(product_id: int) -> Optional[Tuple[Optional[Product], float, float]]:
+    """
+    (alternative, score_delta, carbon_saved) from product_alternatives, with
+    alternative None when the product has no greener one. Returns None when
+    the product's category is stale or has not been built.
+    """
+    with get_db_connection() as conn:
+        c = _tuple_cursor(conn)
+        c.execute(f'''SELECT a.alternative_id, a.score_delta, a.carbon_saved, {", ".join("p." + col for col in PRODUCT_COLUMNS)}
+                      FROM product_alternatives a
+                      JOIN alternative_categories ac ON ac.category = a.category AND ac.dirty = 0
+                      LEFT JOIN products p ON p.id = a.alternative_id
+                      WHERE a.product_id = ?''', (product_id,))
+        row = c.fetchone()
+    if row is None:
+        return None
+    if row[0] is None:
+        return None, 0.0, 0.0
+    if row[3] is None:
+        return None  # alternative deleted since the build
+    return Product(*row[3:]), row[1], row[2]
+
+@timed()
+def get_products_by_ids(pids: Iterable[int]) -> Dict[int, Product]:
+    """Fetch several products in one query, keyed by id"""
+    ids = list(dict.fromkeys(pids))
+    if not ids:
+        return {}
+    found = {}
+    with get_db_connection() as conn:
+        c = _tuple_cursor(conn)
+        # Stay well below SQLite's bound-parameter limit
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            c.execute(PRODUCT_SELECT + f' WHERE id IN ({",".join("?" * len(chunk))})', chunk)
+            for row in c.fetchall():
+                found[row[0]] = Product(*row)
+    return found
+
+# --- Stored Reasons ---
+# recommendation_reasons holds reasons generated ahead of time by
+# pregenerate.py, keyed like the reason cache (both product ids plus a hash of
+# the model and prompt text), so a row stops matching once either product's
+# text changes.
+@timed()
+def get_stored_reason(key: str) -> Optional[str]:
+    with get_db_connection() as conn:
+        row = conn.execute('SELECT reason FROM recommendation_reasons WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else None
+
+@timed()
+def get_stored_reasons(keys: Iterable[str]) -> Dict[str, str]:
+    """Stored reasons for several keys in one query per 500 keys"""
+    keys = list(dict.fromkeys(keys))
+    found = {}
+    with get_db_connection() as conn:
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            found.update(conn.execute(f'SELECT key, reason FROM recommendation_reasons '
+                                      f'WHERE key IN ({",".join("?" * len(chunk))})', chunk).fetchall())
+    return found
+
+def save_stored_reasons(rows: List[Tuple[str, int, int, str, str]]):
+    """Insert or replace (key, product_id, alternative_id, reason, model) rows in one transaction"""
+    now = time.time()
+    with get_db_connection() as conn:
+        conn.executemany('''INSERT OR REPLACE INTO recommendation_reasons
+                            (key, product_id, alternative_id, reason, model, created_at)
+                            VALUES (?, ?, ?, ?, ?, ?)''', ((*row, now) for row in rows))
+        conn.commit()
+
+def prune_stored_reasons(product_ids: List[int], keep_keys: Iterable[str]) -> int:
+    """Delete stored reasons of product_ids other than keep_keys; returns rows deleted"""
+    if not product_ids:
+        return 0
+    keep = list(keep_keys)
+    sql = f'DELETE FROM recommendation_reasons WHERE product_id IN ({",".join("?" * len(product_ids))})'
+    if keep:
+        sql += f' AND key NOT IN ({",".join("?" * len(keep))})'
+    with get_db_connection() as conn:
+        deleted = conn.execute(sql, [*product_ids, *keep]).rowcount
+        conn.commit()
+    return deleted
+
+def count_stored_reasons() -> int:
+    with get_db_connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM recommendation_reasons').fetchone()[0]
+
 # --- User Helpers ---
-def get_user_by_name(name: str) -> Optional[Dict[str, Any]]:
+@timed()
+def get_user_by_name(name: str) -> Optional[User]:
     with get_db_connection() as conn:
-        c = conn.cursor()
-        c.execute('SELECT * FROM users WHERE name=?', (name,))
+        c = _tuple_cursor(conn)
+        c.execute('SELECT id, name, points FROM users WHERE name=?', (name,))
         row = c.fetchone()
         if row:
-            keys = ['id', 'name', 'points']
-            return dict(zip(keys, row))
+            return User(*row)
     return None
 
-def get_user_by_id(user_id: int) -> Optional[Dict[str, Any]]:
+@timed()
+def get_user_by_id(user_id: int) -> Optional[User]:
     with get_db_connection() as conn:
-        c = conn.cursor()
-        c.execute('SELECT * FROM users WHERE id=?', (user_id,))
+        c = _tuple_cursor(conn)
+        c.execute('SELECT id, name, points FROM users WHERE id=?', (user_id,))
         row = c.fetchone()
         if row:
-            keys = ['id', 'name', 'points']
-            return dict(zip(keys, row))
+            return User(*row)
     return None
 
+@timed()
 def update_user_points(user_id: int, points: int):
     with get_db_connection() as conn:
         c = conn.cursor()
         c.execute('UPDATE users SET points=? WHERE id=?', (points, user_id))
         conn.commit()
 
+@timed()
+def increment_user_points(user_id: int, delta: int) -> Optional[int]:
+    """Atomically add delta to a user's points; returns the new balance"""
+    with get_db_connection() as conn:
+        c = conn.cursor()
+        c.execute('UPDATE users SET points = points + ? WHERE id=?', (delta, user_id))
+        if c.rowcount == 0:
+            conn.rollback()
+            return None
+        # Still inside the write transaction, so this is the balance we produced
+        c.execute('SELECT points FROM users WHERE id=?', (user_id,))
+        points = c.fetchone()[0]
+        conn.commit()
+    return points
+
+# Seconds between batched point flushes; 0 applies every award immediately
+POINTS_FLUSH_INTERVAL = float(os.getenv('ESG_POINTS_FLUSH_INTERVAL', '0'))
+POINTS_MAX_PENDING = int(os.getenv('ESG_POINTS_MAX_PENDING', '1000'))
+
+class PointsBatcher:
+    """Accumulates point deltas per user and applies them in one write.
+
+    Deltas are flushed by a background thread every ``interval`` seconds, or
+    immediately once ``max_pending`` awards have queued up.
+    """
+
+    def __init__(self, interval: float = POINTS_FLUSH_INTERVAL, max_pending: int = POINTS_MAX_PENDING):
+        self.interval = interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pending: Dict[int, int] = {}
+        self._count = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+
+    def _ensure_started(self):
+        # Threads don't survive fork, so (re)start per process
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid() or not (self._thread and self._thread.is_alive()):
+                self._pid = os.getpid()
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='points-flusher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Points flush failed: {e}")
+
+    def add(self, user_id: int, delta: int):
+        self._ensure_started()
+        with self._lock:
+            self._pending[user_id] = self._pending.get(user_id, 0) + delta
+            self._count += 1
+            flush_now = self._count >= self.max_pending
+        if flush_now:
+            self.flush()
+
+    def pending(self, user_id: int) -> int:
+        with self._lock:
+            return self._pending.get(user_id, 0)
+
+    def flush(self) -> int:
+        """Write all accumulated deltas; returns the number of users updated"""
+        with self._lock:
+            batch, self._pending, self._count = self._pending, {}, 0
+        if not batch:
+            return 0
+        try:
+            with get_db_connection() as conn:
+                conn.executemany('UPDATE users SET points = points + ? WHERE id=?',
+                                 [(delta, uid) for uid, delta in batch.items()])
+                conn.commit()
+        except Exception:
+            # Put the deltas back so they are retried on the next flush
+            with self._lock:
+                for uid, delta in batch.items():
+                    self._pending[uid] = self._pending.get(uid, 0) + delta
+            raise
+        return len(batch)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread and self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.interval + 1)
+        self.flush()
+
+points_batcher = PointsBatcher()
+atexit.register(points_batcher.stop)
+
+def award_points(user_id: int, delta: int):
+    """Credit points, batched when ESG_POINTS_FLUSH_INTERVAL is set"""
+    if not delta:
+        return
+    if points_batcher.interval > 0:
+        points_batcher.add(user_id, delta)
+    else:
+        increment_user_points(user_id, delta)
+
 # --- Cart Helpers ---
+@timed()
 def add_to_cart(user_id: int, product_id: int, quantity: int = 1):
     if quantity < 1:
         return False, 'Quantity must be at least 1.'
     with get_db_connection() as conn:
         c = conn.cursor()
-        # Check if already in cart
-        c.execute('SELECT id, quantity FROM cart WHERE user_id=? AND product_id=?', (user_id, product_id))
-        row = c.fetchone()
-        if row:
-            cart_id, old_qty = row
-            c.execute('UPDATE cart SET quantity=? WHERE id=?', (old_qty + quantity, cart_id))
-        else:
-            c.execute('INSERT INTO cart (user_id, product_id, quantity) VALUES (?, ?, ?)', (user_id, product_id, quantity))
+        c.execute('''INSERT INTO cart (user_id, product_id, quantity) VALUES (?, ?, ?)
+                     ON CONFLICT(user_id, product_id) DO UPDATE SET quantity = quantity + excluded.quantity
+                     RETURNING quantity''',
+                  (user_id, product_id, quantity))
+        new_line = c.fetchone()[0] == quantity
+        _add_to_cart_summary(conn, user_id, product_id, quantity, new_line)
         conn.commit()
     return True, 'Added to cart.'
 
-def get_cart(user_id: int) -> List[Dict[str, Any]]:
+@timed()
+def get_cart(user_id: int) -> List[CartItem]:
     with get_db_connection() as conn:
-        c = conn.cursor()
+        c = _tuple_cursor(conn)
         c.execute('''SELECT cart.id, products.name, products.category, products.packaging, products.is_organic, products.carbon_kg, products.price, cart.quantity
                      FROM cart JOIN products ON cart.product_id = products.id WHERE cart.user_id=?''', (user_id,))
-        rows = c.fetchall()
-        keys = ['cart_id', 'name', 'category', 'packaging', 'is_organic', 'carbon_kg', 'price', 'quantity']
-        return [dict(zip(keys, row)) for row in rows]
+        return [CartItem(*row) for row in c.fetchall()]
+
+@timed()
+def get_cart_lines(user_id: int) -> List[Dict[str, Any]]:
+    """Product ids and quantities in a user's cart"""
+    with get_db_connection() as conn:
+        c = conn.cursor()
+        c.execute('SELECT product_id, quantity FROM cart WHERE user_id=? ORDER BY id', (user_id,))
+        return [{'product_id': row[0], 'quantity': row[1]} for row in c.fetchall()]
 
+@timed()
 def clear_cart(user_id: int):
     with get_db_connection() as conn:
         c = conn.cursor()
         c.execute('DELETE FROM cart WHERE user_id=?', (user_id,))
+        c.execute('DELETE FROM cart_summary WHERE user_id=?', (user_id,))
         conn.commit()
 
+# --- Cart Summary ---
+# Totals and per-category / per-packaging breakdowns of a cart, as rows of
+# (dimension, value, line_count, item_count, total_price, total_carbon_kg,
+# organic_items). Empty carts produce no rows.
+def _cart_aggregate_sql(where: str) -> str:
+    measures = '''COUNT(*), COALESCE(SUM(cart.quantity), 0), COALESCE(SUM(products.price * cart.quantity), 0.0),
+                  COALESCE(SUM(products.carbon_kg * cart.quantity), 0.0),
+                  COALESCE(SUM(CASE WHEN products.is_organic THEN cart.quantity ELSE 0 END), 0)'''
+    source = f'FROM cart JOIN products ON cart.product_id = products.id WHERE {where}'
+    return f'''SELECT cart.user_id, 'total', '', {measures} {source} GROUP BY cart.user_id
+               UNION ALL
+               SELECT cart.user_id, 'category', COALESCE(products.category, ''), {measures} {source}
+               GROUP BY cart.user_id, products.category
+               UNION ALL
+               SELECT cart.user_id, 'packaging', COALESCE(products.packaging, ''), {measures} {source}
+               GROUP BY cart.user_id, products.packaging'''
+
+_SUMMARY_COLUMNS = 'user_id, dimension, value, line_count, item_count, total_price, total_carbon_kg, organic_items'
+_CATALOG_VERSION_SQL = "SELECT CAST(value AS INTEGER) FROM catalog_meta WHERE key='catalog_version'"
+
+def rebuild_cart_summaries(conn: sqlite3.Connection, user_id: Optional[int] = None):
+    """Recompute stored summaries from the cart (one user, or everyone) in the caller's transaction"""
+    where, params = ('cart.user_id = :user_id', {'user_id': user_id}) if user_id is not None else ('1', {})
+    if user_id is not None:
+        conn.execute('DELETE FROM cart_summary WHERE user_id=?', (user_id,))
+    else:
+        conn.execute('DELETE FROM cart_summary')
+    conn.execute(f'''INSERT INTO cart_summary ({_SUMMARY_COLUMNS}, catalog_version)
+                     SELECT *, ({_CATALOG_VERSION_SQL}) FROM ({_cart_aggregate_sql(where)})''', params)
+    if user_id is not None:
+        # Store an empty cart too, so reading it does not rebuild every time
+        conn.execute(f'''INSERT OR IGNORE INTO cart_summary ({_SUMMARY_COLUMNS}, catalog_version)
+                         VALUES (?, 'total', '', 0, 0, 0.0, 0.0, 0, ({_CATALOG_VERSION_SQL}))''', (user_id,))
+
+def _add_to_cart_summary(conn: sqlite3.Connection, user_id: int, product_id: int, quantity: int, new_line: bool):
+    """Apply one add_to_cart to the stored summary rows"""
+    product = conn.execute('SELECT category, packaging, is_organic, carbon_kg, price FROM products WHERE id=?',
+                           (product_id,)).fetchone()
+    if product is None:
+        return  # not part of the join-based summary either
+    category, packaging, is_organic, carbon_kg, price = product
+    deltas = (1 if new_line else 0, quantity, (price or 0.0) * quantity, (carbon_kg or 0.0) * quantity,
+              quantity if is_organic else 0)
+    # Rows created here are stamped with the current catalog version; an
+    # existing stale row keeps its old stamp and is rebuilt on the next read
+    conn.executemany(f'''INSERT INTO cart_summary ({_SUMMARY_COLUMNS}, catalog_version)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ({_CATALOG_VERSION_SQL}))
+                         ON CONFLICT(user_id, dimension, value) DO UPDATE SET
+                             line_count = line_count + excluded.line_count,
+                             item_count = item_count + excluded.item_count,
+                             total_price = total_price + excluded.total_price,
+                             total_carbon_kg = total_carbon_kg + excluded.total_carbon_kg,
+                             organic_items = organic_items + excluded.organic_items''',
+                     [(user_id, 'total', '') + deltas,
+                      (user_id, 'category', category or '') + deltas,
+                      (user_id, 'packaging', packaging or '') + deltas])
+
+def _stored_cart_summary(conn: sqlite3.Connection, user_id: int) -> List[tuple]:
+    """Stored summary rows, rebuilt first when missing or priced against an older catalog"""
+    c = _tuple_cursor(conn)
+    c.execute(f'''SELECT dimension, value, line_count, item_count, total_price, total_carbon_kg, organic_items,
+                         catalog_version = ({_CATALOG_VERSION_SQL})
+                  FROM cart_summary WHERE user_id=?''', (user_id,))
+    rows = c.fetchall()
+    if rows and all(row[-1] for row in rows):
+        return [row[:-1] for row in rows]
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        rebuild_cart_summaries(conn, user_id)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    c.execute('SELECT dimension, value, line_count, item_count, total_price, total_carbon_kg, organic_items '
+              'FROM cart_summary WHERE user_id=?', (user_id,))
+    return c.fetchall()
+
+@timed()
+def get_cart_summary(user_id: int) -> Dict[str, Any]:
+    """Item count, price and carbon totals of a cart, broken down by category and packaging"""
+    with get_db_connection() as conn:
+        if CART_SUMMARY_TABLE:
+            rows = _stored_cart_summary(conn, user_id)
+        else:
+            c = _tuple_cursor(conn)
+            c.execute(_cart_aggregate_sql('cart.user_id = :user_id'), {'user_id': user_id})
+            rows = [row[1:] for row in c.fetchall()]
+
+    summary: Dict[str, Any] = {'user_id': user_id, 'line_count': 0, 'item_count': 0, 'total_price': 0.0,
+                               'total_carbon_kg': 0.0, 'organic_items': 0, 'organic_share': 0.0,
+                               'by_category': {}, 'by_packaging': {}}
+    for dimension, value, line_count, item_count, total_price, total_carbon_kg, organic_items in rows:
+        if not item_count:
+            continue
+        totals = {'line_count': line_count, 'item_count': item_count, 'total_price': round(total_price, 2),
+                  'total_carbon_kg': round(total_carbon_kg, 2), 'organic_items': organic_items}
+        if dimension == 'total':
+            summary.update(totals)
+            summary['organic_share'] = round(organic_items / item_count, 4)
+        else:
+            summary[f'by_{dimension}'][value] = totals
+    return summary
+
 # --- Initialize DB on first run ---
-def init_db():
+def ensure_schema():
+    """Create tables and apply pending migrations (no seed data)"""
     create_tables()
+    run_migrations()
+    ensure_product_indexes()
+
+def init_db():
+    ensure_schema()
     insert_mock_data()
\ No newline at end of file
@@ -1,29 +1,542 @@
 import google.generativeai as genai
+import asyncio
 import os
+import time
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError
+from typing import Dict, Any, Optional
 from dotenv import load_dotenv
 
+from db import get_db_connection, get_stored_reason, get_stored_reasons
+from metrics import register_stats, timed
+from upstream import UpstreamGuard, UpstreamUnavailable
+
 # Load .env if present
 load_dotenv()
 
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+
+# Reason cache configuration
+REASON_CACHE_SIZE = int(os.getenv("ESG_REASON_CACHE_SIZE", "4096"))
+REASON_CACHE_TTL = float(os.getenv("ESG_REASON_CACHE_TTL", "86400"))
+REASON_CACHE_PERSIST = os.getenv("ESG_REASON_CACHE_PERSIST", "false").lower() == "true"
+# Serve reasons pre-generated by pregenerate.py before calling Gemini
+STORED_REASONS = os.getenv("ESG_STORED_REASONS", "true").lower() == "true"
+
+# Deferred reason generation
+REASON_WORKERS = int(os.getenv("ESG_REASON_WORKERS", "4"))
+REASON_TIMEOUT = float(os.getenv("ESG_REASON_TIMEOUT", "20"))
+REASON_JOB_LIMIT = int(os.getenv("ESG_REASON_JOB_LIMIT", "1000"))
+# Share deferred jobs between worker processes through SQLite, so any worker can answer a poll
+REASON_JOBS_SHARED = os.getenv("ESG_SHARED_REASON_JOBS", "false").lower() == "true"
+# Seconds a shared job stays pollable, and how often a poll rereads it
+REASON_JOB_TTL = float(os.getenv("ESG_REASON_JOB_TTL", "3600"))
+REASON_JOB_POLL_INTERVAL = 0.1
+# Maximum product pairs sent together in one batched prompt
+REASON_BATCH_SIZE = int(os.getenv("ESG_REASON_BATCH_SIZE", "25"))
+
+# Upstream guard: seconds a caller waits for Gemini (batched prompts get their own
+# budget), concurrent upstream calls, and the circuit breaker's consecutive-failure
+# threshold and open period
+GEMINI_BUDGET = float(os.getenv("ESG_GEMINI_BUDGET", "5"))
+GEMINI_BATCH_BUDGET = float(os.getenv("ESG_GEMINI_BATCH_BUDGET", "15"))
+GEMINI_MAX_CONCURRENCY = int(os.getenv("ESG_GEMINI_MAX_CONCURRENCY", "8"))
+GEMINI_BREAKER_FAILURES = int(os.getenv("ESG_GEMINI_BREAKER_FAILURES", "5"))
+GEMINI_BREAKER_RESET = float(os.getenv("ESG_GEMINI_BREAKER_RESET", "30"))
+
 def get_gemini_api_key():
     key = os.getenv("GEMINI_API_KEY")
     return key
 
-def get_gemini_reason(product_a, product_b):
+# --- Model Reuse ---
+_model = None
+_model_api_key = None
+_model_lock = threading.Lock()
+
+def get_model(api_key: str):
+    """Return a configured GenerativeModel, rebuilt only when the key changes"""
+    global _model, _model_api_key
+    if _model is not None and _model_api_key == api_key:
+        return _model
+    with _model_lock:
+        if _model is None or _model_api_key != api_key:
+            genai.configure(api_key=api_key)
+            _model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+            _model_api_key = api_key
+        return _model
+
+# --- Reason Cache ---
+def reason_cache_key(product_a: Dict[str, Any], product_b: Dict[str, Any]) -> str:
+    """Cache key from both product ids plus a hash of the prompt-relevant content"""
+    content = "\x1f".join(str(v) for v in (
+        GEMINI_MODEL_NAME,
+        product_a.get('name', ''), product_a.get('description', ''),
+        product_b.get('name', ''), product_b.get('description', ''),
+    ))
+    digest = hashlib.sha1(content.encode('utf-8')).hexdigest()[:16]
+    return f"{product_a.get('id')}:{product_b.get('id')}:{digest}"
+
+class ReasonCache:
+    """LRU + TTL cache of generated reasons, optionally persisted to SQLite"""
+
+    def __init__(self, max_size: int = REASON_CACHE_SIZE, ttl: float = REASON_CACHE_TTL,
+                 persist: bool = REASON_CACHE_PERSIST):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.persist = persist
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'persistent_hits': 0, 'evictions': 0, 'expired': 0}
+
+    def _load_persistent(self, key: str) -> Optional[tuple]:
+        try:
+            with get_db_connection() as conn:
+                row = conn.execute('SELECT reason, expires_at FROM reason_cache WHERE key=?', (key,)).fetchone()
+        except Exception as e:
+            print(f"Reason cache read error: {e}")
+            return None
+        if row and row[1] > time.time():
+            return row[1], row[0]
+        return None
+
+    def get(self, key: str, memory_only: bool = False) -> Optional[str]:
+        """Cached reason; with memory_only the persistent tier is skipped and a miss isn't counted"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return entry[1]
+                del self._entries[key]
+                self._stats['expired'] += 1
+        if memory_only:
+            return None
+        if self.persist:
+            entry = self._load_persistent(key)
+            if entry is not None:
+                self._store(key, entry)
+                with self._lock:
+                    self._stats['hits'] += 1
+                    self._stats['persistent_hits'] += 1
+                return entry[1]
+        with self._lock:
+            self._stats['misses'] += 1
+        return None
+
+    def _store(self, key: str, entry: tuple):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def remember(self, key: str, reason: str):
+        """Hold a reason persisted elsewhere (a stored reason) in memory only"""
+        self._store(key, (time.time() + self.ttl, reason))
+
+    def set(self, key: str, reason: str):
+        expires_at = time.time() + self.ttl
+        self._store(key, (expires_at, reason))
+        if self.persist:
+            try:
+                with get_db_connection() as conn:
+                    conn.execute('INSERT OR REPLACE INTO reason_cache (key, reason, expires_at) VALUES (?, ?, ?)',
+                                 (key, reason, expires_at))
+                    # Expired rows are never read again; drop them as new ones are written
+                    conn.execute('DELETE FROM reason_cache WHERE expires_at < ?', (time.time(),))
+                    conn.commit()
+            except Exception as e:
+                print(f"Reason cache write error: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+reason_cache = ReasonCache()
+
+def get_reason_cache_stats() -> Dict[str, Any]:
+    return reason_cache.stats()
+
+register_stats('reason_cache', get_reason_cache_stats)
+
+def load_stored_reason(key: str) -> Optional[str]:
+    """Pre-generated reason for a reason cache key, if any"""
+    if not STORED_REASONS:
+        return None
+    try:
+        return get_stored_reason(key)
+    except Exception as e:
+        print(f"Stored reason read error: {e}")
+        return None
+
+def lookup_reason(key: str) -> Optional[str]:
+    """Cached reason, else the stored one (then kept in the in-memory cache)"""
+    reason = reason_cache.get(key)
+    if reason is None:
+        reason = load_stored_reason(key)
+        if reason is not None:
+            reason_cache.remember(key, reason)
+    return reason
+
+# --- Upstream Guard ---
+gemini_guard = UpstreamGuard('gemini', budget=GEMINI_BUDGET, max_concurrency=GEMINI_MAX_CONCURRENCY,
+                             failure_threshold=GEMINI_BREAKER_FAILURES, reset_timeout=GEMINI_BREAKER_RESET)
+
+def get_gemini_guard_stats() -> Dict[str, Any]:
+    return gemini_guard.stats()
+
+register_stats('gemini', get_gemini_guard_stats)
+
+# The pinned google-generativeai client takes no per-call deadline (generate_content
+# rejects request_options), so calls are made without one: the guard's budget bounds
+# how long callers wait, and the client's own 60s default bounds the call itself.
+def _generate_reason(api_key: str, key: str, prompt: str):
+    """Upstream call for one prompt, run once per flight; caches the reason"""
+    def generate(budget: float) -> str:
+        response = get_model(api_key).generate_content(prompt)
+        reason = response.text.strip()
+        reason_cache.set(key, reason)
+        return reason
+    return generate
+
+# --- Reason Generation ---
+def build_prompt(product_a, product_b) -> str:
+    return f"Compare these two products for sustainability.\nProduct A: {product_a['name']}, {product_a.get('description', '')}\nProduct B: {product_b['name']}, {product_b.get('description', '')}\nWhich is greener and why? Give short answer."
+
+def get_fallback_reason(product_a, product_b) -> str:
+    """Deterministic explanation used when Gemini is unavailable"""
+    return f"{product_b['name']} is more sustainable than {product_a['name']} because it is organic, uses better packaging, and has a lower carbon footprint."
+
+@timed()
+def get_gemini_reason(product_a, product_b, fallback: bool = True):
     """
     Calls Gemini API to compare two products and return a sustainability reason.
-    Falls back to a dummy response if no API key is set or on error.
+    Cached, then pre-generated, reasons are served first. Falls back to a dummy response if
+    no API key is set or on error, and to the deterministic fallback when the
+    upstream guard times out or its breaker is open; with fallback=False
+    those cases raise instead. Successful responses are cached per product pair.
     """
+    key = reason_cache_key(product_a, product_b)
+    cached = lookup_reason(key)
+    if cached is not None:
+        return cached
     api_key = get_gemini_api_key()
     if not api_key:
+        if not fallback:
+            raise RuntimeError("GEMINI_API_KEY is not set")
         # Dummy fallback
-        return f"{product_b['name']} is more sustainable than {product_a['name']} because it is organic, uses better packaging, and has a lower carbon footprint."
+        return get_fallback_reason(product_a, product_b)
+    try:
+        return gemini_guard.call(key, _generate_reason(api_key, key, build_prompt(product_a, product_b)))
+    except UpstreamUnavailable:
+        if not fallback:
+            raise
+        return get_fallback_reason(product_a, product_b)
+    except Exception as e:
+        if not fallback:
+            raise
+        print(f"Gemini API error: {e}")
+        return f"(Gemini API error, using dummy reason) {product_b['name']} is more sustainable than {product_a['name']}."
+
+
+@timed()
+async def get_gemini_reason_async(product_a, product_b):
+    """
+    Non-blocking get_gemini_reason for the ASGI app: awaits the same guarded
+    upstream call (run on the guard's threads) and shares the reason cache.
+    """
+    key = reason_cache_key(product_a, product_b)
+    cached = reason_cache.get(key, memory_only=True)
+    if cached is None:
+        if reason_cache.persist or STORED_REASONS:
+            # The persistent tier and stored reasons read SQLite, so keep them off the event loop
+            cached = await asyncio.get_running_loop().run_in_executor(None, lookup_reason, key)
+        else:
+            cached = reason_cache.get(key)
+    if cached is not None:
+        return cached
+    api_key = get_gemini_api_key()
+    if not api_key:
+        return get_fallback_reason(product_a, product_b)
     try:
-        genai.configure(api_key=api_key)
-        prompt = f"Compare these two products for sustainability.\nProduct A: {product_a['name']}, {product_a.get('description', '')}\nProduct B: {product_b['name']}, {product_b.get('description', '')}\nWhich is greener and why? Give short answer."
-        model = genai.GenerativeModel("gemini-2.0-flash") 
-        response = model.generate_content(prompt)
-        return response.text.strip()
+        return await gemini_guard.call_async(key, _generate_reason(api_key, key, build_prompt(product_a, product_b)))
+    except UpstreamUnavailable:
+        return get_fallback_reason(product_a, product_b)
     except Exception as e:
         print(f"Gemini API error: {e}")
-        return f"(Gemini API error, using dummy reason) {product_b['name']} is more sustainable than {product_a['name']}." 
\ No newline at end of file
+        return f"(Gemini API error, using dummy reason) {product_b['name']} is more sustainable than {product_a['name']}."
+
+# --- Batched Generation ---
+def build_batch_prompt(pairs) -> str:
+    lines = [
+        "Compare each numbered pair of products for sustainability.",
+        "For each pair, say which is greener and why in one or two sentences.",
+        f"Respond only with a JSON array of {len(pairs)} strings, one per pair, in order.",
+    ]
+    for i, (product_a, product_b) in enumerate(pairs, 1):
+        lines.append(f"{i}. Product A: {product_a['name']}, {product_a.get('description', '')} | "
+                     f"Product B: {product_b['name']}, {product_b.get('description', '')}")
+    return "\n".join(lines)
+
+def parse_batch_response(text: str, expected: int) -> Optional[list]:
+    """Extract the JSON array of reasons from a batched response"""
+    text = text.strip()
+    start, end = text.find('['), text.rfind(']')
+    if start == -1 or end <= start:
+        return None
+    try:
+        reasons = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(reasons, list) or len(reasons) != expected:
+        return None
+    return [str(r).strip() for r in reasons]
+
+def _generate_batch(api_key: str, keys: list, pairs: list):
+    """Upstream call for one batched prompt; caches the parsed reasons"""
+    def generate(budget: float) -> Optional[list]:
+        response = get_model(api_key).generate_content(build_batch_prompt(pairs))
+        generated = parse_batch_response(response.text, len(pairs))
+        if generated is not None:
+            for key, reason in zip(keys, generated):
+                reason_cache.set(key, reason)
+        return generated
+    return generate
+
+@timed()
+def get_gemini_reasons(pairs) -> list:
+    """
+    Reasons for many (product_a, product_b) pairs, in order.
+    Cached and stored pairs are served without a call; the rest are sent to Gemini
+    together in batched prompts through the upstream guard. Falls back per
+    pair like get_gemini_reason.
+    """
+    keys = [reason_cache_key(product_a, product_b) for product_a, product_b in pairs]
+    reasons = [None] * len(pairs)
+    missing = {}  # cache key -> indexes of pairs needing that reason
+    for i, key in enumerate(keys):
+        cached = reason_cache.get(key)
+        if cached is not None:
+            reasons[i] = cached
+        else:
+            missing.setdefault(key, []).append(i)
+    if STORED_REASONS and missing:
+        try:
+            stored = get_stored_reasons(list(missing))
+        except Exception as e:
+            print(f"Stored reason read error: {e}")
+            stored = {}
+        for key, reason in stored.items():
+            reason_cache.remember(key, reason)
+            for i in missing.pop(key):
+                reasons[i] = reason
+    if not get_gemini_api_key():
+        for key, indexes in missing.items():
+            for i in indexes:
+                reasons[i] = get_fallback_reason(*pairs[i])
+        return reasons
+
+    pending = list(missing)
+    for start in range(0, len(pending), REASON_BATCH_SIZE):
+        chunk = pending[start:start + REASON_BATCH_SIZE]
+        chunk_pairs = [pairs[missing[key][0]] for key in chunk]
+        # Identical batches in flight at once share one upstream call
+        batch_key = "batch:" + hashlib.sha1("\x1f".join(chunk).encode('utf-8')).hexdigest()
+        generated, unavailable = None, False
+        try:
+            generated = gemini_guard.call(batch_key, _generate_batch(get_gemini_api_key(), chunk, chunk_pairs),
+                                          GEMINI_BATCH_BUDGET)
+            if generated is None:
+                print(f"Gemini batch response could not be parsed for {len(chunk)} pairs")
+        except UpstreamUnavailable:
+            unavailable = True
+        except Exception as e:
+            print(f"Gemini API error: {e}")
+        for j, key in enumerate(chunk):
+            product_a, product_b = chunk_pairs[j]
+            if generated is not None:
+                reason = generated[j]
+            elif unavailable:
+                reason = get_fallback_reason(product_a, product_b)
+            else:
+                reason = f"(Gemini API error, using dummy reason) {product_b['name']} is more sustainable than {product_a['name']}."
+            for i in missing[key]:
+                reasons[i] = reason
+    return reasons
+
+# --- Deferred Generation ---
+class ReasonJobs:
+    """Generates reasons on a background executor so requests don't wait.
+
+    Job ids are the reason cache key, so a finished reason can also be
+    resolved through the (optionally persistent) cache by another process.
+    With ``shared`` enabled, job state and results (fallback text included)
+    are also written to SQLite, so a poll answered by another worker sees a
+    pending job as pending and a finished one as finished.
+    """
+
+    def __init__(self, workers: int = REASON_WORKERS, timeout: float = REASON_TIMEOUT,
+                 limit: int = REASON_JOB_LIMIT, shared: bool = REASON_JOBS_SHARED, ttl: float = REASON_JOB_TTL):
+        self.workers = workers
+        self.timeout = timeout
+        self.limit = limit
+        self.shared = shared
+        self.ttl = ttl
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pid = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # Executor threads don't survive fork, so create one per process
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='reason')
+            self._pid = os.getpid()
+            self._jobs.clear()
+        return self._executor
+
+    def _load_shared(self, job_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with get_db_connection() as conn:
+                row = conn.execute('SELECT status, reason, fallback, submitted_at FROM reason_jobs WHERE job_id=?',
+                                   (job_id,)).fetchone()
+        except Exception as e:
+            print(f"Reason job read error: {e}")
+            return None
+        if row is None or row[3] < time.time() - self.ttl:
+            return None
+        return {'status': row[0], 'reason': row[1], 'fallback': row[2], 'submitted_at': row[3]}
+
+    def _save_shared(self, job_id: str, status: str, reason: Optional[str], fallback: str, submitted_at: float):
+        try:
+            with get_db_connection() as conn:
+                conn.execute('INSERT OR REPLACE INTO reason_jobs (job_id, status, reason, fallback, submitted_at) '
+                             'VALUES (?, ?, ?, ?, ?)', (job_id, status, reason, fallback, submitted_at))
+                conn.execute('DELETE FROM reason_jobs WHERE submitted_at < ?', (time.time() - self.ttl,))
+                conn.commit()
+        except Exception as e:
+            print(f"Reason job write error: {e}")
+
+    def _finish_shared(self, job_id: str, future: Future, fallback: str, submitted_at: float):
+        try:
+            self._save_shared(job_id, 'ready', future.result(), fallback, submitted_at)
+        except Exception:
+            self._save_shared(job_id, 'fallback', fallback, fallback, submitted_at)
+
+    def _shared_status(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        if job['status'] != 'pending':
+            return {'status': job['status'], 'reason': job['reason']}
+        if time.time() - job['submitted_at'] >= self.timeout:
+            return {'status': 'timeout', 'reason': job['fallback']}
+        return {'status': 'pending', 'reason': None}
+
+    def submit(self, product_a, product_b) -> str:
+        """Start generating a reason; returns the job id"""
+        job_id = reason_cache_key(product_a, product_b)
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and not (job['future'].done() and job['timed_out']):
+                self._jobs.move_to_end(job_id)
+                return job_id
+        if self.shared:
+            job = self._load_shared(job_id)
+            # Another worker is generating it, or already has
+            if job is not None and self._shared_status(job)['status'] in ('pending', 'ready'):
+                return job_id
+        cached = reason_cache.get(job_id) if get_gemini_api_key() else None
+        fallback = get_fallback_reason(product_a, product_b)
+        submitted_at = time.time()
+        if self.shared:
+            # Written before the work starts, so a finished job is never overwritten by 'pending'
+            self._save_shared(job_id, 'pending' if cached is None else 'ready', cached, fallback, submitted_at)
+        with self._lock:
+            executor = self._get_executor()
+            if cached is not None:
+                future: Future = Future()
+                future.set_result(cached)
+            else:
+                future = executor.submit(get_gemini_reason, product_a, product_b)
+                if self.shared:
+                    future.add_done_callback(lambda f: self._finish_shared(job_id, f, fallback, submitted_at))
+            self._jobs[job_id] = {
+                'future': future,
+                'fallback': fallback,
+                'submitted_at': submitted_at,
+                'timed_out': False,
+            }
+            while len(self._jobs) > self.limit:
+                self._jobs.popitem(last=False)
+        return job_id
+
+    def _shared_result(self, job_id: str, wait: float) -> Optional[Dict[str, Any]]:
+        """result() for a job submitted by another worker, polling SQLite while it's pending"""
+        deadline = time.time() + wait
+        while True:
+            job = self._load_shared(job_id)
+            if job is None:
+                return None
+            status = self._shared_status(job)
+            remaining = min(deadline, job['submitted_at'] + self.timeout) - time.time()
+            if status['status'] != 'pending' or remaining <= 0:
+                return status
+            time.sleep(min(REASON_JOB_POLL_INTERVAL, remaining))
+
+    def result(self, job_id: str, wait: float = 0) -> Optional[Dict[str, Any]]:
+        """Status of a job, optionally waiting up to `wait` seconds for it.
+
+        Returns None for unknown ids. Jobs that outlive the generation
+        timeout resolve to the deterministic fallback text.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            if self.shared:
+                shared = self._shared_result(job_id, wait)
+                if shared is not None:
+                    return shared
+            cached = reason_cache.get(job_id)
+            if cached is None:
+                return None
+            return {'status': 'ready', 'reason': cached}
+
+        future = job['future']
+        remaining = job['submitted_at'] + self.timeout - time.time()
+        if not future.done() and wait > 0 and remaining > 0:
+            try:
+                future.result(timeout=min(wait, remaining))
+            except FutureTimeoutError:
+                pass
+            except Exception:
+                pass
+        if future.done():
+            try:
+                return {'status': 'ready', 'reason': future.result()}
+            except Exception as e:
+                print(f"Reason generation error: {e}")
+                return {'status': 'fallback', 'reason': job['fallback']}
+        if time.time() - job['submitted_at'] >= self.timeout:
+            job['timed_out'] = True
+            return {'status': 'timeout', 'reason': job['fallback']}
+        return {'status': 'pending', 'reason': None}
+
+reason_jobs = ReasonJobs()
+
+def submit_reason_job(product_a, product_b) -> str:
+    return reason_jobs.submit(product_a, product_b)
+
+def get_reason_job(job_id: str, wait: float = 0) -> Optional[Dict[str, Any]]:
+    return reason_jobs.result(job_id, wait)
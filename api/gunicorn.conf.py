@@ -0,0 +1,39 @@
+"""
+Production gunicorn profile for the ESG Recommender API.
+
+Run with:  cd api && gunicorn -c gunicorn.conf.py app:app
+
+Schema setup, seeding and rescoring run once in the master before any
+worker is forked; workers then share the SQLite-backed response and reason
+caches so each catalog response and Gemini reason is produced only once,
+and deferred reason jobs so any worker can answer a poll.
+"""
+import os
+
+# --- Server ---
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+# Import the app in the master so workers share its pages copy-on-write
+preload_app = True
+
+# --- Shared caches ---
+# Must be set before the app is imported (cache settings are read at import)
+os.environ.setdefault('ESG_SHARED_CACHE', 'true')
+os.environ.setdefault('ESG_REASON_CACHE_PERSIST', 'true')
+# A deferred reason can be polled on any worker, not just the one that started it
+os.environ.setdefault('ESG_SHARED_REASON_JOBS', 'true')
+
+def on_starting(server):
+    """Create/migrate the schema once, before any worker exists"""
+    from app import startup
+    import db
+
+    startup()
+    # Workers must not inherit the master's SQLite connections
+    db.close_pool()
+    os.environ['ESG_SCHEMA_READY'] = '1'
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Bulk product ingestion from supplier catalogs.
+
+Streams CSV or NDJSON files in constant memory, validates each row, scores
+it with ESGScorer and upserts by supplier SKU in large chunked transactions.
+Rows without a SKU are rejected unless --allow-missing-sku is given; those
+rows are plain inserts, so loading the same file twice duplicates them.
+
+Usage:
+    python ingest.py catalog.csv
+    python ingest.py feed.ndjson --chunk-size 10000 --db /path/to/esg_recommender.db
+"""
+import argparse
+import csv
+import json
+import logging
+import math
+import sqlite3
+import time
+from itertools import islice
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+import db
+from recommender import ESGScorer, scoring_version
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 5000
+# Rows written per transaction (a multiple of the chunk size is sensible)
+DEFAULT_TRANSACTION_ROWS = 200000
+DEFAULT_PROGRESS_EVERY = 100000
+
+# Pragmas for the duration of a load: durability is traded for speed and
+# restored when the connection closes
+BULK_PRAGMAS = (
+    ('synchronous', 'OFF'),
+    ('cache_size', -262144),  # 256 MiB
+    ('temp_store', 'MEMORY'),
+)
+
+# Indexes that must stay in place while loading (the upsert conflict target)
+REQUIRED_INDEXES = {'idx_products_supplier_sku'}
+
+UPSERT_SQL = '''INSERT INTO products (supplier_sku, name, description, category, packaging,
+                                      is_organic, carbon_kg, price, esg_score, esg_grade, esg_version)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(supplier_sku) DO UPDATE SET
+                    name = excluded.name,
+                    description = excluded.description,
+                    category = excluded.category,
+                    packaging = excluded.packaging,
+                    is_organic = excluded.is_organic,
+                    carbon_kg = excluded.carbon_kg,
+                    price = excluded.price,
+                    esg_score = excluded.esg_score,
+                    esg_grade = excluded.esg_grade,
+                    esg_version = excluded.esg_version'''
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'f', ''}
+
+class RowError(ValueError):
+    """Raised for rows that fail validation"""
+
+# --- Reading & Validation ---
+def detect_format(path: str) -> str:
+    lower = path.lower()
+    if lower.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    if lower.endswith('.csv'):
+        return 'csv'
+    raise ValueError(f'Cannot detect format of {path}; pass --format')
+
+def read_rows(path: str, fmt: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Yield raw rows from a CSV or NDJSON file, one at a time"""
+    fmt = fmt or detect_format(path)
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            yield from csv.DictReader(f)
+        elif fmt == 'ndjson':
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Surface as an invalid row rather than aborting the load
+                    yield {'__error__': f'line {line_no}: invalid JSON'}
+        else:
+            raise ValueError(f'Unsupported format: {fmt}')
+
+def _parse_bool(value: Any) -> int:
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)):
+        return int(bool(value))
+    text = str(value or '').strip().lower()
+    if text in TRUE_VALUES:
+        return 1
+    if text in FALSE_VALUES:
+        return 0
+    raise RowError(f'is_organic: not a boolean: {value!r}')
+
+def _parse_float(row: Dict[str, Any], field: str) -> float:
+    value = row.get(field)
+    if value is None or value == '':
+        raise RowError(f'missing {field}')
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise RowError(f'{field}: not a number: {value!r}')
+    if number < 0 or not math.isfinite(number):
+        raise RowError(f'{field}: must be a finite non-negative number')
+    return number
+
+def validate_row(row: Dict[str, Any], allow_missing_sku: bool = False) -> Tuple:
+    """Normalize a raw row to (sku, name, description, category, packaging, is_organic, carbon_kg, price)"""
+    if '__error__' in row:
+        raise RowError(row['__error__'])
+    name = str(row.get('name') or '').strip()
+    category = str(row.get('category') or '').strip().lower()
+    if not name:
+        raise RowError('missing name')
+    if not category:
+        raise RowError('missing category')
+    sku = str(row.get('supplier_sku') or row.get('sku') or '').strip() or None
+    if sku is None and not allow_missing_sku:
+        raise RowError('missing sku')
+    return (
+        sku,
+        name,
+        str(row.get('description') or '').strip(),
+        category,
+        str(row.get('packaging') or '').strip().lower(),
+        _parse_bool(row.get('is_organic')),
+        _parse_float(row, 'carbon_kg'),
+        _parse_float(row, 'price'),
+    )
+
+def score_chunk(rows: List[Tuple]) -> List[Tuple]:
+    """Append precomputed ESG score, grade and scoring version to validated rows"""
+    version = scoring_version()
+    scores, grades = ESGScorer.score_columns(
+        [r[5] for r in rows], [r[4] for r in rows], [r[6] for r in rows], [r[7] for r in rows])
+    return [row + (score, grade, version) for row, score, grade in zip(rows, scores.tolist(), grades.tolist())]
+
+# --- Loading ---
+def _deferrable_indexes(conn: sqlite3.Connection) -> List[Tuple[str, str]]:
+    rows = conn.execute("SELECT name, sql FROM sqlite_master WHERE type='index' AND tbl_name='products' "
+                        "AND sql IS NOT NULL").fetchall()
+    return [(name, sql) for name, sql in rows if name not in REQUIRED_INDEXES]
+
+def _restore_indexes(conn: sqlite3.Connection, indexes: List[Tuple[str, str]]):
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+    for name, sql in indexes:
+        if name not in existing:
+            logger.info(f"Rebuilding index {name}")
+            conn.execute(sql)
+
+def ingest_products(rows: Iterable[Dict[str, Any]], chunk_size: int = DEFAULT_CHUNK_SIZE,
+                    transaction_rows: int = DEFAULT_TRANSACTION_ROWS,
+                    progress_every: int = DEFAULT_PROGRESS_EVERY,
+                    defer_indexes: bool = True, max_errors_logged: int = 20,
+                    allow_missing_sku: bool = False) -> Dict[str, Any]:
+    """
+    Validate, score and upsert products from an iterable of raw rows.
+    Returns load statistics (rows read/written/invalid, rows per second).
+    With allow_missing_sku, SKU-less rows are inserted rather than rejected
+    and are not idempotent: every load inserts them again.
+    """
+    db.ensure_schema()
+    stats = {'rows_read': 0, 'rows_written': 0, 'rows_invalid': 0}
+    started = time.time()
+    next_progress = progress_every
+
+    conn = db.open_connection(isolation_level=None)  # explicit transactions
+    deferred: List[Tuple[str, str]] = []
+    committed = 0
+    try:
+        for name, value in BULK_PRAGMAS:
+            conn.execute(f'PRAGMA {name}={value}')
+
+        if defer_indexes:
+            deferred = _deferrable_indexes(conn)
+        for name, _ in deferred:
+            conn.execute(f'DROP INDEX IF EXISTS {name}')
+
+        rows = iter(rows)
+        in_transaction = 0
+        conn.execute('BEGIN')
+        while True:
+            raw_chunk = list(islice(rows, chunk_size))
+            if not raw_chunk:
+                break
+            valid = []
+            for raw in raw_chunk:
+                stats['rows_read'] += 1
+                try:
+                    valid.append(validate_row(raw, allow_missing_sku))
+                except RowError as e:
+                    stats['rows_invalid'] += 1
+                    if stats['rows_invalid'] <= max_errors_logged:
+                        logger.warning(f"Skipping row {stats['rows_read']}: {e}")
+            if valid:
+                conn.executemany(UPSERT_SQL, score_chunk(valid))
+                stats['rows_written'] += len(valid)
+                in_transaction += len(valid)
+            if in_transaction >= transaction_rows:
+                # Each committed transaction is visible, so each bumps the version
+                db.bump_catalog_version(conn)
+                conn.execute('COMMIT')
+                committed += in_transaction
+                conn.execute('BEGIN')
+                in_transaction = 0
+            if stats['rows_read'] >= next_progress:
+                elapsed = time.time() - started
+                logger.info(f"Ingested {stats['rows_read']} rows "
+                            f"({stats['rows_read'] / elapsed:,.0f} rows/s)")
+                next_progress += progress_every
+
+        if in_transaction:
+            db.bump_catalog_version(conn)
+        conn.execute('COMMIT')
+        committed += in_transaction
+
+        _restore_indexes(conn, deferred)
+        conn.execute('ANALYZE products')
+    except BaseException:
+        # Also on KeyboardInterrupt: never leave the table without its indexes
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        _restore_indexes(conn, deferred)
+        raise
+    finally:
+        conn.close()
+        # Earlier transactions stay committed when a later one fails
+        if committed:
+            db.notify_product_changes()
+
+    elapsed = max(time.time() - started, 1e-9)
+    stats['seconds'] = round(elapsed, 3)
+    stats['rows_per_second'] = round(stats['rows_read'] / elapsed, 1)
+    logger.info(f"Ingest finished: {stats}")
+    return stats
+
+def ingest_file(path: str, fmt: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+    """Stream a CSV/NDJSON file into the products table"""
+    return ingest_products(read_rows(path, fmt), **kwargs)
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Bulk-load products from a supplier catalog')
+    parser.add_argument('path', help='CSV or NDJSON file')
+    parser.add_argument('--format', choices=['csv', 'ndjson'], help='defaults to the file extension')
+    parser.add_argument('--db', help='database path (defaults to ESG_DB_PATH)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--transaction-rows', type=int, default=DEFAULT_TRANSACTION_ROWS)
+    parser.add_argument('--progress-every', type=int, default=DEFAULT_PROGRESS_EVERY)
+    parser.add_argument('--no-defer-indexes', action='store_true', help='keep secondary indexes during the load')
+    parser.add_argument('--allow-missing-sku', action='store_true',
+                        help='insert rows without a SKU (not idempotent: re-running duplicates them)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    if args.db:
+        db.DB_PATH = args.db
+    stats = ingest_file(args.path, args.format, chunk_size=args.chunk_size,
+                        transaction_rows=args.transaction_rows, progress_every=args.progress_every,
+                        defer_indexes=not args.no_defer_indexes, allow_missing_sku=args.allow_missing_sku)
+    print(json.dumps(stats))
+
+if __name__ == '__main__':
+    main()
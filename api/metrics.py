@@ -0,0 +1,206 @@
+"""
+Request timing instrumentation for the ESG Recommender API.
+
+Records latency histograms per route and per stage (db.py helpers, scoring,
+Gemini calls), SQL statements executed per request and cache statistics,
+and renders them in the Prometheus text exposition format.
+
+Stages are timed with the ``timed`` decorator or the ``span`` context
+manager; time spent inside a request is also attributed to that request
+for the slow-request log (ESG_SLOW_REQUEST_MS).
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, Any, Callable, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv('ESG_METRICS', 'true').lower() == 'true'
+# Log requests slower than this many milliseconds (0 disables the slow log)
+SLOW_REQUEST_MS = float(os.getenv('ESG_SLOW_REQUEST_MS', '0'))
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + '}'
+
+class Histogram:
+    """Thread-safe Prometheus-style histogram with fixed buckets and labels"""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # [per-bucket counts..., sum, count]
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labels, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                le = _format_labels(self.label_names + ('le',), labels + (repr(float(bound)),))
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+            le = _format_labels(self.label_names + ('le',), labels + ('+Inf',))
+            lines.append(f'{self.name}_bucket{le} {values[-1]}')
+            label_text = _format_labels(self.label_names, labels)
+            lines.append(f'{self.name}_sum{label_text} {values[-2]:.6f}')
+            lines.append(f'{self.name}_count{label_text} {values[-1]}')
+        return lines
+
+request_latency = Histogram('esg_request_duration_seconds', 'Request latency by route',
+                            ('route', 'method', 'status'))
+stage_latency = Histogram('esg_stage_duration_seconds', 'Time spent per stage (db helpers, scoring, Gemini)',
+                          ('stage',))
+request_db_queries = Histogram('esg_request_db_queries', 'SQL statements executed per request', ('route',),
+                               QUERY_COUNT_BUCKETS)
+HISTOGRAMS = [request_latency, stage_latency, request_db_queries]
+
+# --- Per-request context ---
+class RequestMetrics:
+    __slots__ = ('started', 'stages', 'db_queries')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, List] = {}  # stage -> [calls, seconds]
+        self.db_queries = 0
+
+_current: 'contextvars.ContextVar[Optional[RequestMetrics]]' = contextvars.ContextVar('esg_request_metrics',
+                                                                                    default=None)
+
+def start_request() -> contextvars.Token:
+    """Begin timing a request in the current context"""
+    return _current.set(RequestMetrics())
+
+def finish_request(token: contextvars.Token, route: str, method: str, status: int) -> Optional[RequestMetrics]:
+    """Record the request started with start_request; logs it when slow"""
+    current = _current.get()
+    _current.reset(token)
+    if current is None:
+        return None
+    elapsed = time.perf_counter() - current.started
+    request_latency.observe(elapsed, route, method, str(status))
+    request_db_queries.observe(current.db_queries, route)
+    if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+        stages = sorted(current.stages.items(), key=lambda item: item[1][1], reverse=True)[:8]
+        breakdown = ', '.join(f'{name}={seconds * 1000:.1f}ms x{calls}' for name, (calls, seconds) in stages)
+        logger.warning(f"Slow request {method} {route} -> {status}: {elapsed * 1000:.1f} ms, "
+                       f"{current.db_queries} queries; {breakdown or 'no stages'}")
+    return current
+
+def record_stage(stage: str, seconds: float):
+    stage_latency.observe(seconds, stage)
+    current = _current.get()
+    if current is not None:
+        entry = current.stages.get(stage)
+        if entry is None:
+            current.stages[stage] = [1, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+
+def count_query(statement: str):
+    """sqlite3 trace callback: counts statements against the current request"""
+    current = _current.get()
+    if current is not None:
+        current.db_queries += 1
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time a block of code as `stage`"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+def timed(stage: Optional[str] = None) -> Callable:
+    """Decorator timing every call as `stage` (default: module.qualified_name)"""
+    def decorator(fn: Callable) -> Callable:
+        if not METRICS_ENABLED:
+            return fn
+        name = stage or f'{fn.__module__}.{fn.__qualname__}'
+
+        if asyncio.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    record_stage(name, time.perf_counter() - started)
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record_stage(name, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+# --- Exposition ---
+_stats_sources: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+def register_stats(name: str, source: Callable[[], Dict[str, Any]]):
+    """Expose the numeric fields of source() as gauges named esg_<name>_<field>"""
+    _stats_sources[name] = source
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines: List[str] = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    for name, source in sorted(_stats_sources.items()):
+        try:
+            stats = source()
+        except Exception as e:
+            logger.error(f"Metrics source {name} failed: {e}")
+            continue
+        for field, value in sorted(stats.items()):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            metric = f'esg_{name}_{field}'
+            lines.append(f'# TYPE {metric} gauge')
+            lines.append(f'{metric} {value}')
+    return '\n'.join(lines) + '\n'
+
+def reset():
+    for histogram in HISTOGRAMS:
+        histogram.clear()
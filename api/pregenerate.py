@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Offline pre-generation of recommendation reasons.
+
+Walks the catalog in id order, finds each product's greener alternative with
+the recommender, and generates the missing reasons with get_gemini_reason on
+a bounded worker pool, rate-limited to --rate calls per second. Reasons are
+stored in the recommendation_reasons table, which get_gemini_reason reads
+before calling Gemini, so /api/recommendation serves them without an LLM
+call. Pairs already stored are skipped, so an interrupted run resumes where
+it left off; stored reasons of a product whose alternative (or text) changed
+are pruned as the walk passes it. The run exits non-zero when reasons were
+missing and none could be generated (a bad key, or Gemini rejecting every call).
+
+Usage:
+    python pregenerate.py --workers 4 --rate 5
+    python pregenerate.py --db /path/to/esg_recommender.db --limit 1000
+"""
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, Any, Iterator, List, Optional, Set, Tuple
+
+import db
+from gemini import (GEMINI_MAX_CONCURRENCY, GEMINI_MODEL_NAME, get_gemini_api_key, get_gemini_reason,
+                    reason_cache_key)
+from recommender import ensure_scores_current, find_greener_alternatives
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = min(4, GEMINI_MAX_CONCURRENCY)
+# Gemini calls per second across all workers (0 = unlimited)
+DEFAULT_RATE = 5.0
+DEFAULT_PAGE_SIZE = 500
+DEFAULT_RETRIES = 3
+# Generated reasons written per transaction
+WRITE_BATCH = 100
+MAX_BACKOFF = 30.0
+DEFAULT_PROGRESS_EVERY = 10000
+
+class RateLimiter:
+    """Token bucket shared by the worker threads"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, stop: Optional[threading.Event] = None) -> bool:
+        """Wait for a token; False if stop was set meanwhile"""
+        if self.rate <= 0:
+            return True
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                delay = (1 - self._tokens) / self.rate
+            if stop is not None:
+                if stop.wait(delay):
+                    return False
+            else:
+                time.sleep(delay)
+
+def iter_missing_pairs(stats: Dict[str, Any], page_size: int = DEFAULT_PAGE_SIZE,
+                       limit: Optional[int] = None) -> Iterator[Tuple[str, Dict[str, Any], Dict[str, Any]]]:
+    """(key, product, alternative) for every product whose reason is not stored yet"""
+    after_id = None
+    while limit is None or stats['products'] < limit:
+        size = page_size if limit is None else min(page_size, limit - stats['products'])
+        page = db.query_products(after_id=after_id, limit=size)
+        if not page:
+            return
+        after_id = page[-1]['id']
+        stats['products'] += len(page)
+        alternatives = find_greener_alternatives(page)
+        pairs = [(reason_cache_key(product, alternatives[product['id']]), product, alternatives[product['id']])
+                 for product in page if alternatives.get(product['id']) is not None]
+        keys = [key for key, _, _ in pairs]
+        stats['pruned'] += db.prune_stored_reasons([product['id'] for product in page], keys)
+        stored = db.get_stored_reasons(keys)
+        stats['pairs'] += len(pairs)
+        stats['already_stored'] += len(stored)
+        for key, product, alternative in pairs:
+            if key not in stored:
+                yield key, product, alternative
+
+def generate(product: Dict[str, Any], alternative: Dict[str, Any], limiter: RateLimiter,
+             stop: threading.Event, retries: int) -> Optional[str]:
+    """A Gemini reason for the pair (never the fallback text), or None after retries"""
+    backoff = 1.0
+    for attempt in range(retries + 1):
+        if not limiter.acquire(stop):
+            return None
+        try:
+            return get_gemini_reason(product, alternative, fallback=False)
+        except Exception as e:
+            if attempt == retries:
+                logger.warning(f"Giving up on {product['id']} -> {alternative['id']}: {e!r}")
+                return None
+            # Also covers an open circuit breaker, which fails immediately
+            if stop.wait(backoff):
+                return None
+            backoff = min(backoff * 2, MAX_BACKOFF)
+    return None
+
+def pregenerate(workers: int = DEFAULT_WORKERS, rate: float = DEFAULT_RATE, page_size: int = DEFAULT_PAGE_SIZE,
+                limit: Optional[int] = None, retries: int = DEFAULT_RETRIES,
+                progress_every: int = DEFAULT_PROGRESS_EVERY) -> Dict[str, Any]:
+    """Generate and store every missing reason; stops cleanly on KeyboardInterrupt"""
+    started = time.time()
+    stats = {'products': 0, 'pairs': 0, 'already_stored': 0, 'generated': 0, 'failed': 0, 'pruned': 0,
+             'interrupted': False}
+    limiter = RateLimiter(rate, burst=workers)
+    stop = threading.Event()
+    buffer: List[Tuple[str, int, int, str, str]] = []
+    in_flight: Dict[Future, Tuple[str, int, int]] = {}
+    next_progress = progress_every
+
+    def collect(done: Set[Future]):
+        nonlocal next_progress
+        for future in done:
+            key, product_id, alternative_id = in_flight.pop(future)
+            reason = None if future.cancelled() else future.result()
+            if reason is None:
+                stats['failed'] += 1
+                continue
+            buffer.append((key, product_id, alternative_id, reason, GEMINI_MODEL_NAME))
+            stats['generated'] += 1
+        if len(buffer) >= WRITE_BATCH:
+            db.save_stored_reasons(buffer)
+            buffer.clear()
+        if progress_every and stats['products'] >= next_progress:
+            next_progress = stats['products'] + progress_every
+            logger.info(f"{stats['products']} products, {stats['generated']} reasons generated, "
+                        f"{stats['already_stored']} already stored, {stats['failed']} failed")
+
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pregenerate')
+    try:
+        for key, product, alternative in iter_missing_pairs(stats, page_size, limit):
+            # Keep the queue short so an interruption loses little work
+            while len(in_flight) >= workers * 2:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            future = executor.submit(generate, product, alternative, limiter, stop, retries)
+            in_flight[future] = (key, product['id'], alternative['id'])
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            collect(done)
+    except KeyboardInterrupt:
+        stats['interrupted'] = True
+        logger.info("Interrupted; saving finished reasons (rerun to resume)")
+        stop.set()
+        done, _ = wait(in_flight)
+        collect(done)
+    finally:
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+        if buffer:
+            db.save_stored_reasons(buffer)
+            buffer.clear()
+    stats['stored_total'] = db.count_stored_reasons()
+    stats['seconds'] = round(time.time() - started, 2)
+    return stats
+
+def nothing_stored(stats: Dict[str, Any]) -> bool:
+    """Whether a run had reasons to generate but stored none of them"""
+    return stats['failed'] > 0 and stats['generated'] == 0
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Pre-generate and store Gemini reasons for every recommendation')
+    parser.add_argument('--db', help='database path (defaults to ESG_DB_PATH)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='concurrent Gemini calls')
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE, help='Gemini calls per second (0 = unlimited)')
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE)
+    parser.add_argument('--limit', type=int, help='stop after this many products')
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES)
+    parser.add_argument('--progress-every', type=int, default=DEFAULT_PROGRESS_EVERY)
+    args = parser.parse_args(argv)
+
+    if not get_gemini_api_key():
+        parser.error('GEMINI_API_KEY is not set; only generated reasons are stored')
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    if args.db:
+        db.DB_PATH = args.db
+    db.ensure_schema()
+    ensure_scores_current()
+    stats = pregenerate(workers=args.workers, rate=args.rate, page_size=args.page_size, limit=args.limit,
+                        retries=args.retries, progress_every=args.progress_every)
+    print(json.dumps(stats))
+    if nothing_stored(stats):
+        logger.error(f"No reasons stored: all {stats['failed']} Gemini calls failed")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+"""
+Opt-in sampling profiler for live requests.
+
+A fraction of requests (ESG_PROFILE_RATE), or requests whose X-Profile
+header carries ESG_ADMIN_TOKEN when ESG_PROFILE_HEADER is enabled, are sampled by a
+background thread reading sys._current_frames(). Each profiled request is
+written to ESG_PROFILE_DIR as collapsed stacks ("a;b;c count" lines), ready
+for flamegraph.pl or speedscope; hot_functions() aggregates every profile
+in the directory, across worker processes.
+"""
+import glob
+import hmac
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+from functools import wraps
+from typing import Dict, Any, List, Optional
+
+from flask import request
+
+logger = logging.getLogger(__name__)
+
+# Fraction of requests to profile (0 disables sampling by rate)
+PROFILE_RATE = float(os.getenv('ESG_PROFILE_RATE', '0'))
+# Honor the X-Profile request header; it must carry ESG_ADMIN_TOKEN, so it is ignored without one
+PROFILE_HEADER = os.getenv('ESG_PROFILE_HEADER', 'false').lower() == 'true'
+PROFILE_DIR = os.getenv('ESG_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'esg-profiles'))
+# Seconds between stack samples
+PROFILE_INTERVAL = float(os.getenv('ESG_PROFILE_INTERVAL', '0.001'))
+# Oldest profiles written by this process are removed beyond this many
+PROFILE_MAX_FILES = int(os.getenv('ESG_PROFILE_MAX_FILES', '500'))
+ADMIN_TOKEN = os.getenv('ESG_ADMIN_TOKEN')
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    name = getattr(code, 'co_qualname', code.co_name)
+    return f'{os.path.basename(code.co_filename)}:{name}'.replace(';', ':').replace(' ', '_')
+
+class Sampler:
+    """Samples the stacks of registered threads on a single background thread"""
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        # thread id -> (stop code object, Counter of collapsed stacks)
+        self._targets: Dict[int, tuple] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    def _ensure_thread(self):
+        # The sampler thread does not survive a fork
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='esg-profiler', daemon=True)
+            self._thread.start()
+
+    def start(self, thread_id: int, root_code) -> Counter:
+        """Begin sampling thread_id; stacks are cut at the frame running root_code"""
+        stacks: Counter = Counter()
+        with self._lock:
+            self._targets[thread_id] = (root_code, stacks)
+            self._ensure_thread()
+        self._wakeup.set()
+        return stacks
+
+    def stop(self, thread_id: int):
+        with self._lock:
+            self._targets.pop(thread_id, None)
+
+    def _sample(self):
+        with self._lock:
+            targets = dict(self._targets)
+        if not targets:
+            return
+        frames = sys._current_frames()
+        for thread_id, (root_code, stacks) in targets.items():
+            frame = frames.get(thread_id)
+            labels = []
+            while frame is not None:
+                labels.append(frame_label(frame))
+                if frame.f_code is root_code:
+                    break
+                frame = frame.f_back
+            if labels:
+                stacks[';'.join(reversed(labels))] += 1
+
+    def _run(self):
+        while True:
+            self._wakeup.clear()
+            with self._lock:
+                idle = not self._targets
+            if idle:
+                # start() sets the event after registering, so no wakeup is lost
+                self._wakeup.wait()
+                continue
+            self._sample()
+            time.sleep(self.interval)
+
+sampler = Sampler()
+_written: deque = deque()
+_written_lock = threading.Lock()
+_sequence = 0
+
+def is_admin_token(value: Optional[str]) -> bool:
+    """Whether value is the configured admin token (never true without one)"""
+    return bool(ADMIN_TOKEN) and value is not None and hmac.compare_digest(value, ADMIN_TOKEN)
+
+def should_profile() -> bool:
+    if PROFILE_HEADER and 'X-Profile' in request.headers:
+        return is_admin_token(request.headers.get('X-Profile'))
+    return PROFILE_RATE > 0 and random.random() < PROFILE_RATE
+
+def write_profile(route: str, stacks: Counter, elapsed: float) -> Optional[str]:
+    """Write collapsed stacks for one request; returns the file path"""
+    global _sequence
+    if not stacks:
+        return None
+    with _written_lock:
+        _sequence += 1
+        sequence = _sequence
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+    name = f'{int(time.time() * 1000)}-{os.getpid()}-{sequence}-{slug}-{int(elapsed * 1000)}ms.folded'
+    path = os.path.join(PROFILE_DIR, name)
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(path, 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write(f'{stack} {count}\n')
+    except OSError as e:
+        logger.error(f"Could not write profile {path}: {e}")
+        return None
+    with _written_lock:
+        _written.append(path)
+        while len(_written) > PROFILE_MAX_FILES:
+            old = _written.popleft()
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+    return path
+
+def profiled(view):
+    """Wrap a Flask view function so selected requests are sampled"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not should_profile():
+            return view(*args, **kwargs)
+        thread_id = threading.get_ident()
+        stacks = sampler.start(thread_id, wrapper.__code__)
+        started = time.perf_counter()
+        try:
+            return view(*args, **kwargs)
+        finally:
+            sampler.stop(thread_id)
+            route = request.url_rule.rule if request.url_rule else request.path
+            write_profile(f'{request.method} {route}', stacks, time.perf_counter() - started)
+    return wrapper
+
+def enabled() -> bool:
+    return PROFILE_RATE > 0 or PROFILE_HEADER
+
+def install(app):
+    """Wrap every registered view function of a Flask app"""
+    for endpoint, view in list(app.view_functions.items()):
+        app.view_functions[endpoint] = profiled(view)
+
+# --- Aggregation ---
+def read_profiles(route: Optional[str] = None) -> Counter:
+    """Merged collapsed stacks of all profiles on disk (optionally one route's)"""
+    pattern = None
+    if route:
+        # File names end in "-<METHOD>_<route slug>-<ms>ms.folded"
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_')
+        pattern = re.compile(rf'-(?:[A-Z]+_)?{re.escape(slug)}-\d+ms\.folded$')
+    merged: Counter = Counter()
+    for path in glob.glob(os.path.join(PROFILE_DIR, '*.folded')):
+        if pattern and not pattern.search(os.path.basename(path)):
+            continue
+        try:
+            with open(path) as f:
+                for line in f:
+                    stack, _, count = line.rstrip('\n').rpartition(' ')
+                    if stack and count.isdigit():
+                        merged[stack] += int(count)
+        except OSError:
+            continue  # removed by another worker meanwhile
+    return merged
+
+def hot_functions(stacks: Counter, limit: int = 20) -> Dict[str, Any]:
+    """Top functions by self samples (leaf frame) and inclusive samples"""
+    own: Counter = Counter()
+    inclusive: Counter = Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(';')
+        own[frames[-1]] += count
+        for name in set(frames):
+            inclusive[name] += count
+    total = sum(stacks.values())
+
+    def top(counter: Counter) -> List[Dict[str, Any]]:
+        return [{'function': name, 'samples': samples, 'percent': round(100.0 * samples / total, 2)}
+                for name, samples in counter.most_common(limit)]
+
+    return {'samples': total, 'top_self': top(own), 'top_inclusive': top(inclusive)}
+
+def profile_count() -> int:
+    return len(glob.glob(os.path.join(PROFILE_DIR, '*.folded')))
@@ -1,9 +1,40 @@
-from db import get_all_products, get_product_by_id
-from typing import Dict, Any, Optional
+from db import (get_all_products, get_product_by_id, get_products_by_ids, subscribe_product_changes, get_catalog_meta,
+                set_catalog_meta, get_catalog_version, get_unscored_products, update_product_scores,
+                get_top_scored_products, get_stale_alternative_categories, get_alternative_categories,
+                replace_category_alternatives, get_precomputed_alternative, iter_scored_candidates)
+from contextlib import closing
+from typing import Dict, Any, Iterator, Optional, List, Tuple
+import bisect
+import hashlib
+import json
+import os
+import threading
+import time
 import logging
+import numpy as np
+
+from metrics import timed
+from records import Product
+from similarity import similarity_index
 
 logger = logging.getLogger(__name__)
 
+# Where alternatives are looked up: 'sql' uses the stored esg_score index,
+# 'memory' keeps the whole catalog in a per-process ProductIndex
+ALTERNATIVE_LOOKUP = os.getenv('ESG_ALTERNATIVE_LOOKUP', 'sql').lower()
+RESCORE_CHUNK_SIZE = 5000
+# How often a memory-mode index checks the catalog version for writes made
+# by other worker processes (seconds)
+INDEX_VERSION_CHECK_INTERVAL = float(os.getenv('ESG_INDEX_VERSION_CHECK_INTERVAL', '1.0'))
+# Answer find_greener_alternative from the product_alternatives table, using
+# the live lookup only for categories changed since their last build
+PRECOMPUTED_ALTERNATIVES = os.getenv('ESG_PRECOMPUTED_ALTERNATIVES', 'true').lower() == 'true'
+# Only consider the SIMILARITY_NEIGHBORS products whose name/description is
+# most similar (cosine >= SIMILARITY_MIN) rather than the whole category
+SIMILARITY_MATCHING = os.getenv('ESG_SIMILARITY_MATCHING', 'false').lower() == 'true'
+SIMILARITY_NEIGHBORS = int(os.getenv('ESG_SIMILARITY_NEIGHBORS', '50'))
+SIMILARITY_MIN = float(os.getenv('ESG_SIMILARITY_MIN', '0.2'))
+
 class ESGScorer:
     """Enhanced ESG scoring system"""
     
@@ -65,33 +96,378 @@ class ESGScorer:
         elif score >= 2: return 'B'
         elif score >= 0: return 'C'
         else: return 'D'
+    
+    # --- Bulk (columnar) scoring ---
+    # Grade thresholds, highest first, mirroring get_sustainability_grade
+    GRADE_THRESHOLDS = ((8, 'A+'), (6, 'A'), (4, 'B+'), (2, 'B'), (0, 'C'))
+    
+    @classmethod
+    def packaging_codes(cls) -> List[str]:
+        """Packaging names by integer code; the last code means unknown"""
+        return list(cls.PACKAGING_SCORES) + ['']
+    
+    @classmethod
+    def encode_packaging(cls, packaging) -> np.ndarray:
+        """Map packaging names (any case) to codes from packaging_codes()"""
+        lookup = {name: code for code, name in enumerate(cls.PACKAGING_SCORES)}
+        unknown = len(lookup)
+        values = np.asarray(packaging, dtype=object)
+        uniques, inverse = np.unique(values.astype(str), return_inverse=True)
+        codes = np.array([lookup.get(u.lower(), unknown) for u in uniques], dtype=np.int64)
+        return codes[inverse.reshape(-1)].reshape(values.shape)
+    
+    @classmethod
+    def calculate_sustainability_scores(cls, is_organic, packaging, carbon_kg, price) -> np.ndarray:
+        """
+        Vectorized calculate_sustainability_score over columnar inputs.
+        `packaging` is either names or integer codes from encode_packaging().
+        Performs the same float operations in the same order, so results are
+        identical to the scalar function.
+        """
+        organic = np.asarray(is_organic).astype(bool)
+        carbon = np.asarray(carbon_kg, dtype=np.float64)
+        price = np.asarray(price, dtype=np.float64)
+        codes = np.asarray(packaging)
+        if codes.dtype.kind not in 'iu':
+            codes = cls.encode_packaging(codes)
+        code_scores = np.array([float(v) for v in cls.PACKAGING_SCORES.values()] + [0.0])
+        
+        score = np.where(organic, 0.0 + cls.WEIGHTS['organic'], 0.0)
+        score = score + code_scores[codes] * cls.WEIGHTS['packaging']
+        
+        carbon_weight = cls.WEIGHTS['carbon']
+        score = np.where(carbon < 1.0, score + carbon_weight * 2,
+                np.where(carbon < 2.0, score + carbon_weight,
+                np.where(carbon > 4.0, score - carbon_weight, score)))
+        
+        positive = price > 0
+        safe_price = np.where(positive, price, 1.0)
+        score = np.where(positive, score + (score / safe_price) * cls.WEIGHTS['price_efficiency'], score)
+        
+        return cls._round2(score)
+    
+    @staticmethod
+    def _round2(values: np.ndarray) -> np.ndarray:
+        """round(x, 2) with Python's exact semantics"""
+        rounded = np.round(values, 2)
+        # np.round scales by 100 first; near-ties may round differently, so
+        # defer those (rare) values to Python's correctly rounded round()
+        scaled = np.abs(values * 100)
+        ties = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+        if ties.any():
+            rounded[ties] = [round(v, 2) for v in values[ties].tolist()]
+        return rounded
+    
+    @classmethod
+    def get_sustainability_grades(cls, scores) -> np.ndarray:
+        """Vectorized get_sustainability_grade"""
+        scores = np.asarray(scores, dtype=np.float64)
+        conditions = [scores >= threshold for threshold, _ in cls.GRADE_THRESHOLDS]
+        choices = [grade for _, grade in cls.GRADE_THRESHOLDS]
+        return np.select(conditions, choices, default='D')
+    
+    @classmethod
+    @timed()
+    def score_columns(cls, is_organic, packaging, carbon_kg, price) -> Tuple[np.ndarray, np.ndarray]:
+        """Scores and grades for columnar product data"""
+        scores = cls.calculate_sustainability_scores(is_organic, packaging, carbon_kg, price)
+        return scores, cls.get_sustainability_grades(scores)
+    
+    @classmethod
+    def score_products(cls, products: List[Dict[str, Any]]) -> Tuple[np.ndarray, np.ndarray]:
+        """Scores and grades for a list of product dicts"""
+        return cls.score_columns(
+            [p.get('is_organic') for p in products],
+            [p.get('packaging') or '' for p in products],
+            [p.get('carbon_kg', 0) for p in products],
+            [p.get('price', 1) for p in products],
+        )
+
+# --- Stored Scores ---
+def scoring_version() -> str:
+    """Stamp identifying the current scoring rules; changes when weights do"""
+    rules = json.dumps([ESGScorer.WEIGHTS, ESGScorer.PACKAGING_SCORES, ESGScorer.GRADE_THRESHOLDS], sort_keys=True)
+    return hashlib.sha1(rules.encode('utf-8')).hexdigest()[:12]
+
+@timed()
+def rescore_products(product_ids: Optional[List[int]] = None, chunk_size: int = RESCORE_CHUNK_SIZE) -> int:
+    """
+    Store esg_score/esg_grade for products scored under an older (or no)
+    scoring version. Works in chunks, so an interrupted run resumes where it
+    stopped. Returns the number of rows rescored.
+    """
+    version = scoring_version()
+    total = 0
+    last_id = 0
+    while True:
+        products = get_unscored_products(version, chunk_size, product_ids, after_id=last_id)
+        if not products:
+            break
+        last_id = products[-1]['id']
+        scores, grades = ESGScorer.score_products(products)
+        update_product_scores([(score, grade, version, p['id'])
+                               for p, score, grade in zip(products, scores.tolist(), grades.tolist())])
+        total += len(products)
+    return total
+
+def ensure_scores_current() -> int:
+    """Rescore the catalog if ESGScorer's weights changed since the last run"""
+    version = scoring_version()
+    if get_catalog_meta('scoring_version') == version:
+        return 0
+    rescored = rescore_products()
+    set_catalog_meta('scoring_version', version)
+    logger.info(f"Scoring version {version}: rescored {rescored} products")
+    return rescored
+
+class ProductIndex:
+    """In-memory catalog index with scores precomputed and sorted per category.
+
+    Each category keeps a list of ``(score, -id)`` keys in ascending order, so
+    the best candidate is always at the end and ties resolve to the lowest id
+    (matching the original full-scan ordering). The lists are copied on write,
+    so readers can walk one after releasing the lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._products: Dict[int, Product] = {}
+        self._scores: Dict[int, float] = {}
+        self._categories: Dict[str, List[Tuple[float, int]]] = {}
+        self._version: Optional[int] = None
+        self._next_version_check = 0.0
+
+    @timed()
+    def load(self):
+        """(Re)build the index from the database"""
+        version = get_catalog_version()
+        products = get_all_products()
+        by_id = {}
+        scores = {}
+        categories: Dict[str, List[Tuple[float, int]]] = {}
+        scores_list = ESGScorer.score_products(products)[0].tolist() if products else []
+        for p, score in zip(products, scores_list):
+            by_id[p['id']] = p
+            scores[p['id']] = score
+            categories.setdefault(p['category'], []).append((score, -p['id']))
+        for keys in categories.values():
+            keys.sort()
+        with self._lock:
+            self._products = by_id
+            self._scores = scores
+            self._categories = categories
+            self._version = version
+            self._next_version_check = time.monotonic() + INDEX_VERSION_CHECK_INTERVAL
+            self._loaded = True
+        logger.info(f"Product index loaded: {len(by_id)} products in {len(categories)} categories")
+
+    def ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+        elif time.monotonic() >= self._next_version_check:
+            # Another worker process may have written to the catalog
+            self._next_version_check = time.monotonic() + INDEX_VERSION_CHECK_INTERVAL
+            if get_catalog_version() != self._version:
+                self.load()
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = False
+
+    def _remove_locked(self, product_id: int):
+        old = self._products.pop(product_id, None)
+        if old is None:
+            return
+        score = self._scores.pop(product_id)
+        keys = self._categories.get(old['category'])
+        if keys:
+            i = bisect.bisect_left(keys, (score, -product_id))
+            if i < len(keys) and keys[i] == (score, -product_id):
+                keys = keys[:i] + keys[i + 1:]
+            if keys:
+                self._categories[old['category']] = keys
+            else:
+                del self._categories[old['category']]
+
+    def upsert(self, product: Dict[str, Any]):
+        """Insert or replace a single product"""
+        score = ESGScorer.calculate_sustainability_score(product)
+        with self._lock:
+            self._remove_locked(product['id'])
+            self._products[product['id']] = product
+            self._scores[product['id']] = score
+            keys = list(self._categories.get(product['category'], ()))
+            bisect.insort(keys, (score, -product['id']))
+            self._categories[product['category']] = keys
+
+    def remove(self, product_id: int):
+        with self._lock:
+            self._remove_locked(product_id)
+
+    def refresh(self, product_ids: Optional[List[int]] = None):
+        """Apply product changes; None reloads the whole catalog"""
+        if product_ids is None or not self._loaded:
+            self.invalidate()
+            return
+        version = get_catalog_version()
+        for pid in product_ids:
+            product = get_product_by_id(pid)
+            if product:
+                self.upsert(product)
+            else:
+                self.remove(pid)
+        with self._lock:
+            self._version = version
+
+    # Products are read-only records, so they are handed out without copying
+    def top_candidates(self, category: str, n: int = 2) -> List[Tuple[float, Product]]:
+        """The n highest-scoring products of a category, best first"""
+        self.ensure_loaded()
+        with self._lock:
+            keys = self._categories.get(category) or []
+            return [(score, self._products[-neg_id]) for score, neg_id in reversed(keys[-n:])]
+
+    def iter_ranked(self, category: str, min_score: float,
+                    exclude_id: Optional[int] = None) -> Iterator[Tuple[float, Product]]:
+        """(score, product) scoring above min_score in a category, best first"""
+        self.ensure_loaded()
+        with self._lock:
+            keys = self._categories.get(category) or []
+            # Keys ascend by (score, -id): everything from here on scores above min_score
+            start = bisect.bisect_right(keys, (min_score, float('inf')))
+            products = self._products
+        # Walk the (never mutated) list by index rather than copying its tail
+        for i in range(len(keys) - 1, start - 1, -1):
+            score, neg_id = keys[i]
+            product = products.get(-neg_id)
+            if product is not None and -neg_id != exclude_id:
+                yield score, product
 
+    def best_alternative(self, product: Dict[str, Any], original_score: float) -> Optional[Tuple[float, Product]]:
+        """Highest-scoring product in the same category scoring above original_score"""
+        self.ensure_loaded()
+        with self._lock:
+            keys = self._categories.get(product.get('category'))
+            if not keys:
+                return None
+            # Only the top of the sorted list matters; skip the product itself
+            for i in range(len(keys) - 1, -1, -1):
+                score, neg_id = keys[i]
+                if score <= original_score:
+                    return None
+                if -neg_id != product.get('id'):
+                    return score, self._products[-neg_id]
+        return None
+
+product_index = ProductIndex()
+
+def _on_products_changed(product_ids: Optional[List[int]]):
+    # Store scores for new/changed rows first; the SQL lookup depends on them
+    rescore_products(product_ids)
+    if ALTERNATIVE_LOOKUP == 'memory':
+        product_index.refresh(product_ids)
+    # Triggers have marked the categories touched by the write as stale
+    ensure_alternatives_current()
+    if SIMILARITY_MATCHING:
+        similarity_index.invalidate()
+
+subscribe_product_changes(_on_products_changed)
+
+# --- Precomputed Alternatives ---
+def category_alternatives(rows: List[Tuple[int, float, float]]) -> List[Tuple[int, Optional[int], Optional[float], Optional[float]]]:
+    """
+    find_greener_alternative for a whole category at once. `rows` are
+    (id, esg_score, carbon_kg), best score first with ties on lowest id;
+    returns (product_id, alternative_id, score_delta, carbon_saved).
+    """
+    if not rows:
+        return []
+    first = rows[0]
+    second = rows[1] if len(rows) > 1 else None
+    results = []
+    for product_id, score, carbon_kg in rows:
+        # The best other product is the top one, or the runner-up for the top one itself
+        candidate = second if product_id == first[0] else first
+        if candidate is None or score is None or candidate[1] is None or candidate[1] <= score:
+            results.append((product_id, None, None, None))
+            continue
+        alt_id, alt_score, alt_carbon = candidate
+        if carbon_kg is None or alt_carbon is None:
+            carbon_saved = 0.0
+        else:
+            carbon_saved = round(max(0.0, float(carbon_kg) - float(alt_carbon)), 2)
+        results.append((product_id, alt_id, round(alt_score - score, 2), carbon_saved))
+    return results
+
+@timed()
+def refresh_alternatives(rebuild_all: bool = False) -> int:
+    """Rebuild product_alternatives for stale categories (or all); returns categories rebuilt"""
+    version = scoring_version()
+    categories = get_alternative_categories() if rebuild_all else get_stale_alternative_categories()
+    rebuilt = 0
+    for category in categories:
+        if replace_category_alternatives(category, version, category_alternatives):
+            rebuilt += 1
+        else:
+            logger.info(f"Alternatives for {category!r} left stale: scores pending")
+    if rebuilt:
+        logger.info(f"Rebuilt precomputed alternatives for {rebuilt} categories")
+    return rebuilt
+
+def ensure_alternatives_current() -> int:
+    """Rebuild stale precomputed alternatives (no-op when they are disabled)"""
+    return refresh_alternatives() if PRECOMPUTED_ALTERNATIVES else 0
+
+def _best_alternative(product: Dict[str, Any], original_score: float) -> Optional[Tuple[float, Dict[str, Any]]]:
+    if ALTERNATIVE_LOOKUP == 'memory':
+        return product_index.best_alternative(product, original_score)
+    # Single indexed query: ORDER BY esg_score DESC LIMIT 1 within the category
+    rows = get_top_scored_products(product['category'], 1, min_score=original_score, exclude_id=product['id'])
+    return rows[0] if rows else None
+
+def _top_candidates(category: str, n: int) -> List[Tuple[float, Dict[str, Any]]]:
+    if ALTERNATIVE_LOOKUP == 'memory':
+        return product_index.top_candidates(category, n)
+    return get_top_scored_products(category, n)
+
+def _pick_similar(neighbors: List[Tuple[int, float, float]], original_score: float) -> Optional[int]:
+    """Best-scoring neighbour above original_score (ties: more similar, then lowest id)"""
+    best = None
+    for product_id, similarity, score in neighbors:
+        if similarity >= SIMILARITY_MIN and score > original_score:
+            key = (score, similarity, -product_id)
+            if best is None or key > best[0]:
+                best = (key, product_id)
+    return best[1] if best else None
+
+@timed()
 def find_greener_alternative(product: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     """Find the best sustainable alternative with enhanced scoring"""
     try:
-        all_products = get_all_products()
+        if SIMILARITY_MATCHING:
+            original_score = ESGScorer.calculate_sustainability_score(product)
+            match_id = _pick_similar(similarity_index.neighbors(product, SIMILARITY_NEIGHBORS), original_score)
+            return get_product_by_id(match_id) if match_id is not None else None
+        
+        if PRECOMPUTED_ALTERNATIVES and product.get('id') is not None:
+            precomputed = get_precomputed_alternative(product['id'])
+            if precomputed is not None:
+                return precomputed[0]
+        
         original_score = ESGScorer.calculate_sustainability_score(product)
         
-        # Filter candidates: same category, different product, higher score
-        candidates = []
-        for p in all_products:
-            if (p['category'] == product['category'] and 
-                p['id'] != product['id']):
-                
-                candidate_score = ESGScorer.calculate_sustainability_score(p)
-                if candidate_score > original_score:
-                    candidates.append((candidate_score, p))
-        
-        if not candidates:
+        # Best candidate: same category, different product, higher score
+        match = _best_alternative(product, original_score)
+        
+        if not match:
             logger.info(f"No greener alternative found for product {product['id']}")
             return None
         
-        # Sort by score and return the best
-        candidates.sort(reverse=True, key=lambda x: x[0])
-        best_alternative = candidates[0][1]
+        best_score, best_alternative = match
         
         logger.info(f"Found greener alternative: {best_alternative['name']} "
-                   f"(score: {candidates[0][0]} vs {original_score})")
+                   f"(score: {best_score} vs {original_score})")
         
         return best_alternative
         
@@ -99,6 +475,41 @@ def find_greener_alternative(product: Dict[str, Any]) -> Optional[Dict[str, Any]
         logger.error(f"Error finding alternative for product {product.get('id')}: {e}")
         return None
 
+@timed()
+def find_greener_alternatives(products: List[Dict[str, Any]]) -> Dict[int, Optional[Dict[str, Any]]]:
+    """Best alternative for many products at once, keyed by product id.
+
+    The top two candidates of each category are fetched once and shared by
+    every product in that category.
+    """
+    results: Dict[int, Optional[Dict[str, Any]]] = {}
+    try:
+        if SIMILARITY_MATCHING:
+            neighbors = similarity_index.neighbors_batch(products, SIMILARITY_NEIGHBORS)
+            matches = {product['id']: _pick_similar(neighbors[product['id']],
+                                                    ESGScorer.calculate_sustainability_score(product))
+                       for product in products}
+            found = get_products_by_ids(pid for pid in matches.values() if pid is not None)
+            return {pid: found.get(match_id) if match_id is not None else None
+                    for pid, match_id in matches.items()}
+        
+        by_category: Dict[str, List[Tuple[float, Dict[str, Any]]]] = {}
+        for product in products:
+            if product['id'] in results:
+                continue
+            category = product.get('category')
+            if category not in by_category:
+                by_category[category] = _top_candidates(category, 2)
+            original_score = ESGScorer.calculate_sustainability_score(product)
+            results[product['id']] = next(
+                (alt for score, alt in by_category[category]
+                 if score > original_score and alt['id'] != product['id']),
+                None,
+            )
+    except Exception as e:
+        logger.error(f"Error finding alternatives for {len(products)} products: {e}")
+    return results
+
 def estimate_carbon_savings(original: Dict[str, Any], alternative: Dict[str, Any]) -> float:
     """Calculate carbon savings with validation"""
     try:
@@ -112,6 +523,116 @@ def estimate_carbon_savings(original: Dict[str, Any], alternative: Dict[str, Any
         logger.error(f"Error calculating carbon savings: {e}")
         return 0.0
 
+# --- Ranked Alternatives ---
+def _ranked_candidates(product: Dict[str, Any], original_score: float, max_price: Optional[float],
+                       max_carbon: Optional[float]) -> Iterator[Tuple[float, Dict[str, Any]]]:
+    if ALTERNATIVE_LOOKUP == 'memory':
+        return product_index.iter_ranked(product.get('category'), original_score, exclude_id=product.get('id'))
+    return iter_scored_candidates(product.get('category'), original_score, exclude_id=product.get('id'),
+                                  max_price=max_price, max_carbon=max_carbon)
+
+@timed()
+def rank_alternatives(product: Dict[str, Any], k: int = 5, max_price_ratio: Optional[float] = None,
+                      min_carbon_saved: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    Up to k greener products from the same category, best score first (ties:
+    lowest id), optionally at most max_price_ratio times the product's price
+    and saving at least min_carbon_saved kg CO2. Candidates arrive already in
+    score order, so the walk stops after k matches.
+    """
+    original_score = ESGScorer.calculate_sustainability_score(product)
+    price = product.get('price')
+    max_price = price * max_price_ratio if max_price_ratio is not None and price is not None else None
+    # Loose bound for the query; estimate_carbon_savings rounds to 0.01, so the exact check follows
+    carbon = product.get('carbon_kg')
+    max_carbon = carbon - min_carbon_saved + 0.005 if min_carbon_saved and carbon is not None else None
+    
+    results = []
+    with closing(_ranked_candidates(product, original_score, max_price, max_carbon)) as candidates:
+        for score, alternative in candidates:
+            if max_price is not None and not (alternative.get('price') is not None
+                                              and alternative['price'] <= max_price):
+                continue
+            carbon_saved = estimate_carbon_savings(product, alternative)
+            if min_carbon_saved and carbon_saved < min_carbon_saved:
+                continue
+            results.append({
+                'product': alternative,
+                'score': score,
+                'grade': ESGScorer.get_sustainability_grade(score),
+                'score_delta': round(score - original_score, 2),
+                'carbon_saved': carbon_saved,
+            })
+            if len(results) >= k:
+                break
+    return results
+
+def alternatives_report(product: Dict[str, Any], k: int = 5, max_price_ratio: Optional[float] = None,
+                        min_carbon_saved: Optional[float] = None) -> Dict[str, Any]:
+    """/api/alternatives payload: the product, its score and grade, and rank_alternatives()"""
+    score = ESGScorer.calculate_sustainability_score(product)
+    return {
+        'product': product,
+        'score': score,
+        'grade': ESGScorer.get_sustainability_grade(score),
+        'k': k,
+        'max_price_ratio': max_price_ratio,
+        'min_carbon_saved': min_carbon_saved,
+        'alternatives': rank_alternatives(product, k, max_price_ratio, min_carbon_saved),
+    }
+
+@timed()
+def plan_batch_recommendations(lines: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Tuple[Dict[str, Any], Dict[str, Any]]]]:
+    """
+    Recommendations for cart-like lines ({'product_id', 'quantity'}), one
+    entry per distinct product with quantities summed. Returns the results
+    (without reasons) and the (original, alternative) pairs needing one.
+    """
+    products = get_products_by_ids(line['product_id'] for line in lines)
+    alternatives = find_greener_alternatives(list(products.values()))
+    
+    quantities: Dict[int, int] = {}
+    for line in lines:
+        quantities[line['product_id']] = quantities.get(line['product_id'], 0) + line['quantity']
+    
+    results = []
+    pairs = []
+    for product_id, quantity in quantities.items():
+        original = products.get(product_id)
+        if not original:
+            results.append({'product_id': product_id, 'error': 'Product not found'})
+            continue
+        alternative = alternatives.get(product_id)
+        if not alternative:
+            results.append({'product_id': product_id, 'original': original, 'alternative': None})
+            continue
+        carbon_saved = estimate_carbon_savings(original, alternative)
+        results.append({
+            'product_id': product_id,
+            'original': original,
+            'alternative': alternative,
+            'quantity': quantity,
+            'carbon_saved': carbon_saved,
+            # 10 points per kg CO2 saved across the whole quantity, matching total_carbon_saved
+            'points_awarded': int(carbon_saved * quantity * 10),
+        })
+        pairs.append((original, alternative))
+    return results, pairs
+
+def summarize_batch_recommendations(results: List[Dict[str, Any]], reasons: List[str]) -> Dict[str, Any]:
+    """Attach reasons (in pair order) and compute batch totals"""
+    reasons_iter = iter(reasons)
+    for result in results:
+        if result.get('alternative'):
+            result['reason'] = next(reasons_iter)
+    
+    recommended = [r for r in results if r.get('alternative')]
+    return {
+        'recommendations': results,
+        'total_carbon_saved': round(sum(r['carbon_saved'] * r['quantity'] for r in recommended), 2),
+        'total_points_awarded': sum(r['points_awarded'] for r in recommended),
+    }
+
 def get_product_insights(product: Dict[str, Any]) -> Dict[str, Any]:
     """Get detailed sustainability insights for a product"""
     score = ESGScorer.calculate_sustainability_score(product)
@@ -136,4 +657,24 @@ def get_product_insights(product: Dict[str, Any]) -> Dict[str, Any]:
     if product.get('carbon_kg', 0) > 3.0:
         insights['recommendations'].append("High carbon footprint - consider lower-impact alternatives")
     
-    return insights
\ No newline at end of file
+    return insights
+
+def main(argv: Optional[List[str]] = None):
+    import argparse
+    import db
+    parser = argparse.ArgumentParser(description='Rebuild the precomputed product_alternatives table')
+    parser.add_argument('--db', help='database path (defaults to ESG_DB_PATH)')
+    parser.add_argument('--all', action='store_true', help='rebuild every category, not only stale ones')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    if args.db:
+        db.DB_PATH = args.db
+    db.ensure_schema()
+    ensure_scores_current()
+    started = time.time()
+    rebuilt = refresh_alternatives(rebuild_all=args.all)
+    print(json.dumps({'categories_rebuilt': rebuilt, 'seconds': round(time.time() - started, 3)}))
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,167 @@
+"""
+Compact row records for db.py results.
+
+Product, CartItem and User keep one row each in __slots__ instead of a
+per-row dict (about a third of the memory) and behave as read-only
+mappings, so callers keep using record['name'], record.get(...) and
+dict(record). dumps() writes them straight to JSON; its output is exactly
+json.dumps(..., sort_keys=True, separators=(',', ':')) of the equivalent
+dicts, which is what Flask's jsonify and asgi.dumps produce.
+"""
+import json
+from json.encoder import encode_basestring_ascii as _str
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+class Record:
+    """Base for fixed-field row records; subclasses declare __slots__ in column order"""
+    __slots__ = ()
+    _fields: Tuple[str, ...] = ()
+    _field_set: frozenset = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._fields = tuple(cls.__slots__)
+        cls._field_set = frozenset(cls.__slots__)
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row)
+
+    # --- Mapping interface ---
+    def __getitem__(self, key: str) -> Any:
+        if key in self._field_set:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in self._field_set:
+            return getattr(self, key)
+        return default
+
+    def __contains__(self, key) -> bool:
+        return key in self._field_set
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._fields)
+
+    def __len__(self) -> int:
+        return len(self._fields)
+
+    def keys(self):
+        return self._fields
+
+    def values(self):
+        return tuple(getattr(self, name) for name in self._fields)
+
+    def items(self):
+        return tuple((name, getattr(self, name)) for name in self._fields)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self._fields}
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Record):
+            return self._fields == other._fields and self.values() == other.values()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self._fields)
+        return f'{type(self).__name__}({fields})'
+
+    def to_json(self) -> str:
+        return _compact(self.to_dict())
+
+def _compact(obj: Any, default: Optional[Callable] = None) -> str:
+    hook = json_default
+    if default is not None:
+        def hook(o):
+            return o.to_dict() if isinstance(o, Record) else default(o)
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'), default=hook)
+
+def _finite(value) -> bool:
+    # False for inf/nan, which json spells Infinity/NaN rather than repr()
+    return value - value == 0.0
+
+class Product(Record):
+    __slots__ = ('id', 'name', 'description', 'category', 'packaging', 'is_organic', 'carbon_kg', 'price')
+
+    def __init__(self, id, name, description, category, packaging, is_organic, carbon_kg, price):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.category = category
+        self.packaging = packaging
+        self.is_organic = is_organic
+        self.carbon_kg = carbon_kg
+        self.price = price
+
+    def to_json(self) -> str:
+        carbon_kg, price = self.carbon_kg, self.price
+        # Fast path for the column types SQLite hands back; anything else
+        # (NULLs, booleans, non-finite floats) goes through json.dumps
+        if (type(self.id) is int and type(self.is_organic) is int and type(carbon_kg) is float
+                and type(price) is float and type(self.name) is str and type(self.description) is str
+                and type(self.category) is str and type(self.packaging) is str
+                and _finite(carbon_kg) and _finite(price)):
+            return ('{"carbon_kg":%r,"category":%s,"description":%s,"id":%d,"is_organic":%d,'
+                    '"name":%s,"packaging":%s,"price":%r}') % (
+                carbon_kg, _str(self.category), _str(self.description), self.id, self.is_organic,
+                _str(self.name), _str(self.packaging), price)
+        return _compact(self.to_dict())
+
+class CartItem(Record):
+    __slots__ = ('cart_id', 'name', 'category', 'packaging', 'is_organic', 'carbon_kg', 'price', 'quantity')
+
+    def __init__(self, cart_id, name, category, packaging, is_organic, carbon_kg, price, quantity):
+        self.cart_id = cart_id
+        self.name = name
+        self.category = category
+        self.packaging = packaging
+        self.is_organic = is_organic
+        self.carbon_kg = carbon_kg
+        self.price = price
+        self.quantity = quantity
+
+    def to_json(self) -> str:
+        carbon_kg, price = self.carbon_kg, self.price
+        if (type(self.cart_id) is int and type(self.quantity) is int and type(self.is_organic) is int
+                and type(carbon_kg) is float and type(price) is float and type(self.name) is str
+                and type(self.category) is str and type(self.packaging) is str
+                and _finite(carbon_kg) and _finite(price)):
+            return ('{"carbon_kg":%r,"cart_id":%d,"category":%s,"is_organic":%d,"name":%s,'
+                    '"packaging":%s,"price":%r,"quantity":%d}') % (
+                carbon_kg, self.cart_id, _str(self.category), self.is_organic, _str(self.name),
+                _str(self.packaging), price, self.quantity)
+        return _compact(self.to_dict())
+
+class User(Record):
+    __slots__ = ('id', 'name', 'points')
+
+    def __init__(self, id, name, points):
+        self.id = id
+        self.name = name
+        self.points = points
+
+# --- JSON ---
+def json_default(obj: Any) -> Any:
+    """json.dumps `default` hook for records"""
+    if isinstance(obj, Record):
+        return obj.to_dict()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+def dumps(obj: Any, default: Optional[Callable] = None) -> str:
+    """Compact, key-sorted JSON with records encoded directly.
+    `default` handles other non-JSON types, as in json.dumps."""
+    if isinstance(obj, Record):
+        return obj.to_json()
+    kind = type(obj)
+    if kind is list or kind is tuple:
+        return '[' + ','.join([dumps(item, default) for item in obj]) + ']'
+    if kind is dict and all(type(key) is str for key in obj):
+        return '{' + ','.join([_str(key) + ':' + dumps(value, default)
+                               for key, value in sorted(obj.items())]) + '}'
+    return _compact(obj, default)
@@ -0,0 +1,154 @@
+import gzip
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+from db import get_db_connection
+from metrics import register_stats
+
+logger = logging.getLogger(__name__)
+
+# Response cache configuration
+RESPONSE_CACHE_ENTRIES = int(os.getenv('ESG_RESPONSE_CACHE_ENTRIES', '512'))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('ESG_RESPONSE_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+# Share serialized responses between worker processes through SQLite
+RESPONSE_CACHE_SHARED = os.getenv('ESG_SHARED_CACHE', 'false').lower() == 'true'
+# Bodies smaller than this are not worth compressing
+GZIP_MIN_BYTES = 1024
+
+def catalog_etag(version: int, key: str) -> str:
+    """Strong ETag for a catalog response: changes whenever the catalog does"""
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+    return f'"c{version}-{digest}"'
+
+def variant_etag(etag: str, encoding: Optional[str]) -> str:
+    """ETag of one encoding of a response; each representation gets its own strong tag"""
+    return f'{etag[:-1]}-{encoding}"' if encoding else etag
+
+class CachedResponse:
+    __slots__ = ('body', 'gzip_body', 'etag', 'size')
+
+    def __init__(self, body: bytes, etag: str, gzip_body: Optional[bytes] = None):
+        self.body = body
+        self.etag = etag
+        if gzip_body is None and len(body) >= GZIP_MIN_BYTES:
+            gzip_body = gzip.compress(body, compresslevel=6)
+        self.gzip_body = gzip_body
+        self.size = len(body) + (len(self.gzip_body) if self.gzip_body else 0)
+
+    def variant(self, accept_gzip: bool) -> Tuple[bytes, str, Optional[str]]:
+        """(body, ETag, Content-Encoding) of the representation to send"""
+        if accept_gzip and self.gzip_body is not None:
+            return self.gzip_body, variant_etag(self.etag, 'gzip'), 'gzip'
+        return self.body, self.etag, None
+
+class ResponseCache:
+    """LRU cache of serialized (and pre-gzipped) catalog responses.
+
+    Entries are keyed by request key and catalog version; a version change
+    drops everything cached for older versions. With ``shared`` enabled,
+    misses fall through to a SQLite table so worker processes serialize
+    each response only once between them.
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_ENTRIES, max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+                 shared: bool = RESPONSE_CACHE_SHARED):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._version: Optional[int] = None
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'shared_hits': 0, 'not_modified': 0, 'evictions': 0}
+
+    def _check_version_locked(self, version: int):
+        if version != self._version:
+            self._entries.clear()
+            self._bytes = 0
+            self._version = version
+
+    def get(self, key: str, version: int) -> Optional[CachedResponse]:
+        with self._lock:
+            self._check_version_locked(version)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry
+        if self.shared:
+            entry = self._load_shared(key, version)
+            if entry is not None:
+                self._store(key, version, entry)
+                with self._lock:
+                    self._stats['hits'] += 1
+                    self._stats['shared_hits'] += 1
+                return entry
+        with self._lock:
+            self._stats['misses'] += 1
+        return None
+
+    def _load_shared(self, key: str, version: int) -> Optional[CachedResponse]:
+        try:
+            with get_db_connection() as conn:
+                row = conn.execute('SELECT etag, body, gzip_body FROM response_cache WHERE key=? AND version=?',
+                                   (key, version)).fetchone()
+        except Exception as e:
+            logger.error(f"Shared response cache read failed: {e}")
+            return None
+        return CachedResponse(row[1], row[0], row[2]) if row else None
+
+    def _save_shared(self, key: str, version: int, entry: CachedResponse):
+        try:
+            with get_db_connection() as conn:
+                conn.execute('INSERT OR REPLACE INTO response_cache (key, version, etag, body, gzip_body) '
+                             'VALUES (?, ?, ?, ?, ?)', (key, version, entry.etag, entry.body, entry.gzip_body))
+                conn.execute('DELETE FROM response_cache WHERE version < ?', (version,))
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Shared response cache write failed: {e}")
+
+    def put(self, key: str, version: int, body: bytes) -> CachedResponse:
+        entry = CachedResponse(body, catalog_etag(version, key))
+        if entry.size > self.max_bytes:
+            return entry
+        if self.shared:
+            self._save_shared(key, version, entry)
+        self._store(key, version, entry)
+        return entry
+
+    def _store(self, key: str, version: int, entry: CachedResponse):
+        with self._lock:
+            self._check_version_locked(version)
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self._stats['evictions'] += 1
+
+    def record_not_modified(self):
+        with self._lock:
+            self._stats['not_modified'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({'entries': len(self._entries), 'bytes': self._bytes, 'catalog_version': self._version})
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+response_cache = ResponseCache()
+register_stats('response_cache', response_cache.stats)
@@ -0,0 +1,308 @@
+"""
+Local text-similarity index over product names and descriptions.
+
+Each product is embedded as a TF-IDF vector of its words and character
+trigrams, folded into ESG_SIMILARITY_DIM dimensions with the hashing trick,
+L2-normalized and stored in one float32 NumPy matrix whose rows are grouped
+by category. Nearest neighbours within a category are found by cosine
+similarity over the category's rows, or approximately through
+random-hyperplane LSH for large categories (ESG_SIMILARITY_MODE).
+"""
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from itertools import chain
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from db import get_catalog_version, get_product_text_rows
+from metrics import register_stats, timed
+
+logger = logging.getLogger(__name__)
+
+# Embedding width (a power of two); memory is rows x dim x 4 bytes
+SIMILARITY_DIM = int(os.getenv('ESG_SIMILARITY_DIM', '64'))
+# 'exact', 'ann', or 'auto' (ANN only for categories above SIMILARITY_EXACT_MAX rows)
+SIMILARITY_MODE = os.getenv('ESG_SIMILARITY_MODE', 'auto').lower()
+SIMILARITY_EXACT_MAX = int(os.getenv('ESG_SIMILARITY_EXACT_MAX', '20000'))
+LSH_TABLES = int(os.getenv('ESG_SIMILARITY_LSH_TABLES', '8'))
+LSH_BITS = int(os.getenv('ESG_SIMILARITY_LSH_BITS', '10'))
+# Upper bound on candidates scored exactly per ANN query
+LSH_MAX_CANDIDATES = 4096
+# Hashed feature space for document frequencies
+FEATURE_BITS = 20
+VERSION_CHECK_INTERVAL = float(os.getenv('ESG_INDEX_VERSION_CHECK_INTERVAL', '1.0'))
+EMBED_CHUNK_SIZE = 50000
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+# word -> hashes of the word and its trigrams; cleared when it grows past the limit
+_word_hashes: Dict[str, Tuple[int, ...]] = {}
+WORD_CACHE_SIZE = 200000
+
+def _hash_word(word: str) -> Tuple[int, ...]:
+    padded = f'#{word}#'
+    return (zlib.crc32(b'w:' + word.encode('utf-8')),
+            *(zlib.crc32(padded[i:i + 3].encode('utf-8')) for i in range(len(padded) - 2)))
+
+def feature_hashes(text: str) -> List[int]:
+    """Distinct 32-bit hashes of the words and padded character trigrams of text"""
+    hashes = set()
+    for word in _TOKEN_RE.findall(text.lower()):
+        cached = _word_hashes.get(word)
+        if cached is None:
+            if len(_word_hashes) >= WORD_CACHE_SIZE:
+                _word_hashes.clear()
+            cached = _word_hashes[word] = _hash_word(word)
+        hashes.update(cached)
+    return list(hashes)
+
+def product_text(name: Optional[str], description: Optional[str]) -> str:
+    return f'{name or ""} {description or ""}'
+
+class _Snapshot:
+    """One immutable build of the index; queries read it without locking"""
+    __slots__ = ('version', 'ids', 'scores', 'vectors', 'categories', 'category_codes', 'id_order',
+                 'sorted_ids', 'idf', 'lsh_keys', 'lsh_rows')
+
+class SimilarityIndex:
+    """Per-process text-vector index, rebuilt in the background when the catalog version changes"""
+
+    def __init__(self, dim: int = SIMILARITY_DIM, seed: int = 0):
+        if dim & (dim - 1):
+            raise ValueError('ESG_SIMILARITY_DIM must be a power of two')
+        self.dim = dim
+        self._lock = threading.Lock()
+        # Held while building, so two builds never run at once
+        self._load_lock = threading.Lock()
+        self._snapshot: Optional[_Snapshot] = None
+        self._stale = False
+        # pid of the process running a background rebuild (threads don't survive fork)
+        self._rebuilding_pid: Optional[int] = None
+        self._next_version_check = 0.0
+        rng = np.random.default_rng(seed)
+        self._planes = rng.standard_normal((LSH_TABLES * LSH_BITS, dim)).astype(np.float32)
+        self._bit_weights = (1 << np.arange(LSH_BITS, dtype=np.int64))
+
+    # --- Embedding ---
+    def _embed_hashes(self, hashes: List[List[int]], idf: np.ndarray) -> np.ndarray:
+        lengths = np.fromiter(map(len, hashes), dtype=np.int64, count=len(hashes))
+        flat = np.fromiter(chain.from_iterable(hashes), dtype=np.int64, count=int(lengths.sum()))
+        docs = np.repeat(np.arange(len(hashes), dtype=np.int64), lengths)
+        weights = idf[flat & ((1 << FEATURE_BITS) - 1)]
+        weights = np.where(flat & (1 << 31), weights, -weights)
+        buckets = docs * self.dim + (flat & (self.dim - 1))
+        vectors = np.bincount(buckets, weights=weights, minlength=len(hashes) * self.dim)
+        vectors = vectors.reshape(len(hashes), self.dim).astype(np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1.0)
+
+    def _codes(self, vectors: np.ndarray) -> np.ndarray:
+        """LSH code per table for each row: (rows, LSH_TABLES) int64"""
+        bits = (vectors @ self._planes.T > 0).reshape(len(vectors), LSH_TABLES, LSH_BITS)
+        return bits.astype(np.int64) @ self._bit_weights
+
+    # --- Building ---
+    @timed()
+    def load(self):
+        """(Re)build the index from the database"""
+        started = time.time()
+        with self._lock:
+            # Writes from here on mark the new snapshot stale again
+            self._stale = False
+        version = get_catalog_version()
+        rows = get_product_text_rows()
+        n = len(rows)
+        snapshot = _Snapshot()
+        snapshot.version = version
+        snapshot.ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=n)
+        snapshot.scores = np.array([np.nan if row[4] is None else row[4] for row in rows], dtype=np.float64)
+
+        # Rows arrive grouped by category
+        snapshot.categories = {}
+        category_index = np.empty(n, dtype=np.int64)
+        start = 0
+        for i in range(1, n + 1):
+            if i == n or rows[i][1] != rows[start][1]:
+                snapshot.categories[rows[start][1]] = (start, i)
+                category_index[start:i] = len(snapshot.categories) - 1
+                start = i
+        snapshot.category_codes = {name: code for code, name in enumerate(snapshot.categories)}
+
+        hashes = [feature_hashes(product_text(row[2], row[3])) for row in rows]
+        del rows
+        df = np.bincount(np.fromiter(chain.from_iterable(hashes), dtype=np.int64) & ((1 << FEATURE_BITS) - 1),
+                         minlength=1 << FEATURE_BITS)
+        snapshot.idf = (np.log((1.0 + n) / (1.0 + df)) + 1.0).astype(np.float32)
+        snapshot.vectors = np.empty((n, self.dim), dtype=np.float32)
+        for chunk in range(0, n, EMBED_CHUNK_SIZE):
+            snapshot.vectors[chunk:chunk + EMBED_CHUNK_SIZE] = self._embed_hashes(
+                hashes[chunk:chunk + EMBED_CHUNK_SIZE], snapshot.idf)
+        del hashes
+
+        snapshot.id_order = np.argsort(snapshot.ids, kind='stable')
+        snapshot.sorted_ids = snapshot.ids[snapshot.id_order]
+
+        snapshot.lsh_keys, snapshot.lsh_rows = [], []
+        if SIMILARITY_MODE != 'exact' and n:
+            codes = self._codes(snapshot.vectors)
+            for table in range(LSH_TABLES):
+                keys = (category_index << LSH_BITS) | codes[:, table]
+                order = np.argsort(keys, kind='stable')
+                snapshot.lsh_keys.append(keys[order])
+                snapshot.lsh_rows.append(order.astype(np.int32))
+
+        with self._lock:
+            self._snapshot = snapshot
+            self._next_version_check = time.monotonic() + VERSION_CHECK_INTERVAL
+        logger.info(f"Similarity index loaded: {n} products, dim {self.dim}, "
+                    f"{time.time() - started:.1f}s")
+
+    def invalidate(self):
+        with self._lock:
+            self._stale = True
+
+    def _rebuild_in_background(self):
+        """Start one background rebuild; queries keep using the current snapshot meanwhile"""
+        with self._lock:
+            if self._rebuilding_pid == os.getpid():
+                return
+            self._rebuilding_pid = os.getpid()
+        threading.Thread(target=self._rebuild, name='similarity-rebuild', daemon=True).start()
+
+    def _rebuild(self):
+        try:
+            with self._load_lock:
+                self.load()
+        except Exception as e:
+            logger.error(f"Similarity index rebuild failed: {e}")
+        finally:
+            with self._lock:
+                self._rebuilding_pid = None
+
+    def _current(self) -> _Snapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            # Only the first build blocks requests
+            with self._load_lock:
+                if self._snapshot is None:
+                    self.load()
+            return self._snapshot
+        if self._stale:
+            self._rebuild_in_background()
+        elif time.monotonic() >= self._next_version_check:
+            # Another worker process may have written to the catalog
+            self._next_version_check = time.monotonic() + VERSION_CHECK_INTERVAL
+            if get_catalog_version() != snapshot.version:
+                self._rebuild_in_background()
+        return snapshot
+
+    # --- Queries ---
+    def _row(self, snapshot: _Snapshot, product_id) -> Optional[int]:
+        i = int(np.searchsorted(snapshot.sorted_ids, product_id))
+        if i < len(snapshot.sorted_ids) and snapshot.sorted_ids[i] == product_id:
+            return int(snapshot.id_order[i])
+        return None
+
+    def _query_vector(self, snapshot: _Snapshot, product: Dict[str, Any]) -> Tuple[np.ndarray, Optional[int]]:
+        row = self._row(snapshot, product.get('id'))
+        if row is not None:
+            return snapshot.vectors[row], row
+        text = product_text(product.get('name'), product.get('description'))
+        return self._embed_hashes([feature_hashes(text)], snapshot.idf)[0], None
+
+    def _ann_candidates(self, snapshot: _Snapshot, category: str, vector: np.ndarray) -> np.ndarray:
+        """Rows sharing an LSH bucket (or one bit away) with vector, in the category"""
+        codes = self._codes(vector[None, :])[0]
+        flips = np.concatenate([[0], self._bit_weights])
+        prefix = snapshot.category_codes[category] << LSH_BITS
+        found = []
+        for table in range(LSH_TABLES):
+            probes = prefix | (codes[table] ^ flips)
+            keys = snapshot.lsh_keys[table]
+            lo = np.searchsorted(keys, probes, side='left')
+            hi = np.searchsorted(keys, probes, side='right')
+            for a, b in zip(lo.tolist(), hi.tolist()):
+                if b > a:
+                    found.append(snapshot.lsh_rows[table][a:b])
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        candidates = np.unique(np.concatenate(found))
+        return candidates[:LSH_MAX_CANDIDATES]
+
+    def _use_ann(self, size: int) -> bool:
+        return SIMILARITY_MODE == 'ann' or (SIMILARITY_MODE == 'auto' and size > SIMILARITY_EXACT_MAX)
+
+    def _top(self, snapshot: _Snapshot, rows: np.ndarray, sims: np.ndarray, exclude: Optional[int],
+             n: int) -> List[Tuple[int, float, float]]:
+        if exclude is not None:
+            sims = np.where(rows == exclude, -np.inf, sims)
+        if len(sims) > n:
+            keep = np.argpartition(-sims, n - 1)[:n]
+            rows, sims = rows[keep], sims[keep]
+        ids = snapshot.ids[rows]
+        # Most similar first; ties on lowest id
+        order = np.lexsort((ids, -sims))
+        return [(int(ids[i]), float(sims[i]), float(snapshot.scores[rows[i]]))
+                for i in order if sims[i] != -np.inf]
+
+    @timed()
+    def neighbors(self, product: Dict[str, Any], n: int = 50) -> List[Tuple[int, float, float]]:
+        """(id, cosine similarity, stored esg_score) of the n most similar products in the same category"""
+        snapshot = self._current()
+        bounds = snapshot.categories.get(product.get('category'))
+        if bounds is None:
+            return []
+        vector, own_row = self._query_vector(snapshot, product)
+        start, end = bounds
+        if self._use_ann(end - start):
+            rows = self._ann_candidates(snapshot, product.get('category'), vector)
+            sims = snapshot.vectors[rows] @ vector
+        else:
+            rows = np.arange(start, end)
+            sims = snapshot.vectors[start:end] @ vector
+        return self._top(snapshot, rows, sims, own_row, n)
+
+    @timed()
+    def neighbors_batch(self, products: Iterable[Dict[str, Any]], n: int = 50) -> Dict[int, List[Tuple[int, float, float]]]:
+        """neighbors() for many products, one matrix product per category in exact mode"""
+        snapshot = self._current()
+        by_category: Dict[str, List[Dict[str, Any]]] = {}
+        results: Dict[int, List[Tuple[int, float, float]]] = {}
+        for product in products:
+            if product.get('category') in snapshot.categories:
+                by_category.setdefault(product['category'], []).append(product)
+            else:
+                results[product['id']] = []
+        for category, group in by_category.items():
+            start, end = snapshot.categories[category]
+            if self._use_ann(end - start):
+                for product in group:
+                    results[product['id']] = self.neighbors(product, n)
+                continue
+            queries = [self._query_vector(snapshot, product) for product in group]
+            matrix = np.stack([vector for vector, _ in queries])
+            sims = matrix @ snapshot.vectors[start:end].T
+            rows = np.arange(start, end)
+            for product, (_, own_row), row_sims in zip(group, queries, sims):
+                results[product['id']] = self._top(snapshot, rows, row_sims, own_row, n)
+        return results
+
+    def similarity(self, a: Dict[str, Any], b: Dict[str, Any]) -> float:
+        """Cosine similarity of two products' text vectors"""
+        snapshot = self._current()
+        return float(self._query_vector(snapshot, a)[0] @ self._query_vector(snapshot, b)[0])
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        if snapshot is None:
+            return {'loaded': False}
+        return {'loaded': True, 'products': len(snapshot.ids), 'categories': len(snapshot.categories),
+                'dim': self.dim, 'bytes': int(snapshot.vectors.nbytes), 'version': snapshot.version,
+                'rebuilding': self._rebuilding_pid == os.getpid()}
+
+similarity_index = SimilarityIndex()
+register_stats('similarity_index', similarity_index.stats)
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+In-memory serving of the bundled frontend (api/static).
+
+The directory is read once per process into a manifest of assets held in
+memory, each with a strong ETag and its gzip/brotli variants: `.gz`/`.br`
+files written next to it at build time (python static_assets.py), else
+compressed at load (brotli only when the module is installed). Fingerprinted
+filenames (main.1a2b3c4d.js) get a year-long immutable Cache-Control;
+everything else, index.html included, is revalidated with its ETag.
+
+respond() is framework-neutral: it returns (status, headers, body) for a
+path and the request headers, handling content negotiation, If-None-Match /
+If-Modified-Since (304) and single byte ranges (206/416), so the Flask and
+ASGI apps serve identical responses without touching the filesystem.
+"""
+import argparse
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import threading
+from typing import Dict, Any, List, Mapping, Optional, Tuple
+
+from werkzeug.http import (http_date, parse_accept_header, parse_date, parse_etags, parse_if_range_header,
+                           parse_range_header)
+
+from metrics import register_stats
+
+try:
+    import brotli
+except ImportError:  # optional: precompressed .br files are still served
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+STATIC_DIR = os.getenv('ESG_STATIC_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
+INDEX_FILE = 'index.html'
+# Content hash in the file name, as emitted by the frontend build (main.1a2b3c4d.js, 787.3f2a91c0.chunk.css)
+FINGERPRINT_RE = re.compile(r'\.[0-9a-f]{8,}\.(?:chunk\.)?[A-Za-z0-9]+$')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+# Compress text-like assets at least this large when no precompressed file exists
+COMPRESS_MIN_SIZE = 1024
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'application/manifest+json',
+                      'application/xml', 'image/svg+xml', 'application/wasm')
+# Missing paths with these extensions are 404s rather than client-side routes
+ASSET_EXTENSIONS = {'js', 'mjs', 'css', 'map', 'json', 'png', 'jpg', 'jpeg', 'gif', 'webp', 'avif', 'ico', 'svg',
+                    'woff', 'woff2', 'ttf', 'eot', 'txt', 'xml', 'wasm', 'webmanifest'}
+ENCODINGS = ('br', 'gzip')
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+mimetypes.add_type('application/javascript', '.js')
+mimetypes.add_type('application/javascript', '.mjs')
+mimetypes.add_type('application/manifest+json', '.webmanifest')
+mimetypes.add_type('image/webp', '.webp')
+
+class Asset:
+    """One file, with its compressed variants, ready to send"""
+    __slots__ = ('path', 'body', 'variants', 'mimetype', 'etag', 'last_modified', 'cache_control')
+
+    def __init__(self, path: str, body: bytes, variants: Dict[str, bytes], mimetype: str, mtime: float):
+        self.path = path
+        self.body = body
+        self.variants = variants
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(body).hexdigest()[:20]
+        self.last_modified = int(mtime)
+        fingerprinted = FINGERPRINT_RE.search(os.path.basename(path)) is not None
+        self.cache_control = IMMUTABLE_CACHE_CONTROL if fingerprinted else REVALIDATE_CACHE_CONTROL
+
+def _compressible(mimetype: str) -> bool:
+    return mimetype.startswith(COMPRESSIBLE_TYPES)
+
+def compress(body: bytes, encoding: str) -> Optional[bytes]:
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=9, mtime=0)
+    if encoding == 'br' and brotli is not None:
+        return brotli.compress(body)
+    return None
+
+def load_asset(root: str, rel_path: str) -> Asset:
+    full = os.path.join(root, rel_path)
+    with open(full, 'rb') as f:
+        body = f.read()
+    mimetype = mimetypes.guess_type(rel_path)[0] or 'application/octet-stream'
+    if mimetype.startswith('text/') or mimetype in ('application/javascript', 'application/json'):
+        mimetype += '; charset=utf-8'
+    variants = {}
+    for encoding in ENCODINGS:
+        compressed_path = full + ENCODING_SUFFIXES[encoding]
+        if os.path.isfile(compressed_path):
+            with open(compressed_path, 'rb') as f:
+                variants[encoding] = f.read()
+        elif _compressible(mimetype) and len(body) >= COMPRESS_MIN_SIZE:
+            compressed = compress(body, encoding)
+            # Not worth a Content-Encoding for a few percent
+            if compressed is not None and len(compressed) < len(body) * 0.9:
+                variants[encoding] = compressed
+    return Asset(rel_path.replace(os.sep, '/'), body, variants, mimetype, os.path.getmtime(full))
+
+class StaticAssets:
+    """Manifest of the frontend build, loaded once per process"""
+
+    def __init__(self, root: str = STATIC_DIR):
+        self.root = root
+        self._assets: Optional[Dict[str, Asset]] = None
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, Asset]:
+        assets = {}
+        if os.path.isdir(self.root):
+            for dirpath, _, filenames in os.walk(self.root):
+                for name in filenames:
+                    if name.endswith(('.gz', '.br')) and os.path.isfile(os.path.join(dirpath, name[:-3])):
+                        continue  # a variant of another asset
+                    rel_path = os.path.relpath(os.path.join(dirpath, name), self.root)
+                    asset = load_asset(self.root, rel_path)
+                    assets[asset.path] = asset
+        with self._lock:
+            self._assets = assets
+        size = sum(len(a.body) + sum(map(len, a.variants.values())) for a in assets.values())
+        logger.info(f"Static assets loaded: {len(assets)} files, {size / 1e6:.1f} MB in memory")
+        return assets
+
+    def assets(self) -> Dict[str, Asset]:
+        assets = self._assets
+        if assets is None:
+            with self._lock:
+                assets = self._assets
+            if assets is None:
+                assets = self.load()
+        return assets
+
+    def lookup(self, path: str) -> Optional[Asset]:
+        """The asset for a request path; index.html for client-side routes, None for missing files"""
+        assets = self.assets()
+        path = path.lstrip('/')
+        asset = assets.get(path) if path else None
+        if asset is not None:
+            return asset
+        name = path.rsplit('/', 1)[-1]
+        if '.' in name and name.rsplit('.', 1)[-1].lower() in ASSET_EXTENSIONS:
+            return None
+        return assets.get(INDEX_FILE)
+
+    def respond(self, path: str, headers: Mapping[str, str],
+                method: str = 'GET') -> Optional[Tuple[int, List[Tuple[str, str]], bytes]]:
+        """(status, headers, body) for a GET/HEAD of path, or None when there is nothing to serve"""
+        asset = self.lookup(path)
+        if asset is None:
+            return None
+        range_header = headers.get('Range') if method == 'GET' else None
+
+        # Ranges are served from the identity body only
+        encoding = None
+        if asset.variants and not range_header:
+            accepted = parse_accept_header(headers.get('Accept-Encoding'))
+            encoding = next((e for e in ENCODINGS if e in asset.variants and accepted.quality(e) > 0), None)
+        body = asset.variants[encoding] if encoding else asset.body
+        etag = f'{asset.etag}-{encoding}' if encoding else asset.etag
+
+        response_headers = [('Content-Type', asset.mimetype), ('ETag', f'"{etag}"'),
+                            ('Cache-Control', asset.cache_control),
+                            ('Last-Modified', http_date(asset.last_modified))]
+        if asset.variants:
+            response_headers.append(('Vary', 'Accept-Encoding'))
+        if encoding:
+            response_headers.append(('Content-Encoding', encoding))
+        else:
+            response_headers.append(('Accept-Ranges', 'bytes'))
+
+        if_none_match = headers.get('If-None-Match')
+        if if_none_match is not None:
+            not_modified = parse_etags(if_none_match).contains_weak(etag)
+        else:
+            since = parse_date(headers.get('If-Modified-Since'))
+            not_modified = since is not None and int(since.timestamp()) >= asset.last_modified
+        if not_modified:
+            return 304, [h for h in response_headers if h[0] != 'Content-Type'], b''
+
+        if range_header:
+            if_range = parse_if_range_header(headers.get('If-Range'))
+            current = ((if_range.etag is None or if_range.etag == etag) and
+                       (if_range.date is None or int(if_range.date.timestamp()) >= asset.last_modified))
+            ranges = parse_range_header(range_header) if current else None
+            # Multiple ranges are answered with the whole body
+            if ranges is not None and len(ranges.ranges) == 1:
+                span = ranges.range_for_length(len(body))
+                if span is None:
+                    return 416, response_headers + [('Content-Range', f'bytes */{len(body)}')], b''
+                start, stop = span
+                content_range = ranges.to_content_range_header(len(body))
+                return 206, response_headers + [('Content-Range', content_range)], body[start:stop]
+        return 200, response_headers, body
+
+    def stats(self) -> Dict[str, Any]:
+        assets = self._assets or {}
+        return {
+            'files': len(assets),
+            'bytes': sum(len(a.body) for a in assets.values()),
+            'compressed_bytes': sum(len(v) for a in assets.values() for v in a.variants.values()),
+            'immutable': sum(1 for a in assets.values() if a.cache_control == IMMUTABLE_CACHE_CONTROL),
+        }
+
+static_assets = StaticAssets()
+register_stats('static_assets', static_assets.stats)
+
+def precompress(root: str = STATIC_DIR) -> Dict[str, int]:
+    """Write .gz (and .br, with brotli installed) next to each compressible file"""
+    written = {'gzip': 0, 'br': 0}
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if name.endswith(('.gz', '.br')):
+                continue
+            full = os.path.join(dirpath, name)
+            mimetype = mimetypes.guess_type(name)[0] or ''
+            if not _compressible(mimetype) or os.path.getsize(full) < COMPRESS_MIN_SIZE:
+                continue
+            with open(full, 'rb') as f:
+                body = f.read()
+            for encoding in ENCODINGS:
+                compressed = compress(body, encoding)
+                if compressed is not None and len(compressed) < len(body) * 0.9:
+                    with open(full + ENCODING_SUFFIXES[encoding], 'wb') as f:
+                        f.write(compressed)
+                    written[encoding] += 1
+    return written
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Precompress the frontend build for static_assets')
+    parser.add_argument('root', nargs='?', default=STATIC_DIR)
+    args = parser.parse_args(argv)
+    written = precompress(args.root)
+    print(f"Precompressed {written['gzip']} gzip and {written['br']} brotli files in {args.root}"
+          + ('' if brotli is not None else ' (install brotli for .br files)'))
+
+if __name__ == '__main__':
+    main()
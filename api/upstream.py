@@ -0,0 +1,236 @@
+"""
+Guards for calls to a slow or failing upstream service (the Gemini API).
+
+UpstreamGuard bounds how long callers wait and how hard the upstream is hit:
+
+- single-flight: concurrent calls with the same key share one upstream call
+- latency budget: callers wait at most `budget` seconds before falling back;
+  a call still queued when its budget runs out is never sent, and one that
+  starts is passed `budget` for upstreams that accept a deadline (a call that
+  runs past it still returns its result to any remaining waiters and to the
+  caller's function, but counts as a failure)
+- concurrency limit: at most `max_concurrency` upstream calls run at once
+- circuit breaker: after `failure_threshold` consecutive failures (errors, or
+  upstream calls taking longer than the budget) new calls fail fast for
+  `reset_timeout` seconds, then a single trial call decides whether to close
+  it again. An overrun counts as soon as the budget runs out, so an upstream
+  that hangs opens the breaker without waiting for its calls to return. Time
+  spent queued behind the concurrency limit is not held against the upstream.
+
+Callers catch UpstreamUnavailable and use their fallback.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+class UpstreamUnavailable(Exception):
+    """The guard declined or gave up on a call: 'open', 'timeout' or 'expired'"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+class CircuitBreaker:
+    """Consecutive-failure breaker with a single half-open trial call"""
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """Whether a new call may go upstream; in half-open state only one at a time"""
+        with self._lock:
+            if self._state == self.OPEN:
+                if self._clock() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+                self._trial_running = False
+            if self._state == self.HALF_OPEN:
+                if self._trial_running:
+                    return False
+                self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("Circuit breaker closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._state == self.HALF_OPEN or (self._state == self.CLOSED
+                                                 and self._failures >= self.failure_threshold):
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+                self.opened += 1
+                logger.warning(f"Circuit breaker opened after {self._failures} consecutive failures; "
+                               f"failing fast for {self.reset_timeout:.0f}s")
+
+    def release(self):
+        """An allowed call never reached the upstream; let another trial through"""
+        with self._lock:
+            self._trial_running = False
+
+class UpstreamGuard:
+    """Single-flight, budgeted, concurrency-limited calls behind a circuit breaker"""
+
+    def __init__(self, name: str, budget: float, max_concurrency: int, failure_threshold: int,
+                 reset_timeout: float):
+        self.name = name
+        self.budget = budget
+        self.max_concurrency = max_concurrency
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._flights: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pid = None
+        self._running = 0
+        self._stats = {'calls': 0, 'coalesced': 0, 'upstream_calls': 0, 'failures': 0, 'slow': 0,
+                       'timeouts': 0, 'rejected': 0, 'expired': 0}
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # Executor threads don't survive fork, so create one per process
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                                thread_name_prefix=f'{self.name}-upstream')
+            self._pid = os.getpid()
+            self._flights.clear()
+        return self._executor
+
+    def submit(self, key: str, fn: Callable[[float], Any], budget: Optional[float] = None) -> Future:
+        """Future for fn(budget), shared with concurrent callers of the same key.
+        Raises UpstreamUnavailable('open') when the breaker is open."""
+        budget = self.budget if budget is None else budget
+        with self._lock:
+            executor = self._get_executor()
+            self._stats['calls'] += 1
+            future = self._flights.get(key)
+            if future is not None:
+                self._stats['coalesced'] += 1
+                return future
+            if not self.breaker.allow():
+                self._stats['rejected'] += 1
+                raise UpstreamUnavailable('open')
+            future = Future()
+            self._flights[key] = future
+        executor.submit(self._run, key, fn, budget, time.monotonic() + budget, future)
+        return future
+
+    def _run(self, key: str, fn: Callable[[float], Any], budget: float, deadline: float, future: Future):
+        result, error = None, None
+        started = time.monotonic()
+        if started >= deadline:
+            # Every caller has given up while this waited for a slot
+            self.breaker.release()
+            error = UpstreamUnavailable('expired')
+            with self._lock:
+                self._stats['expired'] += 1
+        else:
+            with self._lock:
+                self._stats['upstream_calls'] += 1
+                self._running += 1
+            call = {'done': False, 'overran': False}
+            timer = threading.Timer(budget, self._overran, (call,))
+            timer.daemon = True
+            timer.start()
+            try:
+                result = fn(budget)
+            except Exception as e:
+                error = e
+            finally:
+                timer.cancel()
+                with self._lock:
+                    self._running -= 1
+                    call['done'] = True
+            if call['overran']:
+                pass  # already counted as a failure when the budget ran out
+            elif error is not None:
+                self.breaker.record_failure()
+                with self._lock:
+                    self._stats['failures'] += 1
+            elif time.monotonic() - started > budget:
+                self.breaker.record_failure()
+                with self._lock:
+                    self._stats['slow'] += 1
+            else:
+                self.breaker.record_success()
+        with self._lock:
+            if self._flights.get(key) is future:
+                del self._flights[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _overran(self, call: Dict[str, bool]):
+        """Timer callback: the upstream call is still running when its budget ran out"""
+        with self._lock:
+            if call['done']:
+                return
+            call['overran'] = True
+            self._stats['slow'] += 1
+        self.breaker.record_failure()
+
+    def call(self, key: str, fn: Callable[[float], Any], budget: Optional[float] = None) -> Any:
+        """fn's result, or UpstreamUnavailable once the budget is spent"""
+        budget = self.budget if budget is None else budget
+        future = self.submit(key, fn, budget)
+        try:
+            return future.result(timeout=budget)
+        except FutureTimeoutError:
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise UpstreamUnavailable('timeout')
+
+    async def call_async(self, key: str, fn: Callable[[float], Any], budget: Optional[float] = None) -> Any:
+        """call() for the event loop; the upstream call runs on the guard's threads"""
+        budget = self.budget if budget is None else budget
+        wrapped = asyncio.wrap_future(self.submit(key, fn, budget))
+        # Retrieve a late failure after this caller gave up, so it isn't logged as unhandled
+        wrapped.add_done_callback(lambda f: f.cancelled() or f.exception())
+        try:
+            # shield: a caller timing out must not cancel the flight other callers share
+            return await asyncio.wait_for(asyncio.shield(wrapped), budget)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise UpstreamUnavailable('timeout')
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._flights)
+            stats['running'] = self._running
+        state = self.breaker.state
+        stats['breaker_state'] = state
+        stats['breaker_open'] = int(state == CircuitBreaker.OPEN)
+        stats['breaker_opened'] = self.breaker.opened
+        stats['budget_seconds'] = self.budget
+        stats['max_concurrency'] = self.max_concurrency
+        return stats
@@ -0,0 +1,106 @@
+"""Request parsing and validation shared by the WSGI (app.py) and ASGI (asgi.py) apps"""
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+# Page sizes for /api/products keyset pagination
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Result counts for /api/alternatives/<product_id>
+DEFAULT_ALTERNATIVES = 5
+MAX_ALTERNATIVES = 50
+
+def validate_json_data(data, required_fields):
+    """Validate JSON request data"""
+    if not data:
+        return False, 'Missing JSON body'
+    
+    for field in required_fields:
+        if field not in data:
+            return False, f'Missing required field: {field}'
+    
+    return True, None
+
+def _to_number(value: Optional[str], cast):
+    if value is None:
+        return None
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        raise ValueError(value)
+
+def parse_product_filters(args: Mapping[str, str]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """Read /api/products filters from query args; returns (filters, error)"""
+    filters = {
+        'category': args.get('category'),
+        'packaging': args.get('packaging'),
+    }
+    organic = args.get('organic')
+    if organic is not None:
+        if organic.lower() not in ('true', 'false', '1', '0'):
+            return None, 'organic must be true or false'
+        filters['is_organic'] = organic.lower() in ('true', '1')
+    for name in ('min_carbon', 'max_carbon', 'min_price', 'max_price'):
+        try:
+            value = _to_number(args.get(name), float)
+        except ValueError:
+            return None, f'{name} must be a number'
+        if value is not None:
+            filters[name] = value
+    return filters, None
+
+def parse_page_args(args: Mapping[str, str]) -> Tuple[Optional[int], Optional[int], Optional[str]]:
+    """Read keyset pagination args; returns (cursor, limit, error)"""
+    try:
+        cursor = _to_number(args.get('cursor'), int)
+        limit = _to_number(args.get('limit'), int)
+    except ValueError:
+        return None, None, 'cursor and limit must be integers'
+    if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+        return None, None, f'limit must be between 1 and {MAX_PAGE_SIZE}'
+    return cursor, limit, None
+
+def parse_alternative_args(args: Mapping[str, str]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """Read /api/alternatives args (k, max_price_ratio, min_carbon_saved); returns (options, error)"""
+    try:
+        k = _to_number(args.get('k'), int)
+    except ValueError:
+        return None, 'k must be an integer'
+    if k is None:
+        k = DEFAULT_ALTERNATIVES
+    if not 1 <= k <= MAX_ALTERNATIVES:
+        return None, f'k must be between 1 and {MAX_ALTERNATIVES}'
+    options: Dict[str, Any] = {'k': k}
+    for name in ('max_price_ratio', 'min_carbon_saved'):
+        try:
+            value = _to_number(args.get(name), float)
+        except ValueError:
+            return None, f'{name} must be a number'
+        if value is not None and not (value >= 0 and value != float('inf')):
+            return None, f'{name} must be a non-negative number'
+        options[name] = value
+    return options, None
+
+def _is_int(value: Any) -> bool:
+    # bool is an int subclass, but true/false is not an id
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def parse_batch_request(data: Any) -> Tuple[Optional[List[int]], Optional[int], Optional[str]]:
+    """Read a /api/recommendations/batch body; returns (product_ids, user_id, error).
+    product_ids is None when the user's cart should be used."""
+    if not isinstance(data, dict) or ('product_ids' not in data and 'user_id' not in data):
+        return None, None, 'Provide product_ids or user_id'
+    user_id = data.get('user_id', 1)
+    if not _is_int(user_id):
+        return None, None, 'user_id must be an integer'
+    if 'product_ids' not in data:
+        return None, user_id, None
+    product_ids = data['product_ids']
+    if not isinstance(product_ids, list):
+        return None, None, 'product_ids must be a list'
+    if not all(_is_int(pid) for pid in product_ids):
+        return None, None, 'product_ids must be a list of integers'
+    return product_ids, user_id, None
+
+def product_page(items: List[Dict[str, Any]], limit: int) -> Dict[str, Any]:
+    """Page payload from up to limit + 1 rows (the extra row signals a next page)"""
+    next_cursor = items[limit - 1]['id'] if len(items) > limit else None
+    return {'items': items[:limit], 'next_cursor': next_cursor, 'limit': limit}
@@ -0,0 +1,60 @@
+"""Shared helpers for the benchmark scripts"""
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, Any, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_DIR = os.path.join(ROOT, 'api')
+DATA_DIR = os.getenv('ESG_BENCH_DATA_DIR', os.path.join(ROOT, 'benchmarks', 'data'))
+
+def use_api(db_path: str):
+    """Point the api modules at db_path; call before importing any of them"""
+    os.environ['ESG_DB_PATH'] = db_path
+    if API_DIR not in sys.path:
+        sys.path.insert(0, API_DIR)
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+def latency_summary(latencies: List[float], elapsed: float) -> Dict[str, Any]:
+    """Throughput and p50/p95/p99 latency (ms) from per-call durations in seconds"""
+    return {
+        'count': len(latencies),
+        'rps': round(len(latencies) / elapsed, 1) if elapsed > 0 else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 4),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 4),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 4),
+    }
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_for_health(base_url: str, timeout: float = 60.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f'{base_url}/api/health', timeout=1) as resp:
+                if resp.status == 200:
+                    return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    raise RuntimeError(f'Server at {base_url} did not become healthy')
+
+def stop_server(proc: subprocess.Popen):
+    proc.terminate()
+    try:
+        proc.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
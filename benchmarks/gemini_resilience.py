@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Exercises the Gemini upstream guard (single-flight, latency budget,
+concurrency limit, circuit breaker) against the local stub model and reports
+per-scenario latency, upstream call counts and breaker state.
+
+Usage:
+    python benchmarks/gemini_resilience.py --budget 0.5 --concurrency 50
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, Any, Callable, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import API_DIR, latency_summary
+
+_ids = itertools.count(1)
+
+def product_pair():
+    """A fresh (original, alternative) pair, so earlier scenarios' cached reasons don't apply"""
+    a, b = next(_ids), next(_ids)
+    return ({'id': a, 'name': f'Product {a}', 'description': 'Plastic packaging'},
+            {'id': b, 'name': f'Product {b}', 'description': 'Organic, paper packaging'})
+
+def run_concurrently(call: Callable[[int], str], count: int) -> Dict[str, Any]:
+    latencies: List[float] = [0.0] * count
+    reasons: List[str] = [''] * count
+    start = threading.Barrier(count)
+
+    def worker(i: int):
+        start.wait()
+        t0 = time.perf_counter()
+        reasons[i] = call(i)
+        latencies[i] = time.perf_counter() - t0
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    summary = latency_summary(latencies, time.perf_counter() - started)
+    summary['max_ms'] = round(max(latencies) * 1000, 4)
+    summary['fallbacks'] = sum(1 for reason in reasons if not reason.startswith('Stub reason'))
+    return summary
+
+def run(budget: float, concurrency: int, latency: float) -> Dict[str, Any]:
+    os.environ['ESG_GEMINI_BUDGET'] = str(budget)
+    os.environ['ESG_GEMINI_BREAKER_RESET'] = str(budget * 4)
+    # The pairs are synthetic: keep the stored-reason lookup (and the database) out of it
+    os.environ['ESG_STORED_REASONS'] = 'false'
+    if API_DIR not in sys.path:
+        sys.path.insert(0, API_DIR)
+    import gemini
+    import gemini_stub
+
+    stub = gemini_stub.install(latency)
+    guard = gemini.gemini_guard
+    results: Dict[str, Any] = {'budget_seconds': budget, 'stub_latency_seconds': latency,
+                               'max_concurrency': guard.max_concurrency}
+
+    def scenario(name: str, call: Callable[[int], str], count: int = concurrency):
+        calls_before = stub.calls
+        stub.max_concurrent = 0
+        summary = run_concurrently(call, count)
+        summary['upstream_calls'] = stub.calls - calls_before
+        summary['max_upstream_concurrency'] = stub.max_concurrent
+        summary['breaker_state'] = guard.breaker.state
+        results[name] = summary
+
+    # Identical prompts at once: one upstream call
+    original, alternative = product_pair()
+    scenario('identical_burst', lambda i: gemini.get_gemini_reason(original, alternative))
+
+    # Distinct prompts at once: upstream concurrency stays at the limit
+    pairs = [product_pair() for _ in range(concurrency)]
+    scenario('distinct_burst', lambda i: gemini.get_gemini_reason(*pairs[i]))
+
+    # Upstream hangs: callers fall back at the budget and the breaker opens
+    stub.latency = budget * 6
+    pairs = [product_pair() for _ in range(concurrency)]
+    scenario('hanging_upstream', lambda i: gemini.get_gemini_reason(*pairs[i]))
+    pairs = [product_pair() for _ in range(concurrency)]
+    scenario('breaker_open', lambda i: gemini.get_gemini_reason(*pairs[i]))
+
+    # Hung calls keep their slots until they return (the pinned client has no
+    # per-call deadline, only its own default), so let them drain first
+    stub.latency = latency
+    while guard.stats()['running']:
+        time.sleep(0.05)
+
+    # Upstream errors until it recovers; the half-open trial closes the breaker
+    stub.failing = True
+    time.sleep(guard.breaker.reset_timeout)
+    pairs = [product_pair() for _ in range(concurrency)]
+    scenario('failing_upstream', lambda i: gemini.get_gemini_reason(*pairs[i]))
+    stub.failing = False
+    time.sleep(guard.breaker.reset_timeout)
+    pairs = [product_pair() for _ in range(concurrency)]
+    scenario('recovered', lambda i: gemini.get_gemini_reason(*pairs[i]), 1)
+    scenario('after_recovery', lambda i: gemini.get_gemini_reason(*pairs[i]))
+
+    results['guard'] = guard.stats()
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Gemini upstream guard scenarios against the stub model')
+    parser.add_argument('--budget', type=float, default=0.5, help='ESG_GEMINI_BUDGET seconds')
+    parser.add_argument('--concurrency', type=int, default=50, help='simultaneous callers per scenario')
+    parser.add_argument('--latency', type=float, default=0.1, help='stub Gemini seconds per call')
+    args = parser.parse_args(argv)
+    print(json.dumps(run(args.budget, args.concurrency, args.latency), indent=2))
+
+if __name__ == '__main__':
+    main()
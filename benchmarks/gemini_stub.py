@@ -0,0 +1,98 @@
+"""
+Local stand-in for the Gemini model.
+
+install() swaps the stub into gemini.py's model slot so the normal code
+paths (caching, batching, fallbacks, the upstream guard) run without
+network access. Latency and failures can be changed while it runs: set
+`latency`, `error_rate` (fraction of calls that raise) or `failing` (every
+call raises). generate_content and generate_content_async take the same
+arguments as the pinned google-generativeai GenerativeModel; the keyword
+arguments of every call are kept in `call_kwargs`.
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+import time
+
+STUB_API_KEY = 'benchmark-stub'
+
+class StubResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+class StubError(Exception):
+    pass
+
+class StubModel:
+    def __init__(self, latency: float = 0.05, error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.failing = False
+        self.calls = 0
+        self.call_kwargs = []
+        self.max_concurrent = 0
+        self._concurrent = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+
+    def _fails(self) -> bool:
+        with self._lock:
+            return self.failing or (self.error_rate > 0 and self._random.random() < self.error_rate)
+
+    def _reply(self, prompt: str) -> StubResponse:
+        pairs = re.findall(r'^\d+\. Product A:', prompt, flags=re.MULTILINE)
+        if pairs:
+            # Batched prompt: a JSON array with one reason per pair
+            return StubResponse(json.dumps([f'Stub reason {i}.' for i in range(1, len(pairs) + 1)]))
+        return StubResponse('Stub reason: the alternative is the greener choice.')
+
+    def _record(self, generation_config, safety_settings, stream, kwargs: dict):
+        """Count a call and keep the keyword arguments it was given"""
+        passed = dict(kwargs)
+        for name, value in (('generation_config', generation_config), ('safety_settings', safety_settings)):
+            if value is not None:
+                passed[name] = value
+        if stream:
+            passed['stream'] = stream
+        with self._lock:
+            self.calls += 1
+            self.call_kwargs.append(passed)
+
+    def generate_content(self, contents, *, generation_config=None, safety_settings=None, stream=False,
+                         **kwargs) -> StubResponse:
+        self._record(generation_config, safety_settings, stream, kwargs)
+        with self._lock:
+            self._concurrent += 1
+            self.max_concurrent = max(self.max_concurrent, self._concurrent)
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            if self._fails():
+                raise StubError('503 Service Unavailable')
+            return self._reply(contents)
+        finally:
+            with self._lock:
+                self._concurrent -= 1
+
+    async def generate_content_async(self, contents, *, generation_config=None, safety_settings=None,
+                                     stream=False, **kwargs) -> StubResponse:
+        self._record(generation_config, safety_settings, stream, kwargs)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self._fails():
+            raise StubError('503 Service Unavailable')
+        return self._reply(contents)
+
+def install(latency: float = 0.05, error_rate: float = 0.0) -> StubModel:
+    """Route gemini.get_model() to a StubModel; returns the stub"""
+    import gemini
+
+    model = StubModel(latency, error_rate)
+    os.environ['GEMINI_API_KEY'] = STUB_API_KEY
+    with gemini._model_lock:
+        gemini._model = model
+        gemini._model_api_key = STUB_API_KEY
+    return model
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+In-process micro-benchmarks for the recommendation hot paths:
+find_greener_alternative (SQL, in-memory and precomputed lookups) and
+ESGScorer (scalar and vectorized).
+
+Usage:
+    python benchmarks/micro.py --db benchmarks/data/catalog_100000.db
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import Dict, Any, Callable, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import latency_summary, use_api
+
+def time_calls(fn: Callable, args: List, warmup: int = 20) -> Dict[str, Any]:
+    for a in args[:warmup]:
+        fn(a)
+    latencies = []
+    started = time.perf_counter()
+    for a in args:
+        t0 = time.perf_counter()
+        fn(a)
+        latencies.append(time.perf_counter() - t0)
+    return latency_summary(latencies, time.perf_counter() - started)
+
+def run_micro(db_path: str, iterations: int = 2000, seed: int = 7, memory: bool = True) -> Dict[str, Any]:
+    use_api(db_path)
+    import db
+    import recommender
+    from recommender import ESGScorer, find_greener_alternative
+
+    db.ensure_schema()
+    rng = random.Random(seed)
+    with db.get_db_connection() as conn:
+        total, max_id = conn.execute('SELECT COUNT(*), MAX(id) FROM products').fetchone()
+    # Same sample on every run for a given catalog and seed
+    sample = list(db.get_products_by_ids([rng.randint(1, max_id) for _ in range(iterations)]).values())
+    results: Dict[str, Any] = {'products': total}
+
+    results['esg_scorer_scalar'] = time_calls(ESGScorer.calculate_sustainability_score, sample)
+
+    batch = db.query_products(limit=min(total, 100000))
+    started = time.perf_counter()
+    ESGScorer.score_products(batch)
+    elapsed = time.perf_counter() - started
+    results['esg_scorer_vectorized'] = {'rows': len(batch), 'seconds': round(elapsed, 4),
+                                        'rows_per_second': round(len(batch) / elapsed, 1)}
+
+    recommender.PRECOMPUTED_ALTERNATIVES = True
+    started = time.perf_counter()
+    recommender.refresh_alternatives(rebuild_all=True)
+    results['alternatives_build_seconds'] = round(time.perf_counter() - started, 3)
+    results['find_greener_alternative_precomputed'] = time_calls(find_greener_alternative, sample)
+
+    recommender.PRECOMPUTED_ALTERNATIVES = False
+    recommender.ALTERNATIVE_LOOKUP = 'sql'
+    results['find_greener_alternative_sql'] = time_calls(find_greener_alternative, sample)
+
+    if memory:
+        recommender.ALTERNATIVE_LOOKUP = 'memory'
+        started = time.perf_counter()
+        recommender.product_index.load()
+        results['product_index_load_seconds'] = round(time.perf_counter() - started, 3)
+        results['find_greener_alternative_memory'] = time_calls(find_greener_alternative, sample)
+
+    db.close_pool()
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Micro-benchmarks for scoring and alternative lookup')
+    parser.add_argument('--db', required=True)
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--no-memory', action='store_true', help='skip the in-memory ProductIndex lookup')
+    args = parser.parse_args(argv)
+    print(json.dumps(run_micro(os.path.abspath(args.db), args.iterations, memory=not args.no_memory)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Per-row dicts vs records.Product for a full catalog read: fetch time,
+memory retained (tracemalloc) and JSON encoding time.
+
+Usage:
+    python benchmarks/row_memory.py --db benchmarks/data/catalog_1000000.db
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Dict, Any, Callable, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import use_api
+
+def measure(fetch: Callable[[], List], encode: Callable[[List], str]) -> Dict[str, Any]:
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    rows = fetch()
+    fetch_seconds = time.perf_counter() - started
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    body = encode(rows)
+    encode_seconds = time.perf_counter() - started
+    return {
+        'rows': len(rows),
+        'fetch_seconds': round(fetch_seconds, 3),
+        'retained_mb': round(retained / 1e6, 1),
+        'bytes_per_row': round(retained / max(len(rows), 1)),
+        'json_seconds': round(encode_seconds, 3),
+        'json_bytes': len(body),
+    }
+
+def run(db_path: str) -> Dict[str, Any]:
+    use_api(db_path)
+    import db
+    import records
+
+    def fetch_dicts():
+        with db.get_db_connection() as conn:
+            c = conn.cursor()
+            c.execute(db.PRODUCT_SELECT)
+            return [dict(zip(db.PRODUCT_COLUMNS, row)) for row in c.fetchall()]
+
+    def encode_dicts(rows):
+        return json.dumps(rows, sort_keys=True, separators=(',', ':'))
+
+    db.ensure_schema()
+    results = {
+        'dict': measure(fetch_dicts, encode_dicts),
+        'record': measure(db.get_all_products, records.dumps),
+    }
+    db.close_pool()
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare dict rows with slotted records')
+    parser.add_argument('--db', required=True)
+    args = parser.parse_args(argv)
+    print(json.dumps(run(os.path.abspath(args.db)), indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Reproducible benchmark suite for the API hot paths.
+
+For each catalog size (1k, 100k and 1M products by default) this seeds a
+synthetic database (cached under benchmarks/data), runs the in-process
+micro-benchmarks, then serves the API under the production gunicorn
+profile with a stubbed Gemini model and measures p50/p95/p99 latency and
+requests/second per endpoint. Results are written as JSON and can be
+compared against a stored baseline.
+
+Usage:
+    python benchmarks/run.py --sizes 1000 --output results.json
+    python benchmarks/run.py --save-baseline benchmarks/baseline.json
+    python benchmarks/run.py --baseline benchmarks/baseline.json --tolerance 0.2
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+from common import DATA_DIR, free_port, latency_summary, stop_server, wait_for_health
+
+DEFAULT_SIZES = [1000, 100000, 1000000]
+
+# Metrics where a larger value is better; everything else (latencies) is lower-is-better
+HIGHER_IS_BETTER = ('rps', 'rows_per_second')
+
+# --- Seeding ---
+def ensure_catalog(size: int, users: int, cart_items: int, reseed: bool = False) -> Tuple[str, Dict[str, Any]]:
+    """Path of a seeded database for size, reusing a cached one with the same parameters"""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    db_path = os.path.join(DATA_DIR, f'catalog_{size}.db')
+    meta_path = db_path + '.json'
+    params = {'products': size, 'users': users, 'cart_items': cart_items}
+    if not reseed and os.path.exists(db_path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get('params') == params:
+            return db_path, meta['stats']
+
+    print(f'Seeding {size} products...', file=sys.stderr)
+    output = subprocess.check_output([sys.executable, os.path.join(BENCH_DIR, 'seed.py'), '--db', db_path,
+                                      '--products', str(size), '--users', str(users),
+                                      '--cart-items', str(cart_items)])
+    stats = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+    with open(meta_path, 'w') as f:
+        json.dump({'params': params, 'stats': stats}, f)
+    return db_path, stats
+
+# --- Micro-benchmarks ---
+def run_micro(db_path: str, iterations: int, memory: bool) -> Dict[str, Any]:
+    cmd = [sys.executable, os.path.join(BENCH_DIR, 'micro.py'), '--db', db_path, '--iterations', str(iterations)]
+    if not memory:
+        cmd.append('--no-memory')
+    output = subprocess.check_output(cmd)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+# --- HTTP load ---
+class Scenario:
+    """One endpoint under load: builds a randomized request per call"""
+
+    def __init__(self, name: str, method: str, path: str, body: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.body = body
+
+    def request(self, base_url: str, rng: random.Random, ctx: Dict[str, Any]) -> urllib.request.Request:
+        values = {
+            'pid': rng.randint(1, ctx['max_product_id']),
+            'uid': rng.randint(1, ctx['max_user_id']),
+            'category': rng.choice(ctx['categories']),
+        }
+        data = None
+        headers = {}
+        if self.body is not None:
+            payload = {k: (values[v[1:-1]] if isinstance(v, str) and v.startswith('{') else v)
+                       for k, v in self.body.items()}
+            data = json.dumps(payload).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        return urllib.request.Request(base_url + self.path.format(**values), data=data,
+                                      method=self.method, headers=headers)
+
+SCENARIOS = [
+    Scenario('products_page', 'GET', '/api/products?limit=100&cursor={pid}'),
+    Scenario('products_category', 'GET', '/api/products?category={category}&limit=100'),
+    Scenario('cart_get', 'GET', '/api/cart?user_id={uid}'),
+    Scenario('cart_summary', 'GET', '/api/cart/summary?user_id={uid}'),
+    Scenario('cart_post', 'POST', '/api/cart', {'user_id': '{uid}', 'product_id': '{pid}', 'quantity': 1}),
+    Scenario('alternatives', 'GET', '/api/alternatives/{pid}?k=5&max_price_ratio=1.2'),
+    Scenario('recommendation', 'POST', '/api/recommendation', {'product_id': '{pid}'}),
+]
+
+def load_context(db_path: str) -> Dict[str, Any]:
+    conn = sqlite3.connect(db_path)
+    try:
+        return {
+            'max_product_id': conn.execute('SELECT MAX(id) FROM products').fetchone()[0],
+            'max_user_id': conn.execute('SELECT MAX(id) FROM users').fetchone()[0],
+            'categories': [row[0] for row in conn.execute('SELECT DISTINCT category FROM products')],
+        }
+    finally:
+        conn.close()
+
+def run_scenario(scenario: Scenario, base_url: str, ctx: Dict[str, Any], clients: int,
+                 duration: float, seed: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    counts = {'errors': 0, 'not_found': 0}
+    lock = threading.Lock()
+    stop_at = time.time() + duration
+
+    def client(client_seed: int):
+        rng = random.Random(client_seed)
+        local, errors, not_found = [], 0, 0
+        while time.time() < stop_at:
+            req = scenario.request(base_url, rng, ctx)
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(req, timeout=30) as resp:
+                    resp.read()
+            except urllib.error.HTTPError as e:
+                # 404 is a valid answer (e.g. no greener alternative)
+                if e.code == 404:
+                    not_found += 1
+                else:
+                    errors += 1
+            except (urllib.error.URLError, ConnectionError):
+                errors += 1
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+            counts['errors'] += errors
+            counts['not_found'] += not_found
+
+    started = time.time()
+    threads = [threading.Thread(target=client, args=(seed * 1000 + i,)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    result = latency_summary(latencies, time.time() - started)
+    result.update(counts)
+    return result
+
+def run_http(db_path: str, args) -> Dict[str, Any]:
+    """Serve a throwaway copy of db_path and load each scenario in turn"""
+    results: Dict[str, Any] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        work_db = os.path.join(tmp, 'bench.db')
+        shutil.copy(db_path, work_db)
+        ctx = load_context(work_db)
+        port = free_port()
+        base_url = f'http://127.0.0.1:{port}'
+        proc = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, 'server.py'), '--db', work_db,
+                                 '--port', str(port), '--workers', str(args.workers),
+                                 '--threads', str(args.threads), '--gemini-latency', str(args.gemini_latency)],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_health(base_url, timeout=300)
+            for i, scenario in enumerate(SCENARIOS):
+                if args.warmup > 0:
+                    run_scenario(scenario, base_url, ctx, args.clients, args.warmup, seed=i + 100)
+                results[scenario.name] = run_scenario(scenario, base_url, ctx, args.clients, args.duration, seed=i)
+                print(f"  {scenario.name}: {results[scenario.name]['rps']} req/s, "
+                      f"p95 {results[scenario.name]['p95_ms']} ms", file=sys.stderr)
+        finally:
+            stop_server(proc)
+    return results
+
+# --- Baseline comparison ---
+def flatten(results: Dict[str, Any], prefix: str = '') -> Dict[str, float]:
+    """Dotted metric paths for comparable numbers (throughput and latency only)"""
+    flat = {}
+    for key, value in results.items():
+        path = f'{prefix}.{key}' if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and (key in HIGHER_IS_BETTER or key.endswith('_ms')):
+            flat[path] = float(value)
+    return flat
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> Dict[str, Any]:
+    """Relative change per metric; flags regressions worse than tolerance"""
+    now, base = flatten(current['results']), flatten(baseline['results'])
+    metrics, regressions = {}, []
+    for path in sorted(now.keys() & base.keys()):
+        if not base[path]:
+            continue
+        change = (now[path] - base[path]) / base[path]
+        worse = -change if path.rsplit('.', 1)[-1] in HIGHER_IS_BETTER else change
+        metrics[path] = {'baseline': base[path], 'current': now[path], 'change': round(change, 4)}
+        if worse > tolerance:
+            regressions.append(path)
+    return {'tolerance': tolerance, 'metrics': metrics, 'regressions': regressions}
+
+def environment() -> Dict[str, Any]:
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'sqlite': sqlite3.sqlite_version,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the API hot paths')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='catalog sizes')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--cart-items', type=int, default=5, help='cart lines per user')
+    parser.add_argument('--reseed', action='store_true', help='rebuild cached catalogs')
+    parser.add_argument('--iterations', type=int, default=2000, help='calls per micro-benchmark')
+    parser.add_argument('--no-memory', action='store_true', help='skip the in-memory index micro-benchmark')
+    parser.add_argument('--skip-micro', action='store_true')
+    parser.add_argument('--skip-http', action='store_true')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent HTTP clients')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per endpoint')
+    parser.add_argument('--warmup', type=float, default=2.0, help='unmeasured seconds per endpoint')
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=8, help='threads per gunicorn worker')
+    parser.add_argument('--gemini-latency', type=float, default=0.05, help='stub Gemini seconds per call')
+    parser.add_argument('--output', help='write results JSON here (default: stdout)')
+    parser.add_argument('--baseline', help='compare against this results file')
+    parser.add_argument('--save-baseline', help='also write the results to this baseline file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression')
+    args = parser.parse_args(argv)
+
+    report: Dict[str, Any] = {
+        'benchmark': 'api',
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'environment': environment(),
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'baseline', 'save_baseline')},
+        'results': {},
+    }
+    for size in args.sizes:
+        db_path, seed_stats = ensure_catalog(size, args.users, args.cart_items, args.reseed)
+        entry: Dict[str, Any] = {'seed': seed_stats}
+        if not args.skip_micro:
+            print(f'Micro-benchmarks ({size} products)...', file=sys.stderr)
+            entry['micro'] = run_micro(db_path, args.iterations, memory=not args.no_memory)
+        if not args.skip_http:
+            print(f'HTTP benchmarks ({size} products)...', file=sys.stderr)
+            entry['http'] = run_http(db_path, args)
+        report['results'][str(size)] = entry
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['comparison'] = compare(report, json.load(f), args.tolerance)
+        for path in report['comparison']['regressions']:
+            metric = report['comparison']['metrics'][path]
+            print(f"REGRESSION {path}: {metric['baseline']} -> {metric['current']} "
+                  f"({metric['change']:+.1%})", file=sys.stderr)
+        exit_code = 1 if report['comparison']['regressions'] else 0
+
+    text = json.dumps(report, indent=2)
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, 'w') as f:
+            f.write(text + '\n')
+    if not args.output:
+        print(text)
+    sys.exit(exit_code)
+
+if __name__ == '__main__':
+    main()
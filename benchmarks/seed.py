@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Seed a benchmark database with a synthetic catalog, users and carts.
+
+Products are generated deterministically (per --seed) and loaded through
+ingest.ingest_products, so stored scores match what production would hold.
+
+Usage:
+    python benchmarks/seed.py --db benchmarks/data/catalog_100000.db --products 100000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import Dict, Any, Iterator
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import use_api
+
+BASE_CATEGORIES = ['meat', 'dairy', 'grains', 'produce', 'bakery', 'beverages', 'snacks', 'frozen',
+                   'household', 'personal-care']
+PACKAGING = ['plastic', 'paper', 'glass', 'cardboard', 'metal', 'compostable', 'none']
+
+def synthetic_products(count: int, categories: int, seed: int) -> Iterator[Dict[str, Any]]:
+    rng = random.Random(seed)
+    names = [f'{BASE_CATEGORIES[i % len(BASE_CATEGORIES)]}-{i // len(BASE_CATEGORIES)}'
+             for i in range(categories)]
+    for i in range(count):
+        organic = rng.random() < 0.35
+        yield {
+            'supplier_sku': f'BENCH-{i:08d}',
+            'name': f"{'Organic ' if organic else ''}Product {i}",
+            'description': f'Synthetic benchmark product {i}',
+            'category': rng.choice(names),
+            'packaging': rng.choice(PACKAGING),
+            'is_organic': organic,
+            'carbon_kg': round(rng.uniform(0.1, 8.0), 2),
+            'price': round(rng.uniform(0.5, 40.0), 2),
+        }
+
+def seed_database(db_path: str, products: int, users: int, cart_items: int,
+                  categories: int = 100, seed: int = 42) -> Dict[str, Any]:
+    """Create db_path (replacing it) and fill it; returns seeding stats"""
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    use_api(db_path)
+    import db
+    from ingest import ingest_products
+
+    started = time.time()
+    db.init_db()
+    stats = ingest_products(synthetic_products(products, categories, seed), progress_every=max(products, 1))
+
+    rng = random.Random(seed + 1)
+    with db.get_db_connection() as conn:
+        conn.executemany('INSERT INTO users (name, points) VALUES (?, ?)',
+                         ((f'bench-user-{i}', 0) for i in range(users)))
+        user_ids = [row[0] for row in conn.execute('SELECT id FROM users')]
+        max_product = conn.execute('SELECT MAX(id) FROM products').fetchone()[0]
+        lines = {}
+        for user_id in user_ids:
+            for _ in range(cart_items):
+                lines[(user_id, rng.randint(1, max_product))] = rng.randint(1, 3)
+        conn.executemany('INSERT INTO cart (user_id, product_id, quantity) VALUES (?, ?, ?)',
+                         ((u, p, q) for (u, p), q in lines.items()))
+        db.rebuild_cart_summaries(conn)
+        conn.commit()
+    db.close_pool()
+
+    return {
+        'products': stats['rows_written'],
+        'users': len(user_ids),
+        'cart_lines': len(lines),
+        'ingest_rows_per_second': stats['rows_per_second'],
+        'seconds': round(time.time() - started, 2),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Seed a synthetic benchmark database')
+    parser.add_argument('--db', required=True)
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--cart-items', type=int, default=5, help='cart lines per user')
+    parser.add_argument('--categories', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    stats = seed_database(args.db, args.products, args.users, args.cart_items, args.categories, args.seed)
+    print(json.dumps(stats))
+
+if __name__ == '__main__':
+    main()
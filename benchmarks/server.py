@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Run the API under the production gunicorn profile (api/gunicorn.conf.py)
+against a benchmark database, with the Gemini stub installed.
+
+Usage:
+    python benchmarks/server.py --db benchmarks/data/catalog_1000.db --port 5050
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import API_DIR, use_api
+
+from gunicorn.app.base import Application
+
+class BenchmarkApplication(Application):
+    def __init__(self, gemini_latency: float):
+        self.gemini_latency = gemini_latency
+        super().__init__()
+
+    def load_config(self):
+        self.load_config_from_file(os.path.join(API_DIR, 'gunicorn.conf.py'))
+
+    def load(self):
+        import gemini_stub
+        from app import app
+
+        gemini_stub.install(self.gemini_latency)
+        return app
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the API for benchmarking')
+    parser.add_argument('--db', required=True)
+    parser.add_argument('--port', type=int, default=5050)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--gemini-latency', type=float, default=0.05, help='simulated seconds per Gemini call')
+    args = parser.parse_args(argv)
+
+    os.environ.update({'PORT': str(args.port), 'WEB_CONCURRENCY': str(args.workers),
+                       'GUNICORN_THREADS': str(args.threads)})
+    os.environ.pop('ESG_SCHEMA_READY', None)
+    use_api(os.path.abspath(args.db))
+    os.chdir(API_DIR)
+    sys.argv = sys.argv[:1]  # gunicorn must not parse our options
+    BenchmarkApplication(args.gemini_latency).run()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Throughput scaling of the production gunicorn profile across worker counts.
+
+Starts `gunicorn -c gunicorn.conf.py app:app` against a throwaway copy of the
+database with 1, 2, 4 and 8 workers, drives a mixed read/write workload from
+a pool of client threads and reports requests/second and latency percentiles
+as JSON.
+
+Usage:
+    python benchmarks/worker_scaling.py
+    python benchmarks/worker_scaling.py --workers 1 4 --duration 20 --clients 64
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, Any, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import API_DIR, ROOT, free_port, percentile, stop_server, wait_for_health
+
+# (weight, method, path, body) - mostly catalog reads, like the frontend
+WORKLOAD = [
+    (40, 'GET', '/api/products', None),
+    (20, 'GET', '/api/products/{pid}', None),
+    (15, 'GET', '/api/cart', None),
+    (10, 'POST', '/api/cart', {'product_id': '{pid}', 'quantity': 1}),
+    (15, 'POST', '/api/recommendation', {'product_id': '{pid}'}),
+]
+
+def start_server(workers: int, threads: int, port: int, db_path: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        'PORT': str(port),
+        'WEB_CONCURRENCY': str(workers),
+        'GUNICORN_THREADS': str(threads),
+        'ESG_DB_PATH': db_path,
+        'GEMINI_API_KEY': '',  # fallback reasons: measure the app, not the Gemini API
+    })
+    env.pop('ESG_SCHEMA_READY', None)
+    return subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+                            cwd=API_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def build_request(base_url: str, product_ids: List[int], rng: random.Random) -> urllib.request.Request:
+    weights = [w for w, *_ in WORKLOAD]
+    _, method, path, body = rng.choices(WORKLOAD, weights=weights)[0]
+    pid = rng.choice(product_ids)
+    data = None
+    headers = {}
+    if body is not None:
+        data = json.dumps({k: (pid if v == '{pid}' else v) for k, v in body.items()}).encode('utf-8')
+        headers['Content-Type'] = 'application/json'
+    return urllib.request.Request(base_url + path.format(pid=pid), data=data, method=method, headers=headers)
+
+def run_load(base_url: str, clients: int, duration: float, product_ids: List[int]) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.time() + duration
+
+    def client(seed: int):
+        rng = random.Random(seed)
+        local, failed = [], 0
+        while time.time() < stop_at:
+            req = build_request(base_url, product_ids, rng)
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(req, timeout=30) as resp:
+                    resp.read()
+            except urllib.error.HTTPError as e:
+                # 404 "no greener alternative" is a valid answer
+                if e.code >= 500:
+                    failed += 1
+            except (urllib.error.URLError, ConnectionError):
+                failed += 1
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    started = time.time()
+    pool = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.time() - started
+
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure throughput across gunicorn worker counts')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--threads', type=int, default=4, help='threads per worker')
+    parser.add_argument('--clients', type=int, default=32, help='concurrent client threads')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per run')
+    parser.add_argument('--warmup', type=float, default=2.0, help='seconds of unmeasured load per run')
+    parser.add_argument('--db', default=os.path.join(ROOT, 'esg_recommender.db'), help='database to copy')
+    parser.add_argument('--output', help='write results to this JSON file')
+    args = parser.parse_args(argv)
+
+    results = []
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, 'bench.db')
+            if os.path.exists(args.db):
+                shutil.copy(args.db, db_path)
+            port = free_port()
+            base_url = f'http://127.0.0.1:{port}'
+            proc = start_server(workers, args.threads, port, db_path)
+            try:
+                wait_for_health(base_url)
+                with urllib.request.urlopen(f'{base_url}/api/products') as resp:
+                    product_ids = [p['id'] for p in json.loads(resp.read())]
+                if args.warmup > 0:
+                    run_load(base_url, args.clients, args.warmup, product_ids)
+                run = run_load(base_url, args.clients, args.duration, product_ids)
+            finally:
+                stop_server(proc)
+        run.update({'workers': workers, 'threads': args.threads, 'clients': args.clients})
+        results.append(run)
+        print(f"workers={workers}: {run['rps']} req/s, p50 {run['p50_ms']} ms, p95 {run['p95_ms']} ms, "
+              f"errors {run['errors']}", file=sys.stderr)
+
+    base_rps = results[0]['rps'] or 1.0
+    for run in results:
+        run['speedup'] = round(run['rps'] / base_rps, 2)
+
+    report = json.dumps({'benchmark': 'worker_scaling', 'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    print(report)
+
+if __name__ == '__main__':
+    main()
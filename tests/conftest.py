@@ -0,0 +1,68 @@
+"""
+Shared fixtures. The api/ modules are imported as the app imports them
+(flat, from api/ on sys.path); every test gets its own copy of the shipped
+database so the tracked files are never written.
+"""
+import os
+import shutil
+import sqlite3
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_DIR = os.path.join(ROOT, 'api')
+BENCHMARKS_DIR = os.path.join(ROOT, 'benchmarks')
+# Unmigrated database as shipped with the baseline app
+BASELINE_DB = os.path.join(API_DIR, 'esg_recommender.db')
+
+for path in (BENCHMARKS_DIR, API_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import db
+
+@pytest.fixture
+def baseline_db(tmp_path, monkeypatch):
+    """Path of a private copy of the baseline database, used by db.py for this test"""
+    path = str(tmp_path / 'esg_recommender.db')
+    shutil.copyfile(BASELINE_DB, path)
+    with sqlite3.connect(path) as conn:
+        if conn.execute('PRAGMA user_version').fetchone()[0] != 0:
+            pytest.skip('api/esg_recommender.db has been migrated; restore it with git checkout')
+    monkeypatch.setattr(db, 'DB_PATH', path)
+    yield path
+    db.close_pool()
+
+@pytest.fixture
+def catalog_db(baseline_db):
+    """The baseline database migrated, seeded and scored, with per-process caches reset"""
+    import recommender
+    from gemini import reason_cache
+    from response_cache import response_cache
+
+    db.init_db()
+    recommender.ensure_scores_current()
+    recommender.ensure_alternatives_current()
+    recommender.product_index.invalidate()
+    response_cache.clear()
+    reason_cache.clear()
+    yield baseline_db
+    reason_cache.clear()
+    response_cache.clear()
+
+@pytest.fixture
+def client(catalog_db, monkeypatch):
+    """Flask test client for the app on the catalog database (startup already done)"""
+    import app as app_module
+
+    monkeypatch.setattr(app_module, '_startup_done', True)
+    return app_module.app.test_client()
+
+@pytest.fixture
+def asgi_client(catalog_db):
+    """Starlette test client for the ASGI app (lifespan startup is skipped; catalog_db did it)"""
+    from starlette.testclient import TestClient
+    import asgi
+
+    return TestClient(asgi.app, raise_server_exceptions=False)
@@ -0,0 +1,53 @@
+import pytest
+
+from recommender import estimate_carbon_savings, plan_batch_recommendations, summarize_batch_recommendations
+
+def test_quantities_of_repeated_products_are_summed(catalog_db):
+    results, pairs = plan_batch_recommendations([{'product_id': 1, 'quantity': 2}, {'product_id': 1, 'quantity': 1}])
+    assert len(results) == len(pairs) == 1
+    assert results[0]['quantity'] == 3
+
+def test_points_follow_the_carbon_saved_for_the_whole_quantity(catalog_db):
+    lines = [{'product_id': 1, 'quantity': 3}, {'product_id': 3, 'quantity': 1}, {'product_id': 5, 'quantity': 4}]
+    results, pairs = plan_batch_recommendations(lines)
+    payload = summarize_batch_recommendations(results, ['reason'] * len(pairs))
+
+    recommended = [r for r in payload['recommendations'] if r.get('alternative')]
+    assert recommended
+    for result in recommended:
+        assert result['carbon_saved'] == estimate_carbon_savings(result['original'], result['alternative'])
+        assert result['points_awarded'] == int(result['carbon_saved'] * result['quantity'] * 10)
+    assert payload['total_points_awarded'] == sum(r['points_awarded'] for r in recommended)
+    assert payload['total_carbon_saved'] == pytest.approx(sum(r['carbon_saved'] * r['quantity'] for r in recommended))
+    assert payload['total_points_awarded'] == pytest.approx(payload['total_carbon_saved'] * 10, abs=len(recommended))
+
+def test_unknown_products_are_reported_without_points(catalog_db):
+    results, pairs = plan_batch_recommendations([{'product_id': 999, 'quantity': 1}])
+    assert results == [{'product_id': 999, 'error': 'Product not found'}]
+    assert pairs == []
+    assert summarize_batch_recommendations(results, [])['total_points_awarded'] == 0
+
+@pytest.fixture(params=['client', 'asgi_client'])
+def any_client(request):
+    """The WSGI and ASGI apps validate the batch body the same way"""
+    return request.getfixturevalue(request.param)
+
+@pytest.mark.parametrize('body, message', [
+    ({'product_ids': [1, '3', {}]}, 'product_ids must be a list of integers'),
+    ({'product_ids': [1, True]}, 'product_ids must be a list of integers'),
+    ({'product_ids': [1.0]}, 'product_ids must be a list of integers'),
+    ({'product_ids': '1,2'}, 'product_ids must be a list'),
+    ({'user_id': 'me'}, 'user_id must be an integer'),
+    ({}, 'Provide product_ids or user_id'),
+    ([1, 2], 'Provide product_ids or user_id'),
+])
+def test_malformed_bodies_are_rejected(any_client, body, message):
+    response = any_client.post('/api/recommendations/batch', json=body)
+    assert response.status_code == 400
+    # Flask's test response has a json property, httpx's a json() method
+    payload = response.json() if callable(response.json) else response.json
+    assert payload['error'] == message
+
+def test_integer_product_ids_are_accepted(any_client):
+    response = any_client.post('/api/recommendations/batch', json={'product_ids': [1, 999]})
+    assert response.status_code == 200
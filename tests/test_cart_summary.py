@@ -0,0 +1,76 @@
+import pytest
+
+import db
+
+USER_ID = 1
+
+@pytest.fixture
+def summaries(catalog_db, monkeypatch):
+    """(stored, aggregated): the maintained cart_summary rows and a fresh SUM() over the cart"""
+    def read():
+        stored = db.get_cart_summary(USER_ID)
+        with monkeypatch.context() as patch:
+            patch.setattr(db, 'CART_SUMMARY_TABLE', False)
+            aggregated = db.get_cart_summary(USER_ID)
+        return stored, aggregated
+    return read
+
+def write_product(sql, params):
+    """A product write as the app makes one: the catalog version moves with it"""
+    with db.get_db_connection() as conn:
+        conn.execute(sql, params)
+        db.bump_catalog_version(conn)
+        conn.commit()
+
+def test_empty_cart(summaries):
+    stored, aggregated = summaries()
+    assert stored == aggregated
+    assert stored['item_count'] == 0
+
+def test_new_lines_and_added_quantities(summaries):
+    for product_id, quantity in [(1, 2), (4, 1), (6, 3)]:
+        db.add_to_cart(USER_ID, product_id, quantity)
+        stored, aggregated = summaries()
+        assert stored == aggregated
+
+    # Adding to an existing line only changes its quantity
+    db.add_to_cart(USER_ID, 1, 5)
+    stored, aggregated = summaries()
+    assert stored == aggregated
+    assert (stored['line_count'], stored['item_count']) == (3, 11)
+    assert set(stored['by_category']) == {'meat', 'dairy'}
+
+def test_product_update_is_reflected(summaries):
+    db.add_to_cart(USER_ID, 1, 2)
+    db.add_to_cart(USER_ID, 6, 1)
+    summaries()
+    write_product('UPDATE products SET price = price + 10, carbon_kg = 0.5, packaging = ?, is_organic = 1 '
+                  'WHERE id = ?', ('glass', 1))
+    stored, aggregated = summaries()
+    assert stored == aggregated
+    assert stored['organic_items'] == 3
+    assert stored['by_packaging']['glass']['item_count'] == 3
+
+def test_deleted_product_drops_out(summaries):
+    db.add_to_cart(USER_ID, 1, 2)
+    db.add_to_cart(USER_ID, 6, 1)
+    summaries()
+    write_product('DELETE FROM products WHERE id = ?', (6,))
+    stored, aggregated = summaries()
+    assert stored == aggregated
+    assert (stored['line_count'], stored['item_count']) == (1, 2)
+
+def test_clear_cart(summaries):
+    db.add_to_cart(USER_ID, 1, 2)
+    db.add_to_cart(2, 1, 1)
+    db.clear_cart(USER_ID)
+    stored, aggregated = summaries()
+    assert stored == aggregated
+    assert stored['item_count'] == 0
+    assert db.get_cart_summary(2)['item_count'] == 1
+
+def test_unknown_product_is_not_counted(summaries):
+    db.add_to_cart(USER_ID, 999, 1)
+    stored, aggregated = summaries()
+    assert stored == aggregated
+    assert stored['item_count'] == 0
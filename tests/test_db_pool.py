@@ -0,0 +1,75 @@
+import os
+import sqlite3
+import threading
+
+import pytest
+
+import db
+
+def test_released_connection_is_reused(baseline_db):
+    pool = db.ConnectionPool(baseline_db, size=2)
+    conn = pool.acquire()
+    pool.release(conn)
+    assert pool.acquire() is conn
+    stats = pool.stats()
+    assert (stats['misses'], stats['hits'], stats['open'], stats['in_use']) == (1, 1, 1, 1)
+
+def test_connections_use_wal(baseline_db):
+    pool = db.ConnectionPool(baseline_db, size=1)
+    conn = pool.acquire()
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    pool.release(conn)
+
+def test_full_pool_waits_for_a_release(baseline_db):
+    pool = db.ConnectionPool(baseline_db, size=1, timeout=5)
+    conn = pool.acquire()
+    threading.Timer(0.05, pool.release, (conn,)).start()
+    assert pool.acquire() is conn
+    assert pool.stats()['waits'] == 1
+
+def test_full_pool_times_out(baseline_db):
+    pool = db.ConnectionPool(baseline_db, size=1, timeout=0.05)
+    pool.acquire()
+    with pytest.raises(sqlite3.OperationalError):
+        pool.acquire()
+    assert pool.stats()['timeouts'] == 1
+
+def test_released_transaction_is_rolled_back(baseline_db):
+    pool = db.ConnectionPool(baseline_db, size=1)
+    conn = pool.acquire()
+    conn.execute('DELETE FROM products')
+    pool.release(conn)
+    conn = pool.acquire()
+    assert conn.execute('SELECT COUNT(*) FROM products').fetchone()[0] > 0
+
+def test_get_db_connection_follows_db_path(baseline_db, tmp_path, monkeypatch):
+    with db.get_db_connection() as conn:
+        first = conn
+    other = str(tmp_path / 'other.db')
+    monkeypatch.setattr(db, 'DB_PATH', other)
+    with db.get_db_connection() as conn:
+        assert conn is not first
+        assert db.get_pool_stats()['path'] == other
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+def test_forked_child_opens_its_own_connections(baseline_db):
+    pool = db.ConnectionPool(baseline_db, size=1, timeout=0.5)
+    parent_conn = pool.acquire()  # the parent's only slot stays in use across the fork
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            conn = pool.acquire()
+            count = conn.execute('SELECT COUNT(*) FROM products').fetchone()[0]
+            stats = pool.stats()
+            pool.release(conn)
+            if conn is not parent_conn and count > 0 and stats['open'] == 1 and stats['waits'] == 0:
+                code = 0
+        finally:
+            os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+
+    pool.release(parent_conn)
+    assert pool.acquire() is parent_conn
+    assert pool.stats()['open'] == 1
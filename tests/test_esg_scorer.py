@@ -0,0 +1,46 @@
+import random
+
+import numpy as np
+
+import db
+from recommender import ESGScorer
+
+def synthetic_products(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    packaging = list(ESGScorer.PACKAGING_SCORES) + ['Glass', 'PLASTIC', 'unknown', '']
+    products = []
+    for i in range(count):
+        products.append({
+            'id': i,
+            'is_organic': rng.random() < 0.5,
+            'packaging': rng.choice(packaging),
+            # Include the carbon thresholds and non-positive prices
+            'carbon_kg': rng.choice([0.0, 0.99, 1.0, 1.99, 2.0, 4.0, 4.01, round(rng.uniform(0, 8), 2)]),
+            'price': rng.choice([0.0, -1.0, 0.01, 1.0, round(rng.uniform(0.5, 50), 2)]),
+        })
+    return products
+
+def assert_matches_scalar(products):
+    scores, grades = ESGScorer.score_products(products)
+    expected = [ESGScorer.calculate_sustainability_score(p) for p in products]
+    assert scores.tolist() == expected
+    assert grades.tolist() == [ESGScorer.get_sustainability_grade(s) for s in expected]
+
+def test_vectorized_scores_equal_scalar_scores():
+    assert_matches_scalar(synthetic_products(20000))
+
+def test_vectorized_scores_equal_scalar_scores_for_the_catalog(catalog_db):
+    assert_matches_scalar(db.get_all_products())
+
+def test_integer_packaging_codes_match_names():
+    products = synthetic_products(1000, seed=1)
+    columns = ([p['is_organic'] for p in products], [p['packaging'] for p in products],
+               [p['carbon_kg'] for p in products], [p['price'] for p in products])
+    by_name = ESGScorer.calculate_sustainability_scores(*columns)
+    by_code = ESGScorer.calculate_sustainability_scores(columns[0], ESGScorer.encode_packaging(columns[1]),
+                                                        *columns[2:])
+    assert np.array_equal(by_name, by_code)
+
+def test_rounding_ties_follow_python_round():
+    values = np.array([0.125, 0.135, 2.675, -1.005, 1.115, 10.0 / 3])
+    assert ESGScorer._round2(values).tolist() == [round(v, 2) for v in values.tolist()]
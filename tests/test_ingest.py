@@ -0,0 +1,103 @@
+import csv
+
+import pytest
+
+import db
+import ingest
+from ingest import ingest_file, ingest_products
+from recommender import ESGScorer, scoring_version
+
+FIELDS = ['sku', 'name', 'description', 'category', 'packaging', 'is_organic', 'carbon_kg', 'price']
+
+def product_indexes():
+    with db.get_db_connection() as conn:
+        return {row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='products' AND sql IS NOT NULL")}
+
+def products_by_sku():
+    with db.get_db_connection() as conn:
+        rows = conn.execute('SELECT * FROM products WHERE supplier_sku IS NOT NULL').fetchall()
+    return {row['supplier_sku']: dict(row) for row in rows}
+
+def tea(i, **changes):
+    row = {'sku': f'T-{i}', 'name': f'Tea {i}', 'description': 'Loose leaf', 'category': 'Tea',
+           'packaging': 'paper', 'is_organic': 'yes', 'carbon_kg': '0.8', 'price': '4.5'}
+    row.update(changes)
+    return row
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    return str(path)
+
+def test_rows_are_upserted_by_supplier_sku(catalog_db, tmp_path):
+    before = db.get_catalog_version()
+    stats = ingest_file(write_csv(tmp_path / 'first.csv', [tea(1), tea(2)]))
+    assert (stats['rows_written'], stats['rows_invalid']) == (2, 0)
+    total = len(db.get_all_products())
+
+    stats = ingest_file(write_csv(tmp_path / 'second.csv', [tea(1, price='9.0', packaging='glass'), tea(3)]))
+    assert stats['rows_written'] == 2
+    products = products_by_sku()
+    assert len(db.get_all_products()) == total + 1
+    assert (products['T-1']['price'], products['T-1']['packaging']) == (9.0, 'glass')
+    assert products['T-1']['category'] == 'tea'
+    assert db.get_catalog_version() > before
+
+def test_stored_scores_are_precomputed(catalog_db):
+    ingest_products([tea(1), tea(2, packaging='plastic', is_organic='no', carbon_kg='5', price='1')])
+    for product in products_by_sku().values():
+        score = ESGScorer.calculate_sustainability_score(product)
+        assert product['esg_score'] == score
+        assert product['esg_grade'] == ESGScorer.get_sustainability_grade(score)
+        assert product['esg_version'] == scoring_version()
+
+def test_invalid_rows_are_skipped(catalog_db):
+    rows = [tea(1), tea(2, sku=''), tea(3, carbon_kg='nan'), tea(4, price='-1'), tea(5, name=''),
+            tea(6, is_organic='maybe')]
+    stats = ingest_products(rows)
+    assert (stats['rows_read'], stats['rows_written'], stats['rows_invalid']) == (6, 1, 5)
+    assert set(products_by_sku()) == {'T-1'}
+
+def test_missing_sku_rows_are_inserted_only_when_allowed(catalog_db):
+    total = len(db.get_all_products())
+    ingest_products([tea(1, sku='')], allow_missing_sku=True)
+    ingest_products([tea(1, sku='')], allow_missing_sku=True)
+    assert len(db.get_all_products()) == total + 2
+
+def test_secondary_indexes_are_dropped_during_the_load_and_restored(catalog_db):
+    indexes = product_indexes()
+    assert set(db.PRODUCT_INDEXES) <= indexes
+    seen = []
+
+    def rows():
+        yield tea(1)
+        seen.append(product_indexes())
+        yield tea(2)
+
+    ingest_products(rows(), chunk_size=1)
+    assert seen[0] == ingest.REQUIRED_INDEXES
+    assert product_indexes() == indexes
+
+def test_indexes_are_restored_after_a_failed_load(catalog_db):
+    indexes = product_indexes()
+
+    def rows():
+        yield tea(1)
+        yield tea(2)
+        raise RuntimeError('feed dropped')
+
+    with pytest.raises(RuntimeError):
+        ingest_products(rows(), chunk_size=1, transaction_rows=1)
+    assert product_indexes() == indexes
+    # Transactions committed before the failure are kept
+    assert set(products_by_sku()) == {'T-1', 'T-2'}
+
+def test_ensure_schema_recreates_indexes_left_missing(catalog_db):
+    with db.get_db_connection() as conn:
+        conn.execute('DROP INDEX idx_products_category_score')
+        conn.commit()
+    db.ensure_schema()
+    assert 'idx_products_category_score' in product_indexes()
@@ -0,0 +1,61 @@
+import sqlite3
+
+import pytest
+
+import db
+
+def index_names(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+
+@pytest.fixture
+def duplicate_cart(baseline_db):
+    """Baseline database whose cart has the duplicate lines the old add_to_cart wrote"""
+    with sqlite3.connect(baseline_db) as conn:
+        conn.executemany('INSERT INTO cart (user_id, product_id, quantity) VALUES (?, ?, ?)',
+                         [(1, 1, 2), (1, 2, 1), (1, 1, 3), (2, 1, 1), (1, 1, 1)])
+    return baseline_db
+
+def test_baseline_is_upgraded_to_the_latest_version(duplicate_cart):
+    db.ensure_schema()
+    with db.get_db_connection() as conn:
+        assert db.get_schema_version(conn) == db.SCHEMA_VERSION == db.MIGRATIONS[-1][0]
+        indexes = index_names(conn)
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    assert {'idx_cart_user_product', 'idx_users_name', 'idx_reason_cache_expires'} <= indexes
+    assert set(db.PRODUCT_INDEXES) <= indexes
+    assert {'reason_cache', 'catalog_meta', 'response_cache', 'cart_summary', 'product_alternatives',
+            'alternative_categories', 'recommendation_reasons'} <= tables
+    assert db.get_catalog_version() == 0
+
+def test_duplicate_cart_lines_are_merged_into_the_oldest(duplicate_cart):
+    with sqlite3.connect(duplicate_cart) as conn:
+        first_id = conn.execute('SELECT MIN(id) FROM cart WHERE user_id=1 AND product_id=1').fetchone()[0]
+    db.ensure_schema()
+    with db.get_db_connection() as conn:
+        rows = [tuple(row) for row in conn.execute('SELECT id, user_id, product_id, quantity FROM cart ORDER BY id')]
+        assert rows[0] == (first_id, 1, 1, 6)
+        assert [row[1:] for row in rows] == [(1, 1, 6), (1, 2, 1), (2, 1, 1)]
+        with pytest.raises(sqlite3.IntegrityError):
+            conn.execute('INSERT INTO cart (user_id, product_id, quantity) VALUES (1, 1, 1)')
+
+def test_cart_summary_is_built_from_the_merged_cart(duplicate_cart):
+    db.ensure_schema()
+    summary = db.get_cart_summary(1)
+    assert (summary['line_count'], summary['item_count']) == (2, 7)
+
+def test_migrations_are_idempotent(duplicate_cart):
+    db.ensure_schema()
+    with db.get_db_connection() as conn:
+        before = [tuple(row) for row in conn.execute('SELECT * FROM cart ORDER BY id')]
+    db.ensure_schema()
+    with db.get_db_connection() as conn:
+        assert db.get_schema_version(conn) == db.SCHEMA_VERSION
+        assert [tuple(row) for row in conn.execute('SELECT * FROM cart ORDER BY id')] == before
+
+def test_each_migration_applies_on_top_of_the_previous(baseline_db, monkeypatch):
+    migrations = db.MIGRATIONS
+    for count in range(1, len(migrations) + 1):
+        monkeypatch.setattr(db, 'MIGRATIONS', migrations[:count])
+        db.run_migrations()
+        with db.get_db_connection() as conn:
+            assert db.get_schema_version(conn) == migrations[count - 1][0]
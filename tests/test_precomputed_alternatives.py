@@ -0,0 +1,98 @@
+import pytest
+
+import db
+import recommender
+from ingest import ingest_products
+
+@pytest.fixture
+def live_alternative(monkeypatch):
+    """find_greener_alternative answered by the live (indexed SQL) lookup"""
+    def find(product):
+        with monkeypatch.context() as patch:
+            patch.setattr(recommender, 'PRECOMPUTED_ALTERNATIVES', False)
+            alternative = recommender.find_greener_alternative(product)
+        return alternative['id'] if alternative else None
+    return find
+
+def assert_matches_live(live_alternative):
+    products = db.get_all_products()
+    assert products
+    for product in products:
+        precomputed = db.get_precomputed_alternative(product['id'])
+        assert precomputed is not None, f"no fresh row for product {product['id']}"
+        alternative = precomputed[0]
+        assert (alternative['id'] if alternative else None) == live_alternative(product)
+
+def write_products(sql, params, changed_id=None):
+    """A product write as the app makes one: an updated row's stored score and
+    the catalog version change in the same transaction (inserted rows are
+    scored by the change listener)"""
+    with db.get_db_connection() as conn:
+        cursor = conn.execute(sql, params)
+        if changed_id is not None:
+            row = conn.execute('SELECT is_organic, packaging, carbon_kg, price FROM products WHERE id = ?',
+                               (changed_id,)).fetchone()
+            score = recommender.ESGScorer.calculate_sustainability_score(dict(row))
+            conn.execute('UPDATE products SET esg_score = ?, esg_grade = ?, esg_version = ? WHERE id = ?',
+                         (score, recommender.ESGScorer.get_sustainability_grade(score),
+                          recommender.scoring_version(), changed_id))
+        db.bump_catalog_version(conn)
+        conn.commit()
+    return cursor.lastrowid
+
+def category_of(product_id):
+    return db.get_product_by_id(product_id)['category']
+
+def test_built_table_matches_live_lookup(catalog_db, live_alternative):
+    assert db.get_stale_alternative_categories() == []
+    assert_matches_live(live_alternative)
+
+def test_update_marks_only_its_categories_stale(catalog_db, live_alternative):
+    category = category_of(1)
+    write_products("UPDATE products SET is_organic = 1, packaging = 'glass', carbon_kg = 0.2 WHERE id = ?", (1,), 1)
+    assert db.get_stale_alternative_categories() == [category]
+    # Rows of a stale category are not served
+    assert db.get_precomputed_alternative(1) is None
+    other = next(p for p in db.get_all_products() if p['category'] != category)
+    assert db.get_precomputed_alternative(other['id']) is not None
+
+    db.notify_product_changes([1])
+    assert db.get_stale_alternative_categories() == []
+    assert_matches_live(live_alternative)
+    # Product 1 is now the best of its category
+    assert db.get_precomputed_alternative(1)[0] is None
+
+def test_category_change_marks_both_categories(catalog_db, live_alternative):
+    old = category_of(5)
+    new = next(p['category'] for p in db.get_all_products() if p['category'] != old)
+    write_products('UPDATE products SET category = ? WHERE id = ?', (new, 5), 5)
+    assert sorted(db.get_stale_alternative_categories()) == sorted([old, new])
+    db.notify_product_changes([5])
+    assert_matches_live(live_alternative)
+
+def test_insert_and_delete(catalog_db, live_alternative):
+    category = category_of(2)
+    product_id = write_products('''INSERT INTO products (name, description, category, packaging, is_organic,
+                                                         carbon_kg, price) VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                                ('Greenest', 'Organic', category, 'glass', 1, 0.1, 1.0))
+    assert db.get_stale_alternative_categories() == [category]
+    db.notify_product_changes([product_id])
+    assert_matches_live(live_alternative)
+    assert db.get_precomputed_alternative(2)[0]['id'] == product_id
+
+    write_products('DELETE FROM products WHERE id = ?', (product_id,))
+    assert db.get_stale_alternative_categories() == [category]
+    db.notify_product_changes([product_id])
+    assert_matches_live(live_alternative)
+
+def test_bulk_ingestion_marks_categories_stale(catalog_db, live_alternative):
+    rows = [{'sku': f'T-{i}', 'name': f'Tea {i}', 'category': 'tea', 'packaging': packaging,
+             'is_organic': i % 2, 'carbon_kg': 1.5 - i * 0.1, 'price': 3 + i}
+            for i, packaging in enumerate(['plastic', 'paper', 'glass'])]
+    rows.append({'sku': 'M-1', 'name': 'Meat', 'category': category_of(1), 'packaging': 'glass',
+                 'is_organic': 1, 'carbon_kg': 0.5, 'price': 2})
+    ingest_products(rows, defer_indexes=False)
+    # ingest notifies listeners, which rebuild what the triggers marked
+    assert db.get_stale_alternative_categories() == []
+    assert 'tea' in db.get_alternative_categories()
+    assert_matches_live(live_alternative)
@@ -0,0 +1,54 @@
+import google.generativeai as genai
+import pytest
+
+import db
+import gemini
+import gemini_stub
+import pregenerate
+from gemini_stub import StubModel
+from upstream import UpstreamGuard
+
+STUB_REASON = 'Stub reason: the alternative is the greener choice.'
+
+@pytest.fixture
+def stub(catalog_db, monkeypatch):
+    """gemini.py routed to a StubModel with the pinned client's signature"""
+    model = StubModel(latency=0.0)
+    monkeypatch.setenv('GEMINI_API_KEY', gemini_stub.STUB_API_KEY)
+    monkeypatch.setattr(gemini, '_model', model)
+    monkeypatch.setattr(gemini, '_model_api_key', gemini_stub.STUB_API_KEY)
+    monkeypatch.setattr(gemini, 'gemini_guard', UpstreamGuard('test', budget=5, max_concurrency=4,
+                                                              failure_threshold=5, reset_timeout=60))
+    return model
+
+def run(*args):
+    pregenerate.main(['--rate', '0', '--retries', '0', '--progress-every', '0', *args])
+
+def test_stored_reasons_are_served_by_the_recommendation_endpoint(stub, client, monkeypatch):
+    run()
+    assert stub.calls > 0
+    assert db.count_stored_reasons() == stub.calls
+    # Every call went through the real client's request builder unchanged
+    model = genai.GenerativeModel(gemini.GEMINI_MODEL_NAME)
+    for kwargs in stub.call_kwargs:
+        model._prepare_request(contents='prompt', **kwargs)
+
+    # Served without a key, the cache emptied: only the stored table can answer
+    monkeypatch.delenv('GEMINI_API_KEY')
+    gemini.reason_cache.clear()
+    response = client.post('/api/recommendation', json={'product_id': 1})
+    assert response.status_code == 200
+    assert response.get_json()['reason'] == STUB_REASON
+
+def test_resumed_run_generates_nothing(stub):
+    run()
+    calls = stub.calls
+    run()
+    assert stub.calls == calls
+
+def test_exits_non_zero_when_no_reason_is_stored(stub):
+    stub.failing = True
+    with pytest.raises(SystemExit) as raised:
+        run()
+    assert raised.value.code == 1
+    assert db.count_stored_reasons() == 0
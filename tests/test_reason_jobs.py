@@ -0,0 +1,62 @@
+import time
+
+import pytest
+
+import db
+import gemini
+import gemini_stub
+from gemini import ReasonJobs, get_fallback_reason
+from gemini_stub import StubModel
+from upstream import UpstreamGuard
+
+@pytest.fixture
+def pair(catalog_db):
+    return db.get_product_by_id(1), db.get_product_by_id(2)
+
+@pytest.fixture
+def stub(catalog_db, monkeypatch):
+    model = StubModel(latency=0.3)
+    monkeypatch.setenv('GEMINI_API_KEY', gemini_stub.STUB_API_KEY)
+    monkeypatch.setattr(gemini, '_model', model)
+    monkeypatch.setattr(gemini, '_model_api_key', gemini_stub.STUB_API_KEY)
+    monkeypatch.setattr(gemini, 'gemini_guard', UpstreamGuard('test', budget=5, max_concurrency=4,
+                                                              failure_threshold=5, reset_timeout=60))
+    return model
+
+def workers(**kwargs):
+    """Two job registries sharing the database, as two gunicorn workers do"""
+    return ReasonJobs(shared=True, **kwargs), ReasonJobs(shared=True, **kwargs)
+
+def test_pending_job_is_pending_on_another_worker(stub, pair):
+    first, second = workers()
+    job_id = first.submit(*pair)
+    assert second.result(job_id) == {'status': 'pending', 'reason': None}
+    result = second.result(job_id, wait=2)
+    assert result == {'status': 'ready', 'reason': 'Stub reason: the alternative is the greener choice.'}
+    # Submitting the same pair on the other worker doesn't generate it again
+    second.submit(*pair)
+    assert stub.calls == 1
+
+def test_fallback_text_is_shared_without_an_api_key(pair, monkeypatch):
+    monkeypatch.delenv('GEMINI_API_KEY', raising=False)
+    first, second = workers()
+    job_id = first.submit(*pair)
+    assert second.result(job_id, wait=2) == {'status': 'ready', 'reason': get_fallback_reason(*pair)}
+
+def test_abandoned_job_times_out_to_the_fallback(stub, pair):
+    first, second = workers(timeout=0.1)
+    job_id = first.submit(*pair)
+    result = second.result(job_id, wait=1)
+    assert result == {'status': 'timeout', 'reason': get_fallback_reason(*pair)}
+    # Let the late generation finish before the next test resets the caches
+    first._jobs[job_id]['future'].result(timeout=2)
+
+def test_unknown_and_expired_jobs_are_not_found(pair, monkeypatch):
+    # Without a key the result is fallback text, which only the job row holds
+    monkeypatch.delenv('GEMINI_API_KEY', raising=False)
+    first, second = workers(ttl=0.2)
+    assert second.result('1:2:0000000000000000') is None
+    job_id = first.submit(*pair)
+    assert second.result(job_id, wait=2)['status'] == 'ready'
+    time.sleep(0.25)
+    assert second.result(job_id) is None
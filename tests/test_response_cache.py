@@ -0,0 +1,102 @@
+import gzip
+import json
+
+import pytest
+
+import db
+from response_cache import GZIP_MIN_BYTES, CachedResponse, ResponseCache, catalog_etag, response_cache
+
+GZIP = {'Accept-Encoding': 'gzip, deflate'}
+
+def write_product(sql, params):
+    """A product write as the app makes one: the catalog version moves with it"""
+    with db.get_db_connection() as conn:
+        conn.execute(sql, params)
+        db.bump_catalog_version(conn)
+        conn.commit()
+
+# --- CachedResponse / ResponseCache ---
+def test_large_bodies_are_gzipped_once():
+    body = json.dumps([{'id': i, 'name': 'x' * 20} for i in range(100)]).encode('utf-8')
+    entry = CachedResponse(body, catalog_etag(1, '/api/products?'))
+    assert gzip.decompress(entry.gzip_body) == body
+    gzipped, gzip_etag, encoding = entry.variant(accept_gzip=True)
+    plain, plain_etag, no_encoding = entry.variant(accept_gzip=False)
+    assert (gzipped, encoding) == (entry.gzip_body, 'gzip')
+    assert (plain, no_encoding) == (body, None)
+    assert gzip_etag != plain_etag and gzip_etag.endswith('-gzip"')
+
+def test_small_bodies_are_not_gzipped():
+    entry = CachedResponse(b'x' * (GZIP_MIN_BYTES - 1), '"c1-a"')
+    assert entry.gzip_body is None
+    assert entry.variant(accept_gzip=True) == (entry.body, '"c1-a"', None)
+
+def test_version_change_drops_entries():
+    cache = ResponseCache(shared=False)
+    cache.put('/api/products?', 1, b'[]')
+    assert cache.get('/api/products?', 1).body == b'[]'
+    assert cache.get('/api/products?', 2) is None
+    assert cache.get('/api/products?', 1) is None
+
+def test_shared_tier_serves_other_processes(catalog_db):
+    writer, reader = ResponseCache(shared=True), ResponseCache(shared=True)
+    body = b'[' + b'0,' * GZIP_MIN_BYTES + b'0]'
+    stored = writer.put('/api/products?', 3, body)
+    entry = reader.get('/api/products?', 3)
+    assert (entry.body, entry.gzip_body, entry.etag) == (body, stored.gzip_body, stored.etag)
+    assert reader.stats()['shared_hits'] == 1
+    # Rows of older versions are dropped as newer ones are written
+    writer.put('/api/products?', 4, b'[]')
+    assert ResponseCache(shared=True).get('/api/products?', 3) is None
+
+# --- Product routes ---
+def test_gzip_and_identity_responses_carry_their_own_etags(client):
+    plain = client.get('/api/products')
+    gzipped = client.get('/api/products', headers=GZIP)
+    assert plain.status_code == gzipped.status_code == 200
+    assert 'Content-Encoding' not in plain.headers
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(gzipped.data) == plain.data
+    assert gzipped.headers['ETag'] != plain.headers['ETag']
+    assert plain.headers['Vary'] == gzipped.headers['Vary'] == 'Accept-Encoding'
+
+@pytest.mark.parametrize('headers', [{}, GZIP])
+def test_matching_etag_is_not_modified(client, headers):
+    etag = client.get('/api/products', headers=headers).headers['ETag']
+    not_modified = response_cache.stats()['not_modified']
+    response = client.get('/api/products', headers={**headers, 'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+    assert response_cache.stats()['not_modified'] == not_modified + 1
+
+def test_other_encodings_etag_is_not_a_match(client):
+    plain_etag = client.get('/api/products').headers['ETag']
+    response = client.get('/api/products', headers={**GZIP, 'If-None-Match': plain_etag})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+
+def test_small_response_is_sent_uncompressed(client):
+    response = client.get('/api/products/1', headers=GZIP)
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response.headers
+    etag = response.headers['ETag']
+    # The client is sent the identity tag, and revalidating with it works
+    assert client.get('/api/products/1', headers={**GZIP, 'If-None-Match': etag}).status_code == 304
+
+def test_catalog_change_invalidates_cached_responses(client):
+    first = client.get('/api/products/1')
+    etag = first.headers['ETag']
+    write_product('UPDATE products SET price = price + 1 WHERE id = ?', (1,))
+    response = client.get('/api/products/1', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert response.get_json()['price'] == pytest.approx(first.get_json()['price'] + 1)
+
+def test_asgi_app_revalidates_the_same_way(asgi_client):
+    gzipped = asgi_client.get('/api/products', headers=GZIP)
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    etag = gzipped.headers['ETag']
+    assert asgi_client.get('/api/products', headers={**GZIP, 'If-None-Match': etag}).status_code == 304
+    assert asgi_client.get('/api/products', headers={'Accept-Encoding': 'identity',
+                                                     'If-None-Match': etag}).status_code == 200
@@ -0,0 +1,141 @@
+import gzip
+
+import pytest
+
+import static_assets
+from static_assets import IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL, StaticAssets
+
+INDEX = b'<!doctype html><div id="root"></div>'
+BUNDLE = b'console.log("greener choices");\n' * 200
+STYLES = b'body { margin: 0; }\n' * 100
+GZIP = {'Accept-Encoding': 'gzip'}
+
+@pytest.fixture
+def build(tmp_path):
+    """A frontend build: index.html, a fingerprinted bundle and a precompressed stylesheet"""
+    (tmp_path / 'static' / 'js').mkdir(parents=True)
+    (tmp_path / 'static' / 'css').mkdir()
+    (tmp_path / 'index.html').write_bytes(INDEX)
+    (tmp_path / 'static' / 'js' / 'main.1a2b3c4d.js').write_bytes(BUNDLE)
+    (tmp_path / 'static' / 'css' / 'main.css').write_bytes(STYLES)
+    (tmp_path / 'static' / 'css' / 'main.css.gz').write_bytes(gzip.compress(STYLES, mtime=0))
+    return tmp_path
+
+@pytest.fixture
+def assets(build):
+    return StaticAssets(str(build))
+
+def respond(assets, path, method='GET', **headers):
+    status, response_headers, body = assets.respond(path, {k.replace('_', '-'): v for k, v in headers.items()},
+                                                    method)
+    return status, dict(response_headers), body
+
+# --- Manifest ---
+def test_precompressed_files_are_variants_not_assets(assets):
+    assert set(assets.load()) == {'index.html', 'static/js/main.1a2b3c4d.js', 'static/css/main.css'}
+
+def test_client_routes_get_index_and_missing_files_404(assets):
+    assert assets.lookup('/').path == 'index.html'
+    assert assets.lookup('/cart/checkout').path == 'index.html'
+    assert assets.lookup('/static/js/missing.js') is None
+    assert assets.respond('/static/js/missing.js', {}) is None
+
+def test_fingerprinted_assets_are_immutable(assets):
+    assert respond(assets, '/static/js/main.1a2b3c4d.js')[1]['Cache-Control'] == IMMUTABLE_CACHE_CONTROL
+    assert respond(assets, '/index.html')[1]['Cache-Control'] == REVALIDATE_CACHE_CONTROL
+    assert respond(assets, '/static/css/main.css')[1]['Cache-Control'] == REVALIDATE_CACHE_CONTROL
+
+# --- Content negotiation ---
+def test_gzip_is_negotiated(assets):
+    status, headers, body = respond(assets, '/static/js/main.1a2b3c4d.js', **GZIP)
+    assert status == 200
+    assert headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(body) == BUNDLE
+    assert headers['ETag'].endswith('-gzip"')
+    assert headers['Vary'] == 'Accept-Encoding'
+    assert 'Accept-Ranges' not in headers
+
+@pytest.mark.parametrize('accept', [None, 'gzip;q=0', 'identity'])
+def test_identity_when_gzip_is_not_accepted(assets, accept):
+    headers = {} if accept is None else {'Accept_Encoding': accept}
+    status, response_headers, body = respond(assets, '/static/js/main.1a2b3c4d.js', **headers)
+    assert (status, body) == (200, BUNDLE)
+    assert 'Content-Encoding' not in response_headers
+    assert response_headers['Accept-Ranges'] == 'bytes'
+
+def test_precompressed_file_is_served_as_written(assets, build):
+    _, headers, body = respond(assets, '/static/css/main.css', **GZIP)
+    assert headers['Content-Encoding'] == 'gzip'
+    assert body == (build / 'static' / 'css' / 'main.css.gz').read_bytes()
+
+def test_small_files_are_not_compressed(assets):
+    _, headers, body = respond(assets, '/index.html', **GZIP)
+    assert body == INDEX
+    assert 'Content-Encoding' not in headers and 'Vary' not in headers
+
+# --- Conditional requests ---
+def test_matching_etag_is_not_modified(assets):
+    _, headers, _ = respond(assets, '/static/js/main.1a2b3c4d.js', **GZIP)
+    etag = headers['ETag']
+    status, not_modified, body = respond(assets, '/static/js/main.1a2b3c4d.js', If_None_Match=etag, **GZIP)
+    assert (status, body) == (304, b'')
+    assert not_modified['ETag'] == etag
+    assert 'Content-Type' not in not_modified
+    # Weak comparison, and lists of tags
+    assert respond(assets, '/static/js/main.1a2b3c4d.js', If_None_Match=f'"other", W/{etag}', **GZIP)[0] == 304
+
+def test_other_encodings_etag_is_not_a_match(assets):
+    identity_etag = respond(assets, '/static/js/main.1a2b3c4d.js')[1]['ETag']
+    status, _, body = respond(assets, '/static/js/main.1a2b3c4d.js', If_None_Match=identity_etag, **GZIP)
+    assert status == 200 and gzip.decompress(body) == BUNDLE
+
+def test_if_modified_since(assets):
+    last_modified = respond(assets, '/index.html')[1]['Last-Modified']
+    assert respond(assets, '/index.html', If_Modified_Since=last_modified)[0] == 304
+    assert respond(assets, '/index.html', If_Modified_Since='Thu, 01 Jan 1970 00:00:00 GMT')[0] == 200
+
+# --- Byte ranges ---
+def test_single_range_is_partial_content_of_the_identity_body(assets):
+    status, headers, body = respond(assets, '/static/js/main.1a2b3c4d.js', Range='bytes=0-9', **GZIP)
+    assert status == 206
+    assert body == BUNDLE[:10]
+    assert headers['Content-Range'] == f'bytes 0-9/{len(BUNDLE)}'
+    assert 'Content-Encoding' not in headers
+
+def test_suffix_range(assets):
+    status, headers, body = respond(assets, '/index.html', Range='bytes=-5')
+    assert (status, body) == (206, INDEX[-5:])
+    assert headers['Content-Range'] == f'bytes {len(INDEX) - 5}-{len(INDEX) - 1}/{len(INDEX)}'
+
+def test_unsatisfiable_range(assets):
+    status, headers, body = respond(assets, '/index.html', Range=f'bytes={len(INDEX)}-')
+    assert (status, body) == (416, b'')
+    assert headers['Content-Range'] == f'bytes */{len(INDEX)}'
+
+@pytest.mark.parametrize('headers', [
+    {'Range': 'bytes=0-1, 4-5'},                      # multiple ranges
+    {'Range': 'bytes=0-9', 'If_Range': '"stale"'},    # the client's copy changed
+])
+def test_whole_body_instead_of_a_range(assets, headers):
+    assert respond(assets, '/index.html', **headers)[::2] == (200, INDEX)
+
+def test_if_range_with_the_current_etag(assets):
+    etag = respond(assets, '/index.html')[1]['ETag']
+    assert respond(assets, '/index.html', Range='bytes=0-4', If_Range=etag)[::2] == (206, INDEX[:5])
+
+def test_head_ignores_ranges(assets):
+    assert respond(assets, '/index.html', method='HEAD', Range='bytes=0-4')[0] == 200
+
+# --- Through the app ---
+def test_app_serves_the_build(build, client, monkeypatch):
+    monkeypatch.setattr(static_assets, 'static_assets', StaticAssets(str(build)))
+    import app
+    monkeypatch.setattr(app, 'static_assets', static_assets.static_assets)
+
+    bundle = client.get('/static/js/main.1a2b3c4d.js', headers=GZIP)
+    assert bundle.status_code == 200
+    assert gzip.decompress(bundle.data) == BUNDLE
+    assert client.get('/cart').data == INDEX
+    assert client.get('/static/js/missing.js').status_code == 404
+    partial = client.get('/index.html', headers={'Range': 'bytes=0-4'})
+    assert (partial.status_code, partial.data) == (206, INDEX[:5])
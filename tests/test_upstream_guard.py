@@ -0,0 +1,265 @@
+import asyncio
+import inspect
+import threading
+import time
+
+import google.generativeai as genai
+import pytest
+
+import db
+import gemini
+import gemini_stub
+from gemini_stub import StubError, StubModel
+from upstream import CircuitBreaker, UpstreamGuard, UpstreamUnavailable
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def call_stub(stub: StubModel, prompt: str = 'prompt'):
+    """The guarded function: one stub call"""
+    return lambda budget: stub.generate_content(prompt).text
+
+def run_concurrently(fn, count: int):
+    start = threading.Barrier(count)
+    results = [None] * count
+
+    def worker(i):
+        start.wait()
+        try:
+            results[i] = fn(i)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+# --- CircuitBreaker ---
+def test_breaker_opens_after_consecutive_failures():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()  # resets the count
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.opened == 1
+
+def test_half_open_allows_a_single_trial():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    clock.now = 9.9
+    assert not breaker.allow()
+    clock.now = 10
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()
+    # A trial that never reached the upstream lets another one through
+    breaker.release()
+    assert breaker.allow()
+
+def test_failed_trial_reopens_and_successful_trial_closes():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    clock.now = 10
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and breaker.opened == 2
+    assert not breaker.allow()
+
+    clock.now = 20
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() and breaker.allow()
+
+# --- UpstreamGuard ---
+def make_guard(budget=1.0, max_concurrency=4, failure_threshold=3, reset_timeout=0.2):
+    return UpstreamGuard('test', budget=budget, max_concurrency=max_concurrency,
+                         failure_threshold=failure_threshold, reset_timeout=reset_timeout)
+
+def test_identical_calls_share_one_upstream_call():
+    stub = StubModel(latency=0.1)
+    guard = make_guard()
+    results = run_concurrently(lambda i: guard.call('same', call_stub(stub)), 20)
+    assert stub.calls == 1
+    assert len(set(results)) == 1 and results[0].startswith('Stub reason')
+    stats = guard.stats()
+    assert (stats['calls'], stats['coalesced'], stats['upstream_calls']) == (20, 19, 1)
+    assert stats['in_flight'] == 0
+
+def test_concurrency_is_limited():
+    stub = StubModel(latency=0.05)
+    guard = make_guard(max_concurrency=3)
+    results = run_concurrently(lambda i: guard.call(f'key-{i}', call_stub(stub, f'prompt {i}')), 12)
+    assert all(isinstance(r, str) for r in results)
+    assert stub.calls == 12
+    assert stub.max_concurrent <= 3
+
+def test_callers_give_up_at_the_budget():
+    stub = StubModel(latency=0.5)
+    guard = make_guard(budget=0.1)
+    started = time.monotonic()
+    with pytest.raises(UpstreamUnavailable) as raised:
+        guard.call('slow', call_stub(stub))
+    assert raised.value.reason == 'timeout'
+    assert time.monotonic() - started < 0.4
+    assert guard.stats()['timeouts'] == 1
+
+def test_queued_calls_past_their_deadline_are_not_sent():
+    stub = StubModel(latency=0.3)
+    guard = make_guard(budget=0.1, max_concurrency=1, failure_threshold=100)
+    guard.submit('first', call_stub(stub, 'first'), budget=0.5)
+    queued = guard.submit('second', call_stub(stub, 'second'))
+    with pytest.raises(UpstreamUnavailable) as raised:
+        queued.result(timeout=2)
+    assert raised.value.reason == 'expired'
+    assert stub.calls == 1
+    assert guard.stats()['expired'] == 1
+
+def test_breaker_opens_on_errors_and_recovers():
+    stub = StubModel(latency=0.0)
+    guard = make_guard(failure_threshold=3, reset_timeout=0.2)
+    stub.failing = True
+    for i in range(3):
+        with pytest.raises(StubError):
+            guard.call(f'fail-{i}', call_stub(stub))
+    assert guard.breaker.state == CircuitBreaker.OPEN
+
+    # Open: fails fast without reaching the upstream
+    with pytest.raises(UpstreamUnavailable) as raised:
+        guard.call('rejected', call_stub(stub))
+    assert raised.value.reason == 'open'
+    assert stub.calls == 3
+
+    stub.failing = False
+    time.sleep(0.25)
+    assert guard.call('trial', call_stub(stub)).startswith('Stub reason')
+    assert guard.breaker.state == CircuitBreaker.CLOSED
+    stats = guard.stats()
+    assert (stats['failures'], stats['rejected'], stats['breaker_opened']) == (3, 1, 1)
+
+def test_slow_upstream_counts_as_failure():
+    guard = make_guard(budget=0.05, failure_threshold=2, reset_timeout=5)
+
+    def late(timeout):
+        # Ignores the deadline it was given and answers after it
+        time.sleep(timeout * 3)
+        return 'late'
+
+    for i in range(2):
+        with pytest.raises(UpstreamUnavailable):
+            guard.call(f'slow-{i}', late)
+    deadline = time.monotonic() + 2
+    while guard.breaker.state != CircuitBreaker.OPEN and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert guard.breaker.state == CircuitBreaker.OPEN
+    assert guard.stats()['slow'] == 2
+
+def test_hanging_upstream_opens_the_breaker_before_calls_return():
+    guard = make_guard(budget=0.05, failure_threshold=2, reset_timeout=5)
+    release = threading.Event()
+
+    def hang(budget):
+        release.wait(5)
+        return 'late'
+
+    try:
+        for i in range(2):
+            with pytest.raises(UpstreamUnavailable):
+                guard.call(f'hang-{i}', hang)
+        time.sleep(0.05)
+        stats = guard.stats()
+        assert stats['running'] == 2
+        assert guard.breaker.state == CircuitBreaker.OPEN
+        assert stats['slow'] == 2
+        with pytest.raises(UpstreamUnavailable) as raised:
+            guard.call('next', hang)
+        assert raised.value.reason == 'open'
+    finally:
+        release.set()
+    # Calls returning late are not counted a second time
+    deadline = time.monotonic() + 2
+    while guard.stats()['running'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert (guard.stats()['slow'], guard.stats()['failures'], guard.breaker.opened) == (2, 0, 1)
+
+def test_async_callers_share_the_flight():
+    stub = StubModel(latency=0.1)
+    guard = make_guard()
+
+    async def main():
+        return await asyncio.gather(*(guard.call_async('same', call_stub(stub)) for _ in range(10)))
+
+    results = asyncio.run(main())
+    assert stub.calls == 1
+    assert len(set(results)) == 1
+
+# --- Through get_gemini_reason ---
+def test_gemini_reason_burst_makes_one_upstream_call(catalog_db, monkeypatch):
+    stub = StubModel(latency=0.1)
+    monkeypatch.setenv('GEMINI_API_KEY', gemini_stub.STUB_API_KEY)
+    monkeypatch.setattr(gemini, '_model', stub)
+    monkeypatch.setattr(gemini, '_model_api_key', gemini_stub.STUB_API_KEY)
+    monkeypatch.setattr(gemini, 'gemini_guard', make_guard())
+    original, alternative = db.get_product_by_id(1), db.get_product_by_id(2)
+
+    reasons = run_concurrently(lambda i: gemini.get_gemini_reason(original, alternative), 10)
+    assert stub.calls == 1
+    assert set(reasons) == {'Stub reason: the alternative is the greener choice.'}
+    # Later calls are served from the reason cache
+    assert gemini.get_gemini_reason(original, alternative) == reasons[0]
+    assert stub.calls == 1
+
+def test_gemini_reason_falls_back_when_the_breaker_is_open(catalog_db, monkeypatch):
+    stub = StubModel(latency=0.0)
+    guard = make_guard(failure_threshold=1, reset_timeout=60)
+    monkeypatch.setenv('GEMINI_API_KEY', gemini_stub.STUB_API_KEY)
+    monkeypatch.setattr(gemini, '_model', stub)
+    monkeypatch.setattr(gemini, '_model_api_key', gemini_stub.STUB_API_KEY)
+    monkeypatch.setattr(gemini, 'gemini_guard', guard)
+    guard.breaker.record_failure()
+    original, alternative = db.get_product_by_id(3), db.get_product_by_id(4)
+
+    assert gemini.get_gemini_reason(original, alternative) == gemini.get_fallback_reason(original, alternative)
+    with pytest.raises(UpstreamUnavailable):
+        gemini.get_gemini_reason(original, alternative, fallback=False)
+    assert stub.calls == 0
+
+# --- Against the pinned client ---
+def parameters(fn):
+    return [(p.name, p.kind, p.default) for p in inspect.signature(fn).parameters.values()]
+
+def test_stub_signatures_match_the_pinned_client():
+    assert parameters(StubModel.generate_content) == parameters(genai.GenerativeModel.generate_content)
+    assert parameters(StubModel.generate_content_async) == parameters(genai.GenerativeModel.generate_content_async)
+
+def test_gemini_calls_are_accepted_by_the_pinned_client(catalog_db, monkeypatch):
+    stub = StubModel(latency=0.0)
+    monkeypatch.setattr(gemini, '_model', stub)
+    monkeypatch.setattr(gemini, '_model_api_key', gemini_stub.STUB_API_KEY)
+    pair = (db.get_product_by_id(1), db.get_product_by_id(2))
+    key = gemini.reason_cache_key(*pair)
+    gemini._generate_reason(gemini_stub.STUB_API_KEY, key, gemini.build_prompt(*pair))(1.0)
+    gemini._generate_batch(gemini_stub.STUB_API_KEY, [key], [pair])(1.0)
+    assert stub.calls == 2
+
+    model = genai.GenerativeModel(gemini.GEMINI_MODEL_NAME)
+    for kwargs in stub.call_kwargs:
+        inspect.signature(model.generate_content).bind('prompt', **kwargs)
+        # Extra keywords become GenerateContentRequest fields; unknown ones raise here
+        request_kwargs = {k: v for k, v in kwargs.items() if k != 'stream'}
+        model._prepare_request(contents='prompt', **request_kwargs)